@@ -1,56 +1,108 @@
 """
 Platformer Game
 """
+# Imported first, so the startup trace covers every other import
+from startup import startup_trace
+
+import argparse
 import arcade
 import os
+import threading
 import timeit
-import arcade.gui
-
-# Constants
-
-SCREEN_WIDTH = 1280  # 1000
-SCREEN_HEIGHT = 720  # 650
-SCREEN_TITLE = "Robot Platformer"
-
-# Constants used to scale our sprites from their original size
-TILE_SCALING = 0.5
-CHARACTER_SCALING = TILE_SCALING * 2
-COIN_SCALING = TILE_SCALING
-SPRITE_PIXEL_SIZE = 128
-GRID_PIXEL_SIZE = (SPRITE_PIXEL_SIZE * TILE_SCALING)
 
-# Movement speed of player, in pixels per frame
-PLAYER_MOVEMENT_SPEED = 8
-GRAVITY = 1.7
-PLAYER_JUMP_SPEED = 30
-
-# How many pixels to keep as a minimum margin between the character
-# and the edge of the screen.
-LEFT_VIEWPORT_MARGIN = 450
-RIGHT_VIEWPORT_MARGIN = 450
-BOTTOM_VIEWPORT_MARGIN = 150
-TOP_VIEWPORT_MARGIN = 100
+from assets import registry, MENU_TEXTURES, GAME_SOUNDS
+from atlas import load_atlas
+from audio import audio, SELECT_SOUND, CLICK_SOUND, COLLECT_SOUND, JUMP_SOUND, DEAD_SOUND
+from baked_layers import can_bake, create_baked_layer
+from chunks import ChunkedLayer
+from constants import (SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, LEFT_VIEWPORT_MARGIN,
+                       RIGHT_VIEWPORT_MARGIN, BOTTOM_VIEWPORT_MARGIN, TOP_VIEWPORT_MARGIN,
+                       LEVEL_MAX, SIMULATION_TIME_STEP, DRAW_RATE, MAX_TICKS_PER_FRAME, SPLASH_SLICE_TIME)
+from hud import HealthBar
+from preload import LevelPreloader
+from profiler import profiler
+from replay import InputRecorder, InputReplay, trajectory_hash
+from simulation import (GameSimulation, PlayerInputs, EVENT_JUMP, EVENT_COIN, EVENT_PLAYER_RESET,
+                        EVENT_GAME_OVER, EVENT_LEVEL_COMPLETE)
+from text_cache import text_cache, GlyphText
+
+# Level layers that never move, drawn chunk by chunk
+STATIC_LAYERS = ("wall_list", "ladder_list", "coin_list", "dont_touch_list", "do_touch_list")
+
+# Decoration layers drawn from pre-baked chunk images instead of per tile,
+# by simulation attribute and Tiled layer name
+BAKED_LAYERS = (("background_list", "Background"), ("foreground_list", "Foreground"))
+
+# Order the level's sprite lists are drawn in, back to front
+DRAW_ORDER = ("wall_list", "moving_wall_list", "background_list", "ladder_list", "coin_list",
+              "enemy_list", "player_list", "dont_touch_list", "do_touch_list", "foreground_list")
+
+
+class SplashView(arcade.View):
+    """
+    Shown as soon as the window opens, while the menu's assets load. Loads
+    a few stages every frame so the progress bar keeps moving.
+    """
 
-PLAYER_START_X = SPRITE_PIXEL_SIZE * TILE_SCALING * 10
-PLAYER_START_Y = SPRITE_PIXEL_SIZE * TILE_SCALING * 4
+    def __init__(self, next_view):
+        """
+        :param next_view: Function making the view to show once everything is loaded
+        """
+        super().__init__()
+        self.next_view = next_view
+
+        # (name, function) for each loading stage, in order. The menu
+        # doesn't need the atlases, so they load on a worker thread and
+        # the first level waits for them if they aren't done yet.
+        self.stages = [("start atlas", self.start_atlas)]
+        for file_name in MENU_TEXTURES:
+            self.stages.append((file_name, lambda file_name=file_name: registry.texture(file_name)))
+        for file_name in GAME_SOUNDS:
+            self.stages.append((file_name, lambda file_name=file_name: registry.sound(file_name)))
+        self.stage = 0
+
+        # Nothing loads until the first frame is on screen
+        self.drawn = False
+
+        arcade.set_background_color(arcade.csscolor.BLACK)
+        arcade.set_viewport(0, SCREEN_WIDTH - 1, 0, SCREEN_HEIGHT - 1)
 
-# Constants used to track if the player is facing left or right
-RIGHT_FACING = 0
-LEFT_FACING = 1
+    @staticmethod
+    def start_atlas():
+        """ Load the texture atlases on a worker thread """
+        def load():
+            with startup_trace.phase("atlas (worker thread)"):
+                load_atlas()
+        threading.Thread(target=load, daemon=True).start()
 
-# LEVELS
-LEVEL_MAX = 4
-_level = 1
+    def on_draw(self):
+        """ Draw the progress bar """
+        arcade.start_render()
+        left = SCREEN_WIDTH / 4
+        right = SCREEN_WIDTH * 3 / 4
+        bottom = SCREEN_HEIGHT / 2 - 10
+        done = left + (right - left) * self.stage / len(self.stages)
+        arcade.draw_lrtb_rectangle_filled(left, done, bottom + 20, bottom, arcade.csscolor.WHITE)
+        arcade.draw_lrtb_rectangle_outline(left, right, bottom + 20, bottom, arcade.csscolor.WHITE, 2)
 
+        if not self.drawn:
+            self.drawn = True
+            startup_trace.mark("first frame")
 
-def load_texture_pair(filename):
-    """
-    Load a texture pair, with the second being a mirror image.
-    """
-    return [
-        arcade.load_texture(filename),
-        arcade.load_texture(filename, flipped_horizontally=True)
-    ]
+    def on_update(self, delta_time):
+        """ Run loading stages for a slice of the frame, then move on when all are done """
+        if not self.drawn:
+            return
+        start_time = timeit.default_timer()
+        while self.stage < len(self.stages):
+            name, load = self.stages[self.stage]
+            with startup_trace.phase(name):
+                load()
+            self.stage += 1
+            if timeit.default_timer() - start_time > SPLASH_SLICE_TIME:
+                return
+        startup_trace.mark("assets loaded")
+        self.window.show_view(self.next_view())
 
 
 class InstructionView(arcade.View):
@@ -61,13 +113,9 @@ class InstructionView(arcade.View):
         super().__init__()
 
         # Load textures
-        self.texture = arcade.load_texture("maps/images/views/gamestart.png")
-        self.char = arcade.load_texture("maps/images/person/Person_idle.png")
-        self.health = arcade.load_texture("maps/images/person/health_3.png")
-
-        # Load the menu sounds
-        self.select_sound = arcade.load_sound("sounds/select.wav")
-        self.click_sound = arcade.load_sound("sounds/click.wav")
+        self.texture = registry.texture("maps/images/views/gamestart.png")
+        self.char = registry.texture("maps/images/person/Person_idle.png")
+        self.health = registry.texture("maps/images/person/health_3.png")
 
         # Reset the viewport, necessary if we have a scrolling game and we need
         # to reset the viewport back to the start so we can see what we draw.
@@ -82,52 +130,54 @@ class InstructionView(arcade.View):
         self.char.draw_sized(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 3.29,
                              96, 128)
 
-        arcade.draw_text("Controls:", 850, 440, arcade.csscolor.WHITE, 30)
-        arcade.draw_text("Up / Down Keys", 860, 400, arcade.csscolor.WHITE, 25)
-        arcade.draw_text("Enter", 860, 360, arcade.csscolor.WHITE, 25)
+        text_cache.draw("Controls:", 850, 440, arcade.csscolor.WHITE, 30)
+        text_cache.draw("Up / Down Keys", 860, 400, arcade.csscolor.WHITE, 25)
+        text_cache.draw("Enter", 860, 360, arcade.csscolor.WHITE, 25)
 
         #
         if self.selected == 1:
-            arcade.draw_text(" Start ", 10, 385, arcade.csscolor.WHITE, 75)
+            text_cache.draw(" Start ", 10, 385, arcade.csscolor.WHITE, 75)
         else:
-            arcade.draw_text("Start", 30, 400, arcade.csscolor.WHITE, 50)
+            text_cache.draw("Start", 30, 400, arcade.csscolor.WHITE, 50)
 
         if self.selected == 2:
-            arcade.draw_text(" Level Select", 10, 185, arcade.csscolor.WHITE, 75)
+            text_cache.draw(" Level Select", 10, 185, arcade.csscolor.WHITE, 75)
         else:
-            arcade.draw_text("Level Select", 30, 200, arcade.csscolor.WHITE, 50)
+            text_cache.draw("Level Select", 30, 200, arcade.csscolor.WHITE, 50)
 
         if self.selected == 3:
-            arcade.draw_text(" Quit ", 30, 35, arcade.csscolor.BLACK, 75)
+            text_cache.draw(" Quit ", 30, 35, arcade.csscolor.BLACK, 75)
         else:
-            arcade.draw_text("Quit", 30, 50, arcade.csscolor.BLACK, 50)
+            text_cache.draw("Quit", 30, 50, arcade.csscolor.BLACK, 50)
+
+        startup_trace.finish("menu drawn")
 
     def on_key_press(self, key, modifiers):
         """Called whenever a key is pressed. """
 
         if key == arcade.key.ENTER:
             if self.selected == 1:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 game_view = GameView()
                 game_view.setup(1)
                 self.window.show_view(game_view)
             elif self.selected == 2:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 game_view = LevelSelectView()
                 self.window.show_view(game_view)
             elif self.selected == 3:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 arcade.close_window()
             else:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
         if key == arcade.key.DOWN:
             self.selected += 1
-            arcade.play_sound(self.select_sound)
+            audio.play(SELECT_SOUND)
             if self.selected > 3:
                 self.selected = 1
         if key == arcade.key.UP:
             self.selected -= 1
-            arcade.play_sound(self.select_sound)
+            audio.play(SELECT_SOUND)
             if self.selected < 1:
                 self.selected = 3
 
@@ -135,28 +185,28 @@ class InstructionView(arcade.View):
         if 385 <= y <= 385 + 75 and 10 <= x <= 200:
             if self.selected != 1:
                 self.selected = 1
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
         elif 185 <= y <= 185 + 75 and 10 <= x <= 325:
             if self.selected != 2:
                 self.selected = 2
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
         if 35 <= y <= 35 + 75 and 10 <= x <= 200:
             if self.selected != 3:
                 self.selected = 3
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
 
     def on_mouse_press(self, x: float, y: float, button: int, modifiers: int):
         if 385 <= y <= 385 + 75 and 10 <= x <= 200:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             game_view = GameView()
             game_view.setup(1)
             self.window.show_view(game_view)
         elif 185 <= y <= 185 + 75 and 10 <= x <= 325:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             game_view = LevelSelectView()
             self.window.show_view(game_view)
         if 35 <= y <= 35 + 75 and 10 <= x <= 200:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             arcade.close_window()
 
 
@@ -168,15 +218,11 @@ class LevelSelectView(arcade.View):
         super().__init__()
 
         # Load textures
-        self.texture = arcade.load_texture("maps/images/views/gamestart.png")
-        self.char = arcade.load_texture("maps/images/person/Person_idle.png")
-        self.health = arcade.load_texture("maps/images/person/health_3.png")
-        self.arrow_up = arcade.load_texture("maps/images/views/Up Arrow.png")
-        self.arrow_down = arcade.load_texture("maps/images/views/Down Arrow.png")
-
-        # Load the menu sounds
-        self.select_sound = arcade.load_sound("sounds/select.wav")
-        self.click_sound = arcade.load_sound("sounds/click.wav")
+        self.texture = registry.texture("maps/images/views/gamestart.png")
+        self.char = registry.texture("maps/images/person/Person_idle.png")
+        self.health = registry.texture("maps/images/person/health_3.png")
+        self.arrow_up = registry.texture("maps/images/views/Up Arrow.png")
+        self.arrow_down = registry.texture("maps/images/views/Down Arrow.png")
 
         # Reset the viewport, necessary if we have a scrolling game and we need
         # to reset the viewport back to the start so we can see what we draw.
@@ -192,13 +238,13 @@ class LevelSelectView(arcade.View):
         self.char.draw_sized(SCREEN_WIDTH / 1.25, SCREEN_HEIGHT / 3.29,
                              96, 128)
 
-        arcade.draw_text(f" Level", 460, 285, arcade.csscolor.WHITE, 75)
+        text_cache.draw(f" Level", 460, 285, arcade.csscolor.WHITE, 75)
 
         # 
         if self.selected == 1:
-            arcade.draw_text("Back", 10, 385, arcade.csscolor.WHITE, 75)
+            text_cache.draw("Back", 10, 385, arcade.csscolor.WHITE, 75)
         else:
-            arcade.draw_text("Back", 30, 400, arcade.csscolor.WHITE, 50)
+            text_cache.draw("Back", 30, 400, arcade.csscolor.WHITE, 50)
 
         if self.selected == 2:
             self.arrow_up.draw_sized(721, 401, 34, 40)
@@ -206,9 +252,9 @@ class LevelSelectView(arcade.View):
             self.arrow_up.draw_sized(721, 401, 24, 26)
 
         if self.selected == 3:
-            arcade.draw_text(f"{self.choice}", 695, 283, arcade.csscolor.WHITE, 80)
+            text_cache.draw(f"{self.choice}", 695, 283, arcade.csscolor.WHITE, 80)
         else:
-            arcade.draw_text(f"{self.choice}", 700, 290, arcade.csscolor.WHITE, 65)
+            text_cache.draw(f"{self.choice}", 700, 290, arcade.csscolor.WHITE, 65)
 
         if self.selected == 4:
             self.arrow_down.draw_sized(721, 277, 34, 40)
@@ -216,44 +262,44 @@ class LevelSelectView(arcade.View):
             self.arrow_down.draw_sized(721, 277, 24, 26)
 
         if self.selected == 5:
-            arcade.draw_text(" Quit ", 30, 35, arcade.csscolor.BLACK, 75)
+            text_cache.draw(" Quit ", 30, 35, arcade.csscolor.BLACK, 75)
         else:
-            arcade.draw_text("Quit", 30, 50, arcade.csscolor.BLACK, 50)
+            text_cache.draw("Quit", 30, 50, arcade.csscolor.BLACK, 50)
 
     def on_key_press(self, key, modifiers):
         """Called whenever a key is pressed. """
 
         if key == arcade.key.ENTER:
             if self.selected == 1:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 game_view = InstructionView()
                 self.window.show_view(game_view)
             elif self.selected == 2:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 if not self.choice > 4:
                     self.choice += 1
             elif self.selected == 3:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 game_view = GameView()
                 game_view.setup(self.choice)
                 self.window.show_view(game_view)
             elif self.selected == 4:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 if not self.choice < 2:
                     self.choice -= 1
             elif self.selected == 5:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 arcade.close_window()
             else:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
         if key == arcade.key.DOWN:
             self.selected += 1
-            arcade.play_sound(self.select_sound)
+            audio.play(SELECT_SOUND)
             if self.selected > 5:
                 self.selected = 1
         if key == arcade.key.UP:
             self.selected -= 1
-            arcade.play_sound(self.select_sound)
+            audio.play(SELECT_SOUND)
             if self.selected < 1:
                 self.selected = 3
 
@@ -261,44 +307,44 @@ class LevelSelectView(arcade.View):
         if 385 <= y <= 385 + 75 and 10 <= x <= 200:
             if self.selected != 1:
                 self.selected = 1
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
         if 390 <= y <= 390 + 35 and 700 <= x <= 730:
             if self.selected != 2:
                 self.selected = 2
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
         if 300 <= y <= 300 + 75 and 685 <= x <= 730:
             if self.selected != 3:
                 self.selected = 3
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
         if 267 <= y <= 267 + 30 and 700 <= x <= 730:
             if self.selected != 4:
                 self.selected = 4
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
         if 35 <= y <= 35 + 75 and 10 <= x <= 200:
             if self.selected != 5:
                 self.selected = 5
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
 
     def on_mouse_press(self, x: float, y: float, button: int, modifiers: int):
         if 385 <= y <= 385 + 75 and 10 <= x <= 200:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             game_view = InstructionView()
             self.window.show_view(game_view)
         if 390 <= y <= 390 + 35 and 700 <= x <= 730:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             if not self.choice > 3:
                 self.choice += 1
         if 300 <= y <= 300 + 75 and 685 <= x <= 730:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             game_view = GameView()
             game_view.setup(self.choice)
             self.window.show_view(game_view)
         if 267 <= y <= 267 + 35 and 700 <= x <= 730:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             if not self.choice < 2:
                 self.choice -= 1
         if 35 <= y <= 35 + 75 and 10 <= x <= 200:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             arcade.close_window()
 
 
@@ -310,10 +356,6 @@ class LevelOverView(arcade.View):
         super().__init__()
         self.game_view = game_view
 
-        # load the menu sounds
-        self.select_sound = arcade.load_sound("sounds/select.wav")
-        self.click_sound = arcade.load_sound("sounds/click.wav")
-
         # Reset the viewport, necessary if we have a scrolling game and we need
         # to reset the viewport back to the start so we can see what we draw.
         arcade.set_viewport(0, SCREEN_WIDTH - 1, 0, SCREEN_HEIGHT - 1)
@@ -326,53 +368,53 @@ class LevelOverView(arcade.View):
         arcade.set_viewport(0, SCREEN_WIDTH - 1, 0, SCREEN_HEIGHT - 1)
 
         if self.selected == 1:
-            arcade.draw_text("Next Level", 450, 285, arcade.csscolor.WHITE, 75)
+            text_cache.draw("Next Level", 450, 285, arcade.csscolor.WHITE, 75)
         else:
-            arcade.draw_text("Next Level", 500, 300, arcade.csscolor.WHITE, 50)
+            text_cache.draw("Next Level", 500, 300, arcade.csscolor.WHITE, 50)
 
         if self.selected == 2:
-            arcade.draw_text("Back To Menu", 400, 115, arcade.csscolor.WHITE, 75)
+            text_cache.draw("Back To Menu", 400, 115, arcade.csscolor.WHITE, 75)
         else:
-            arcade.draw_text("Back To Menu", 470, 130, arcade.csscolor.WHITE, 50)
+            text_cache.draw("Back To Menu", 470, 130, arcade.csscolor.WHITE, 50)
 
     def on_key_press(self, key, modifiers):
         """Called whenever a key is pressed. """
 
         if key == arcade.key.ENTER:
             if self.selected == 1:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 self.window.show_view(self.game_view)
             elif self.selected == 2:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 game_view = InstructionView()
                 self.window.show_view(game_view)
         if key == arcade.key.DOWN:
             self.selected += 1
-            arcade.play_sound(self.select_sound)
+            audio.play(SELECT_SOUND)
             if self.selected > 2:
                 self.selected = 1
         if key == arcade.key.UP:
             self.selected -= 1
-            arcade.play_sound(self.select_sound)
+            audio.play(SELECT_SOUND)
             if self.selected < 1:
                 self.selected = 2
 
     def on_mouse_motion(self, x: float, y: float, dx: float, dy: float):
         if 285 <= y <= 285 + 75 and 500 <= x <= 750:
             if not self.selected == 1:
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
                 self.selected = 1
         elif 125 <= y <= 195 and 475 <= x <= 850:
             if not self.selected == 2:
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
                 self.selected = 2
 
     def on_mouse_press(self, x: float, y: float, button: int, modifiers: int):
         if 285 <= y <= 285 + 75 and 500 <= x <= 750:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             self.window.show_view(self.game_view)
         elif 125 <= y <= 195 and 475 <= x <= 850:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             game_view = InstructionView()
             self.window.show_view(game_view)
 
@@ -383,11 +425,7 @@ class GameOverView(arcade.View):
     def __init__(self):
         """ This is run once when we switch to this view """
         super().__init__()
-        self.texture = arcade.load_texture("maps/images/views/gameover.png")
-
-        # load menu sounds
-        self.select_sound = arcade.load_sound("sounds/select.wav")
-        self.click_sound = arcade.load_sound("sounds/click.wav")
+        self.texture = registry.texture("maps/images/views/gameover.png")
 
         # Reset the viewport, necessary if we have a scrolling game and we need
         # to reset the viewport back to the start so we can see what we draw.
@@ -403,170 +441,84 @@ class GameOverView(arcade.View):
         self.texture.draw_sized(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2,
                                 SCREEN_WIDTH, SCREEN_HEIGHT)
 
-        arcade.draw_text("Controls:", 850, 400, arcade.csscolor.WHITE, 30)
-        arcade.draw_text("Up / Down Keys", 860, 360, arcade.csscolor.WHITE, 25)
-        arcade.draw_text("Enter", 860, 320, arcade.csscolor.WHITE, 25)
+        text_cache.draw("Controls:", 850, 400, arcade.csscolor.WHITE, 30)
+        text_cache.draw("Up / Down Keys", 860, 360, arcade.csscolor.WHITE, 25)
+        text_cache.draw("Enter", 860, 320, arcade.csscolor.WHITE, 25)
 
         if self.selected == 1:
-            arcade.draw_text("Menu", 485, 285, arcade.csscolor.WHITE, 75)
+            text_cache.draw("Menu", 485, 285, arcade.csscolor.WHITE, 75)
         else:
-            arcade.draw_text("Menu", 500, 300, arcade.csscolor.WHITE, 50)
+            text_cache.draw("Menu", 500, 300, arcade.csscolor.WHITE, 50)
 
         if self.selected == 2:
-            arcade.draw_text("Quit", 505, 215, arcade.csscolor.WHITE, 75)
+            text_cache.draw("Quit", 505, 215, arcade.csscolor.WHITE, 75)
         else:
-            arcade.draw_text("Quit", 520, 230, arcade.csscolor.WHITE, 50)
+            text_cache.draw("Quit", 520, 230, arcade.csscolor.WHITE, 50)
 
     def on_key_press(self, key, modifiers):
         """Called whenever a key is pressed. """
 
         if key == arcade.key.ENTER:
             if self.selected == 1:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 game_view = InstructionView()
                 self.window.show_view(game_view)
             elif self.selected == 2:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
                 arcade.close_window()
             else:
-                arcade.play_sound(self.click_sound)
+                audio.play(CLICK_SOUND)
         if key == arcade.key.DOWN:
             self.selected += 1
-            arcade.play_sound(self.select_sound)
+            audio.play(SELECT_SOUND)
             if self.selected > 2:
                 self.selected = 1
         if key == arcade.key.UP:
             self.selected -= 1
-            arcade.play_sound(self.select_sound)
+            audio.play(SELECT_SOUND)
             if self.selected < 1:
                 self.selected = 2
 
     def on_mouse_motion(self, x: float, y: float, dx: float, dy: float):
         if 285 <= y <= 285 + 75 and 450 <= x <= 450 + 200:
             if not self.selected == 1:
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
                 self.selected = 1
         elif 230 <= y <= 230 + 75 and 500 <= x <= 500 + 200:
             if not self.selected == 2:
-                arcade.play_sound(self.select_sound)
+                audio.play(SELECT_SOUND)
                 self.selected = 2
 
     def on_mouse_press(self, x: float, y: float, button: int, modifiers: int):
         if 285 <= y <= 285 + 75 and 450 <= x <= 450 + 200:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             game_view = InstructionView()
             self.window.show_view(game_view)
         elif 230 <= y <= 230 + 75 and 500 <= x <= 500 + 200:
-            arcade.play_sound(self.click_sound)
+            audio.play(CLICK_SOUND)
             arcade.close_window()
 
 
-class PlayerCharacter(arcade.Sprite):
-    """ Player Sprite"""
-
-    def __init__(self):
-
-        # Set up parent class
-        super().__init__()
-
-        # Default to face-right
-        self.character_face_direction = RIGHT_FACING
-
-        # Used for flipping between image sequences
-        self.cur_texture = 0
-        self.scale = CHARACTER_SCALING
-
-        # Track our state
-        self.jumping = False
-        self.climbing = False
-        self.is_on_ladder = False
-
-        # --- Load Textures ---
-        main_path = "maps/images/person/Person"
-
-        # Load textures for idle standing
-        self.idle_texture_pair = load_texture_pair(f"{main_path}_idle.png")
-        self.jump_texture_pair = load_texture_pair(f"{main_path}_jump.png")
-        self.fall_texture_pair = load_texture_pair(f"{main_path}_fall.png")
-
-        # Load textures for walking
-        self.walk_textures = []
-        for i in range(8):
-            texture = load_texture_pair(f"{main_path}_walk{i}.png")
-            self.walk_textures.append(texture)
-
-        # Load textures for climbing
-        self.climbing_textures = []
-        texture = arcade.load_texture(f"{main_path}_climb0.png")
-        self.climbing_textures.append(texture)
-        texture = arcade.load_texture(f"{main_path}_climb1.png")
-        self.climbing_textures.append(texture)
-
-        # Set the initial texture
-        self.texture = self.idle_texture_pair[0]
-
-        # Hit box will be set based on the first image used. If you want to specify
-        # a different hit box, you can do it like the code below.
-        # self.set_hit_box([[-22, -64], [22, -64], [22, 28], [-22, 28]])
-        # self.set_hit_box(self.texture.hit_box_points)
-
-    def update_animation(self, delta_time: float = 1 / 60):
-
-        # Figure out if we need to flip face left or right
-        if self.change_x < 0 and self.character_face_direction == RIGHT_FACING:
-            self.character_face_direction = LEFT_FACING
-        elif self.change_x > 0 and self.character_face_direction == LEFT_FACING:
-            self.character_face_direction = RIGHT_FACING
-
-        # Climbing animation
-        if self.is_on_ladder:
-            self.climbing = True
-        if not self.is_on_ladder and self.climbing:
-            self.climbing = False
-        if self.climbing and abs(self.change_y) > 1:
-            self.cur_texture += 1
-            if self.cur_texture > 7:
-                self.cur_texture = 0
-        if self.climbing:
-            self.texture = self.climbing_textures[self.cur_texture // 4]
-            return
-
-        # Jumping animation
-        if self.change_y > 0 and not self.is_on_ladder:
-            self.texture = self.jump_texture_pair[self.character_face_direction]
-            return
-        elif self.change_y < 0 and not self.is_on_ladder:
-            self.texture = self.fall_texture_pair[self.character_face_direction]
-            return
-
-        # Idle animation
-        if self.change_x == 0:
-            self.texture = self.idle_texture_pair[self.character_face_direction]
-            return
-
-        # Walking animation
-        self.cur_texture += 1
-        if self.cur_texture > 7:
-            self.cur_texture = 0
-        self.texture = self.walk_textures[self.cur_texture][self.character_face_direction]
-
-
 class GameView(arcade.View):
     """
     Main application class.
     """
 
-    def __init__(self):
+    # Where to save a recording of the keys pressed while playing. Set
+    # from the command line.
+    record_file = None
+
+    def __init__(self, replay=None):
         """
         Initializer for the game
+
+        :param InputReplay replay: Recording to play back instead of reading the keyboard
         """
 
         # Call the parent class and set up the window
         super().__init__()
 
         # Set the path to start with this program
-        self.health_texture = arcade.load_texture("maps/images/person/health_1.png")
-        self.tutorial_num = 0
         file_path = os.path.dirname(os.path.abspath(__file__))
         os.chdir(file_path)
 
@@ -579,155 +531,84 @@ class GameView(arcade.View):
         self.frame_count = 0
         self.fps_start_timer = None
         self.fps = None
+        # Textures loaded from disk during the last frame. Should stay 0
+        # while playing.
+        self.frame_texture_loads = 0
+        self.last_texture_load_count = registry.load_count
+
+        # Health shown above the player
+        self.health_bar = HealthBar()
 
         # Track the current state of what key is pressed
-        self.left_pressed = False
-        self.right_pressed = False
-        self.up_pressed = False
+        self.inputs = PlayerInputs()
         self.debug = False
-        self.down_pressed = False
-        self.jump_needs_reset = False
-
-        # These are 'lists' that keep track of our sprites. Each sprite should
-        # go into a list.
-        self.coin_list = None
-        self.wall_list = None
-        self.foreground_list = None
-        self.background_list = None
-        self.dont_touch_list = None
-        self.do_touch_list = None
-        self.ladder_list = None
-        self.player_list = None
-
-        # Separate variable that holds the player sprite
-        self.player_sprite = None
-
-        # Our 'physics' engine
-        self.physics_engine = None
+
+        # Recording being played back, and where the player was after each
+        # tick of it
+        self.replay = replay
+        self.replay_trajectory = []
+        # Records the keys for every tick while record_file is set
+        self.recorder = None
+        # Draws the debug numbers, made the first time F3 is pressed
+        self.debug_text = None
+
+        # The level being played. All game logic lives in here.
+        self.simulation = None
+
+        # Static layers of the level, split into chunks so only what is on
+        # screen is drawn. Keyed by simulation attribute.
+        self.chunked_layers = {}
+        # Sprites drawn by the chunked layers last frame
+        self.drawn_sprites = 0
+        # Baked decoration layers, keyed by simulation attribute
+        self.baked_layers = {}
+
+        # Time that has passed but not been simulated yet, in seconds
+        self.accumulator = 0.0
+
+        # Loads the next level while this one is played
+        self.preloader = LevelPreloader()
 
         # Used to keep track of our scrolling
         self.view_bottom = 0
         self.view_left = 0
 
-        self.end_of_map = 0
-
-        # Level
-        self.level = 1
-
-        # Keep track of the score
-        self.score = 0
         # Keep track of tutorial text
-        if self.level == 1:
-            self.tutorial_num = 0
-            self.tutorial = ""
-        else:
-            self.tutorial_num = 4
-            self.tutorial = ""
-
-        # Load sounds
-        self.collect_coin_sound = arcade.load_sound("sounds/collect.wav")
-        self.jump_sound = arcade.load_sound("sounds/jump.wav")
-        self.game_over = arcade.load_sound("sounds/dead.wav")
+        self.tutorial = ""
 
     def setup(self, level):
         """ Set up the game here. Call this function to restart the game. """
 
-        # Updates the self.level variable to the game level
-        self.level = level
-
         # Used to keep track of our scrolling
         self.view_bottom = 0
         self.view_left = 0
 
-        # Keep track of the score
-        self.score = 3
-
-        # Create the Sprite lists
-        self.player_list = arcade.SpriteList()
-        self.foreground_list = arcade.SpriteList()
-        self.background_list = arcade.SpriteList()
-        self.wall_list = arcade.SpriteList()
-        self.coin_list = arcade.SpriteList()
-
-        # Set up the player, specifically placing it at these coordinates.
-        self.player_sprite = PlayerCharacter()
-
-        self.player_sprite.center_x = PLAYER_START_X
-        self.player_sprite.center_y = PLAYER_START_Y
-        self.player_list.append(self.player_sprite)
-
-        # --- Load in a map from the tiled editor ---
-
-        # Name of the layer in the file that has our platforms/walls
-        platforms_layer_name = 'Platforms'
-
-        moving_platforms_layer_name = 'Moving Platforms'
-        foreground_layer_name = "Foreground"
-        # Name of the layer that has items for pick-up
-        coins_layer_name = 'Coins'
-        # Name of the layer that has items we shouldn't touch
-        dont_touch_layer_name = "Don't Touch"
-        do_touch_layer_name = "Do Touch"
-
-        # Map name
-        map_name = f"maps/level_{level}.tmx"
-
-        # Read in the tiled map
-        my_map = arcade.tilemap.read_tmx(map_name)
-
-        # Calculate the right edge of the my_map in pixels
-        self.end_of_map = my_map.map_size.width * GRID_PIXEL_SIZE
-
-        # -- Platforms
-        self.wall_list = arcade.tilemap.process_layer(my_map,
-                                                      platforms_layer_name,
-                                                      TILE_SCALING,
-                                                      use_spatial_hash=True)
-
-        # -- Moving Platforms
-        moving_platforms_list = arcade.tilemap.process_layer(my_map, moving_platforms_layer_name, TILE_SCALING)
-        for sprite in moving_platforms_list:
-            self.wall_list.append(sprite)
-            # -- Foreground
-            # -- Foreground
-            self.foreground_list = arcade.tilemap.process_layer(my_map,
-                                                                foreground_layer_name,
-                                                                TILE_SCALING)
-        # -- Background objects
-        self.background_list = arcade.tilemap.process_layer(my_map, "Background", TILE_SCALING)
-
-        # -- Background objects
-        self.ladder_list = arcade.tilemap.process_layer(my_map, "Ladders",
-                                                        TILE_SCALING,
-                                                        use_spatial_hash=True)
-
-        # -- Coins
-        self.coin_list = arcade.tilemap.process_layer(my_map, coins_layer_name,
-                                                      TILE_SCALING,
-                                                      use_spatial_hash=True)
-        # -- Don't Touch Layer
-        self.dont_touch_list = arcade.tilemap.process_layer(my_map,
-                                                            dont_touch_layer_name,
-                                                            TILE_SCALING,
-                                                            use_spatial_hash=True)
-
-        # -- Do Touch Layer
-        self.do_touch_list = arcade.tilemap.process_layer(my_map,
-                                                          do_touch_layer_name,
-                                                          TILE_SCALING,
-                                                          use_spatial_hash=True)
+        self.simulation = GameSimulation()
+        self.simulation.setup(level, self.preloader.take(level))
+
+        if self.record_file is not None and self.recorder is None and self.replay is None:
+            self.recorder = InputRecorder(level)
+        self.accumulator = 0.0
+
+        self.chunked_layers = {}
+        for attribute in STATIC_LAYERS:
+            self.chunked_layers[attribute] = ChunkedLayer(getattr(self.simulation, attribute))
+        self.baked_layers = {}
+        for attribute, layer_name in BAKED_LAYERS:
+            # Layers that can't be baked are drawn from their sprites
+            if can_bake(self.simulation.level_map, layer_name):
+                self.baked_layers[attribute] = create_baked_layer(self.simulation.level_map, layer_name)
+
+        # Start loading the next level straight away, so moving on to it
+        # doesn't stall the game
+        if level < LEVEL_MAX:
+            self.preloader.start(level + 1)
 
         # --- Other stuff
         # Set the background color
-        if my_map.background_color:
+        if self.simulation.background_color:
             arcade.set_background_color(arcade.csscolor.BLACK)  # my_map.background_color
 
-        # Create the 'physics engine'
-        self.physics_engine = arcade.PhysicsEnginePlatformer(self.player_sprite,
-                                                             self.wall_list,
-                                                             gravity_constant=GRAVITY,
-                                                             ladders=self.ladder_list)
-
     def on_draw(self):
         """ Render the screen. """
 
@@ -747,144 +628,199 @@ class GameView(arcade.View):
         # Add one to our frame count
         self.frame_count += 1
 
+        # Count textures loaded since the last frame
+        self.frame_texture_loads = registry.load_count - self.last_texture_load_count
+        self.last_texture_load_count = registry.load_count
+
         # Clear the screen to the background color
         arcade.start_render()
 
-        # Stop the draw timer, and calculate total on_draw time.
-        self.draw_time = timeit.default_timer() - start_time
-
-        # Draw our sprites
-        self.wall_list.draw()
-        self.background_list.draw()
-        self.ladder_list.draw()
-        self.coin_list.draw()
-        self.player_list.draw()
-        self.dont_touch_list.draw()
-        self.do_touch_list.draw()
-        self.foreground_list.draw()
-
-        # Change the health texture to math the player's health
-        if self.score == 3:
-            self.health_texture = arcade.load_texture("maps/images/person/health_3.png")
-        elif self.score == 2:
-            self.health_texture = arcade.load_texture("maps/images/person/health_2.png")
-        elif self.score == 1:
-            self.health_texture = arcade.load_texture("maps/images/person/health_1.png")
-        else:
-            pass
+        simulation = self.simulation
+        player_sprite = simulation.player_sprite
+
+        left = self.view_left
+        right = self.view_left + SCREEN_WIDTH
+        bottom = self.view_bottom
+        top = self.view_bottom + SCREEN_HEIGHT
+
+        # Draw moving sprites part way between the last two ticks
+        alpha = self.accumulator / SIMULATION_TIME_STEP
+        simulation.begin_interpolation(alpha)
+        with profiler.phase("sync enemies"):
+            simulation.enemies.sync_sprites(alpha, (left, right, bottom, top))
+
+        # Draw our sprites. Static layers only draw the chunks on screen.
+        chunked_layers = self.chunked_layers
+        for attribute in DRAW_ORDER:
+            with profiler.phase(f"draw {attribute}"):
+                if attribute in chunked_layers:
+                    chunked_layers[attribute].draw(left, right, bottom, top)
+                elif attribute in self.baked_layers:
+                    self.baked_layers[attribute].draw()
+                else:
+                    getattr(simulation, attribute).draw()
+        self.drawn_sprites = sum(layer.drawn_sprites for layer in chunked_layers.values())
 
         # Draw our health on the screen, scrolling it with the character
-        self.health_texture.draw_sized(self.player_sprite.center_x + 1.5, self.player_sprite.center_y + 16,
-                                       25, 10)
-        if self.level == 1:
+        with profiler.phase("draw hud"):
+            self.health_bar.set_health(simulation.score)
+            self.health_bar.draw(player_sprite.center_x + 1.5, player_sprite.center_y + 16)
+        if simulation.level == 1:
             # Keep track of tutorial text
-            if self.tutorial_num == 0:
+            if simulation.tutorial_num == 0:
                 self.tutorial = "Use A and D keys to move"
-            elif self.tutorial_num == 1:
+            elif simulation.tutorial_num == 1:
                 self.tutorial = "Use W or Up key to jump"
-            elif self.tutorial_num == 2:
+            elif simulation.tutorial_num == 2:
                 self.tutorial = "Find the the computer to finish the level"
         else:
             self.tutorial = ""
 
         # Draw tutorial text
-        tutorial_text = f"{self.tutorial}"
-        arcade.draw_text(tutorial_text, 20 + self.view_left, 550 + self.view_bottom, arcade.csscolor.WHITE, 25)
+        with profiler.phase("draw text"):
+            tutorial_text = f"{self.tutorial}"
+            text_cache.draw(tutorial_text, 20 + self.view_left, 550 + self.view_bottom, arcade.csscolor.WHITE, 25)
 
-        # This draws tutorial text based on which level you're playing
-        if self.level == 1:
-            arcade.draw_text("Don't Touch Marked Objects", 1200, 235, arcade.csscolor.RED, 25)
-        elif self.level == 2:
-            arcade.draw_text("Coloured Buttons react with same coloured objects", 1200, 235, arcade.csscolor.BLUE, 25)
+            # This draws tutorial text based on which level you're playing
+            if simulation.level == 1:
+                text_cache.draw("Don't Touch Marked Objects", 1200, 235, arcade.csscolor.RED, 25)
+            elif simulation.level == 2:
+                text_cache.draw("Coloured Buttons react with same coloured objects", 1200, 235,
+                                arcade.csscolor.BLUE, 25)
 
         # Triggered when self.debug is true
         if self.debug:
             # Draw hit boxes.
-            self.player_sprite.draw_hit_box(arcade.color.RED, 3)
-
-            # Display timings
-            output = f"Processing time: {self.processing_time:.3f}"
-            arcade.draw_text(output, 10 + self.view_left, 620 + self.view_bottom,
-                             arcade.csscolor.RED, 18)
+            player_sprite.draw_hit_box(arcade.color.RED, 3)
 
-            output = f"Drawing time: {self.draw_time:.3f}"
-            arcade.draw_text(output, 10 + self.view_left, 600 + self.view_bottom,
-                             arcade.csscolor.RED, 18)
+            # Display timings. These change every frame, so they are drawn
+            # from glyphs rather than the text cache.
+            if self.debug_text is None:
+                self.debug_text = GlyphText(arcade.csscolor.RED, 18, max_length=64)
+            left = 10 + self.view_left
+            bottom = self.view_bottom
 
+            self.debug_text.draw(f"Processing time: {self.processing_time:.3f}", left, 620 + bottom)
+            self.debug_text.draw(f"Drawing time: {self.draw_time:.3f}", left, 600 + bottom)
             if self.fps is not None:
-                output = f"FPS: {self.fps:.0f}"
-                arcade.draw_text(output, 10 + self.view_left, 580 + self.view_bottom,
-                                 arcade.csscolor.RED, 18)
-
-    def process_keychange(self):
-        """
-        Called when we change a key up/down or we move on/off a ladder.
-        """
-        # Process up/down
-        if self.up_pressed and not self.down_pressed:
-            if self.physics_engine.is_on_ladder():
-                self.player_sprite.change_y = PLAYER_MOVEMENT_SPEED
-            elif self.physics_engine.can_jump(y_distance=10) and not self.jump_needs_reset:
-                self.player_sprite.change_y = PLAYER_JUMP_SPEED
-                if self.tutorial_num == 1:
-                    self.tutorial_num += 1
-                self.jump_needs_reset = True
-                arcade.play_sound(self.jump_sound)
-        elif self.down_pressed and not self.up_pressed:
-            if self.physics_engine.is_on_ladder():
-                self.player_sprite.change_y = -PLAYER_MOVEMENT_SPEED
-
-        # Process up/down when on a ladder and no movement
-        if self.physics_engine.is_on_ladder():
-            if not self.up_pressed and not self.down_pressed:
-                self.player_sprite.change_y = 0
-            elif self.up_pressed and self.down_pressed:
-                self.player_sprite.change_y = 0
-
-        # Process left/right
-        if self.right_pressed and not self.left_pressed:
-            self.player_sprite.change_x = PLAYER_MOVEMENT_SPEED
-            if self.tutorial_num == 0:
-                self.tutorial_num += 1
-        elif self.left_pressed and not self.right_pressed:
-            self.player_sprite.change_x = -PLAYER_MOVEMENT_SPEED
-            if self.tutorial_num == 0:
-                self.tutorial_num += 1
-        else:
-            self.player_sprite.change_x = 0
+                self.debug_text.draw(f"FPS: {self.fps:.0f}", left, 580 + bottom)
+            self.debug_text.draw(f"Texture loads this frame: {self.frame_texture_loads}", left, 560 + bottom)
+            self.debug_text.draw("Text cache hits: {hits} misses: {misses}".format(**text_cache.stats()),
+                                 left, 540 + bottom)
+            self.debug_text.draw(f"Tile sprites drawn: {self.drawn_sprites}", left, 520 + bottom)
+
+            # Frame times from the profiler, over the last PROFILER_FRAMES frames
+            p50, p95, p99 = profiler.percentiles()
+            self.debug_text.draw(f"Frame ms p50: {p50 * 1000:.1f} p95: {p95 * 1000:.1f} "
+                                 f"p99: {p99 * 1000:.1f}", left, 500 + bottom)
+            if profiler.worst_frame is not None:
+                worst = profiler.worst_frame
+                slowest = max(worst["phases"], key=worst["phases"].get, default="")
+                self.debug_text.draw(f"Worst frame: {worst['frame_time'] * 1000:.1f} ms ({slowest})",
+                                     left, 480 + bottom)
+            self.debug_text.draw("Sounds: {played} played {skipped} skipped {stolen} stolen".format(
+                **audio.stats()), left, 460 + bottom)
+            self.debug_text.draw("F4: save profile", left, 440 + bottom)
+            profiler.draw_graph(left, 330 + bottom, 300, 100)
+
+        simulation.end_interpolation()
+
+        # Total on_draw time, now that everything is drawn
+        self.draw_time = timeit.default_timer() - start_time
+        profiler.add("draw", self.draw_time)
+        profiler.end_frame()
+        startup_trace.finish("game drawn")
 
     def on_key_press(self, key, modifiers):
         """Called whenever a key is pressed. """
 
         if key == arcade.key.F3 and not self.debug:
             self.debug = True
+            profiler.enabled = True
         elif key == arcade.key.F3 and self.debug:
             self.debug = False
+            profiler.enabled = False
+        if key == arcade.key.F4 and self.debug:
+            csv_name, json_name = profiler.dump()
+            print(f"Profile saved to {csv_name} and {json_name}")
         if key == arcade.key.UP or key == arcade.key.W:
-            self.up_pressed = True
+            self.inputs.up = True
         elif key == arcade.key.DOWN or key == arcade.key.S:
-            self.down_pressed = True
+            self.inputs.down = True
         elif key == arcade.key.LEFT or key == arcade.key.A:
-            self.left_pressed = True
+            self.inputs.left = True
         elif key == arcade.key.RIGHT or key == arcade.key.D:
-            self.right_pressed = True
-
-        self.process_keychange()
+            self.inputs.right = True
 
     def on_key_release(self, key, modifiers):
         """Called when the user releases a key. """
 
         if key == arcade.key.UP or key == arcade.key.W:
-            self.up_pressed = False
-            self.jump_needs_reset = False
+            self.inputs.up = False
         elif key == arcade.key.DOWN or key == arcade.key.S:
-            self.down_pressed = False
+            self.inputs.down = False
         elif key == arcade.key.LEFT or key == arcade.key.A:
-            self.left_pressed = False
+            self.inputs.left = False
         elif key == arcade.key.RIGHT or key == arcade.key.D:
-            self.right_pressed = False
+            self.inputs.right = False
 
-        self.process_keychange()
+    def finish_replay(self):
+        """ Report the trajectory of a finished replay, so it can be compared with other runs. """
+        if self.replay is None or self.replay_trajectory is None:
+            return
+        print(f"Replay finished after {len(self.replay_trajectory)} ticks, "
+              f"trajectory {trajectory_hash(self.replay_trajectory)}")
+        self.replay_trajectory = None
+
+    def save_recording(self):
+        """ Write the keys recorded so far to record_file. """
+        if self.recorder is not None:
+            self.recorder.save(self.record_file)
+
+    def on_hide_view(self):
+        """ Save the recording whenever another view takes over. """
+        self.save_recording()
+
+    def process_events(self, events):
+        """
+        Play sounds and switch views for what happened in a simulation tick.
+
+        :returns: True if the camera was moved back to the start
+        """
+        reset_camera = False
+
+        for event in events:
+            if event == EVENT_JUMP:
+                audio.play(JUMP_SOUND)
+            elif event == EVENT_COIN:
+                audio.play(COLLECT_SOUND)
+            elif event == EVENT_PLAYER_RESET:
+                reset_camera = True
+                audio.play(DEAD_SOUND)
+            elif event == EVENT_GAME_OVER:
+                self.finish_replay()
+                view = GameOverView()
+                self.window.show_view(view)
+            elif event == EVENT_LEVEL_COMPLETE:
+                # Advance to the next level
+                next_level = self.simulation.level + 1
+
+                # Load the next level
+                if next_level > LEVEL_MAX:
+                    self.finish_replay()
+                    view = GameOverView()
+                    self.window.show_view(view)
+                elif self.replay is not None:
+                    # Carry straight on, the recording doesn't include the menus
+                    self.setup(next_level)
+                else:
+                    view = LevelOverView(self)
+                    self.setup(next_level)
+                    self.inputs.clear()
+                    self.window.show_view(view)
+                reset_camera = True
+
+        return reset_camera
 
     def on_update(self, delta_time):
         """ Movement and game logic """
@@ -892,152 +828,86 @@ class GameView(arcade.View):
         # Start timing how long this takes
         start_time = timeit.default_timer()
 
-        # Move the player with the physics engine
-        self.physics_engine.update()
-
-        # Update animations
-        if self.physics_engine.can_jump():
-            self.player_sprite.can_jump = False
-        else:
-            self.player_sprite.can_jump = True
-
-        if self.physics_engine.is_on_ladder() and not self.physics_engine.can_jump():
-            self.player_sprite.is_on_ladder = True
-            self.process_keychange()
-        else:
-            self.player_sprite.is_on_ladder = False
-            self.process_keychange()
-
-        self.coin_list.update_animation(delta_time)
-        self.background_list.update_animation(delta_time)
-        self.player_list.update_animation(delta_time)
-
-        # Update walls, used with moving platforms
-        self.wall_list.update()
-
-        # See if the moving wall hit a boundary and needs to reverse direction.
-        for wall in self.wall_list:
-
-            if wall.boundary_right and wall.right > wall.boundary_right and wall.change_x > 0:
-                wall.change_x *= -1
-            if wall.boundary_left and wall.left < wall.boundary_left and wall.change_x < 0:
-                wall.change_x *= -1
-            if wall.boundary_top and wall.top > wall.boundary_top and wall.change_y > 0:
-                wall.change_y *= -1
-            if wall.boundary_bottom and wall.bottom < wall.boundary_bottom and wall.change_y < 0:
-                wall.change_y *= -1
-
-        # See if we hit any coins
-        coin_hit_list = arcade.check_for_collision_with_list(self.player_sprite,
-                                                             self.coin_list)
-
-        # Loop through each coin we hit (if any) and remove it
-        for coin in coin_hit_list:
-
-            # Figure out how many points this coin is worth
-            if 'Type' not in coin.properties:
-                print("Warning, collected an item without a Type property.")
-            else:
-                trigger = int(coin.properties['Type'])
-                print("Triggered:", trigger)
-                for wall in self.wall_list:
-                    if "Type" not in wall.properties:
-                        pass
-                    else:
-                        if int(wall.properties['Type']) == trigger:
-                            wall.remove_from_sprite_lists()
-
-            # Remove the coin
-            coin.remove_from_sprite_lists()
-            arcade.play_sound(self.collect_coin_sound)
-
         # Track if we need to change the viewport
         changed_viewport = False
 
-        # Did the player fall off the map?
-        if self.player_sprite.center_y < -100:
-            self.player_sprite.center_x = PLAYER_START_X
-            self.player_sprite.center_y = PLAYER_START_Y
-            self.score -= 1
-            if self.score <= 0:
-                view = GameOverView()
-                self.window.show_view(view)
-
-            # Set the camera to the start
-            # Set the camera to the start
-            self.view_left = 0
-            self.view_bottom = 0
-            changed_viewport = True
-            arcade.play_sound(self.game_over)
-
-        # Did the player touch something they should not?
-        if arcade.check_for_collision_with_list(self.player_sprite,
-                                                self.dont_touch_list):
-            self.player_sprite.change_x = 0
-            self.player_sprite.change_y = 0
-            self.player_sprite.center_x = PLAYER_START_X
-            self.player_sprite.center_y = PLAYER_START_Y
-
-            # Set the camera to the start
-            self.view_left = 0
-            self.view_bottom = 0
-            changed_viewport = True
-            arcade.play_sound(self.game_over)
-            self.score -= 1
-            if self.score <= 0:
-                view = GameOverView()
-                self.window.show_view(view)
-
-        # See if the user got to the end of the level
-        if arcade.check_for_collision_with_list(self.player_sprite,
-                                                self.do_touch_list):
-            # Advance to the next level
-            if self.level == 1:
-                self.tutorial_num == 4
-            self.level += 1
-
-            # Load the next level
-            if self.level > LEVEL_MAX:
-                view = GameOverView()
-                self.level = LEVEL_MAX
-                self.window.show_view(view)
+        # Run as many fixed simulation ticks as the time that passed calls for
+        self.accumulator += delta_time
+        ticks = 0
+        while self.accumulator >= SIMULATION_TIME_STEP:
+            if ticks == MAX_TICKS_PER_FRAME:
+                # Too far behind to catch up, so drop the rest
+                self.accumulator = 0.0
+                break
+            self.accumulator -= SIMULATION_TIME_STEP
+            ticks += 1
+
+            simulation = self.simulation
+            if self.replay is not None:
+                if self.replay.finished:
+                    self.finish_replay()
+                    break
+                inputs = self.replay.next_inputs()
             else:
-                view = LevelOverView(self)
-                self.setup(self.level)
-                self.left_pressed = False
-                self.right_pressed = False
-                self.up_pressed = False
-                self.down_pressed = False
-                self.window.show_view(view)
+                inputs = self.inputs
+            if self.recorder is not None:
+                self.recorder.record(inputs)
+
+            events = simulation.step(inputs)
+            if self.replay is not None:
+                player_sprite = simulation.player_sprite
+                self.replay_trajectory.append((simulation.level, player_sprite.center_x,
+                                               player_sprite.center_y))
+            if self.process_events(events):
+                # Set the camera to the start
+                self.view_left = 0
+                self.view_bottom = 0
+                changed_viewport = True
+            if self.simulation is not simulation or self.window.current_view is not self:
+                # A new level was loaded or the game ended
+                break
+
+        with profiler.phase("animation"):
+            self.simulation.update_animation(delta_time)
+
+        # Build a little more of the next level
+        with profiler.phase("preload"):
+            self.preloader.pump()
 
-            # Set the camera to the start
-            self.view_left = 0
-            self.view_bottom = 0
-            changed_viewport = True
         # --- Manage Scrolling ---
+        scroll_start_time = timeit.default_timer()
+
+        # Follow the player where it will be drawn, between the last two ticks
+        self.simulation.begin_interpolation(self.accumulator / SIMULATION_TIME_STEP)
+        player_sprite = self.simulation.player_sprite
+        player_left = player_sprite.left
+        player_right = player_sprite.right
+        player_top = player_sprite.top
+        player_bottom = player_sprite.bottom
+        self.simulation.end_interpolation()
 
         # Scroll left
         left_boundary = self.view_left + LEFT_VIEWPORT_MARGIN
-        if self.player_sprite.left < left_boundary:
-            self.view_left -= left_boundary - self.player_sprite.left
+        if player_left < left_boundary:
+            self.view_left -= left_boundary - player_left
             changed_viewport = True
 
         # Scroll right
         right_boundary = self.view_left + SCREEN_WIDTH - RIGHT_VIEWPORT_MARGIN
-        if self.player_sprite.right > right_boundary:
-            self.view_left += self.player_sprite.right - right_boundary
+        if player_right > right_boundary:
+            self.view_left += player_right - right_boundary
             changed_viewport = True
 
         # Scroll up
         top_boundary = self.view_bottom + SCREEN_HEIGHT - TOP_VIEWPORT_MARGIN
-        if self.player_sprite.top > top_boundary:
-            self.view_bottom += self.player_sprite.top - top_boundary
+        if player_top > top_boundary:
+            self.view_bottom += player_top - top_boundary
             changed_viewport = True
 
         # Scroll down
         bottom_boundary = self.view_bottom + BOTTOM_VIEWPORT_MARGIN
-        if self.player_sprite.bottom < bottom_boundary:
-            self.view_bottom -= bottom_boundary - self.player_sprite.bottom
+        if player_bottom < bottom_boundary:
+            self.view_bottom -= bottom_boundary - player_bottom
             changed_viewport = True
 
         if changed_viewport:
@@ -1051,18 +921,49 @@ class GameView(arcade.View):
                                 SCREEN_WIDTH + self.view_left,
                                 self.view_bottom,
                                 SCREEN_HEIGHT + self.view_bottom)
+        profiler.add("scrolling", timeit.default_timer() - scroll_start_time)
 
-        # Stop the draw timer, and calculate total on_draw time.
+        # Stop the draw timer, and calculate total on_update time.
         self.processing_time = timeit.default_timer() - start_time
+        profiler.add("update", self.processing_time)
 
 
 def main():
     """ Main method """
-    window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
-    start_view = InstructionView()
-    window.show_view(start_view)
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument("--record", metavar="FILE", help="save the keys pressed while playing to FILE")
+    parser.add_argument("--replay", metavar="FILE", help="play back a recording made with --record")
+    parser.add_argument("--trace-startup", metavar="FILE", help="write startup times to FILE as JSON")
+    args = parser.parse_args()
+    startup_trace.mark("imports")
+    if args.trace_startup:
+        startup_trace.file_name = os.path.abspath(args.trace_startup)
+
+    replay = InputReplay.load(args.replay) if args.replay else None
+    if args.record:
+        GameView.record_file = os.path.abspath(args.record)
+
+    window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE,
+                           update_rate=1 / DRAW_RATE)
+    startup_trace.mark("window")
+
+    def start_view():
+        if replay is not None:
+            game_view = GameView(replay)
+            game_view.setup(replay.level)
+            return game_view
+        return InstructionView()
+
+    # The splash screen loads the menu and game assets once, so moving
+    # between views doesn't touch the disk. Tiles and characters come from
+    # the atlases.
+    window.show_view(SplashView(start_view))
     arcade.run()
 
+    # Closing the window mid-level doesn't hide the view, so save here too
+    if isinstance(window.current_view, GameView):
+        window.current_view.save_recording()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,167 @@
+"""
+Time-based sprite animation from clip files
+
+A character's clips (which frames, how long each is shown, whether the
+frames are mirrored for facing left) are kept in a JSON file next to its
+images:
+
+    {
+     "clips": {
+      "walk": {"frames": ["Person_walk0.png", ...], "frame_duration": 0.0167, "mirror": true},
+      "climb": {"frames": ["Person_climb0.png", "Person_climb1.png"], "durations": [0.1, 0.05]}
+     }
+    }
+
+Frame paths are relative to the clip file. A clip gives one frame_duration
+for every frame or a list of durations, one per frame, in seconds. Clips
+loop; a clip of one frame just shows it.
+
+Clip files are read once and their AnimationSet is shared by every sprite
+of that character, with the textures coming from the asset registry. Each
+sprite only has an Animator: the clip playing, the frame and the time
+into it. Animator.update advances by elapsed time, so animations run at
+the same speed at any frame rate, and it allocates nothing.
+"""
+import json
+import os
+
+from assets import registry
+from constants import RIGHT_FACING, LEFT_FACING
+from hit_box_cache import hit_boxes
+
+# Seconds a frame is shown when a clip does not say
+DEFAULT_FRAME_DURATION = 0.1
+
+
+class AnimationClip:
+    """
+    The frames of one clip and how long each is shown.
+    """
+
+    def __init__(self, name, textures, durations):
+        """
+        :param str name: Name of the clip
+        :param list textures: Per facing, a tuple of one texture per frame
+        :param list durations: Seconds each frame is shown
+        """
+        self.name = name
+        self.textures = textures
+        self.durations = tuple(durations)
+        self.frame_count = len(self.durations)
+        self.duration = sum(self.durations)
+
+
+class AnimationSet:
+    """
+    Every clip of one character type, shared by all its sprites.
+    """
+
+    def __init__(self, clips):
+        """
+        :param dict clips: Clip name -> AnimationClip
+        """
+        self.clips = clips
+
+    @classmethod
+    def load(cls, file_name):
+        """ Read a clip file, loading its textures through the registry """
+        with open(file_name) as file:
+            data = json.load(file)
+        directory = os.path.dirname(file_name)
+
+        clips = {}
+        for name, clip in data["clips"].items():
+            frames = [os.path.join(directory, frame) for frame in clip["frames"]]
+            right = tuple(registry.texture(frame) for frame in frames)
+            if clip.get("mirror", False):
+                left = tuple(registry.texture(frame, flipped_horizontally=True) for frame in frames)
+            else:
+                left = right
+            for texture in set(right + left):
+                hit_boxes.fill(texture)
+            textures = [None, None]
+            textures[RIGHT_FACING] = right
+            textures[LEFT_FACING] = left
+
+            durations = clip.get("durations")
+            if durations is None:
+                durations = [clip.get("frame_duration", DEFAULT_FRAME_DURATION)] * len(frames)
+            if len(durations) != len(frames) or min(durations) <= 0:
+                raise ValueError(f"{file_name}: clip {name} needs one positive duration per frame")
+            clips[name] = AnimationClip(name, textures, durations)
+        hit_boxes.save()
+        return cls(clips)
+
+
+# Clip file name -> AnimationSet, so each file is only read once
+_animation_sets = {}
+
+
+def animation_set(file_name):
+    """ Get the shared AnimationSet of a clip file, loading it the first time. """
+    animations = _animation_sets.get(file_name)
+    if animations is None:
+        animations = AnimationSet.load(file_name)
+        _animation_sets[file_name] = animations
+    return animations
+
+
+class Animator:
+    """
+    Plays clips of an AnimationSet on one sprite.
+    """
+
+    def __init__(self, sprite, animations, clip_name, facing=RIGHT_FACING):
+        """
+        :param Sprite sprite: Sprite whose texture is set
+        :param AnimationSet animations: Clips to play
+        :param str clip_name: Clip to start with
+        :param int facing: RIGHT_FACING or LEFT_FACING
+        """
+        self.sprite = sprite
+        self.animations = animations
+        self.clip = None
+        self.facing = facing
+        self.frame = 0
+        self.time = 0.0
+        self.play(clip_name)
+
+    def play(self, clip_name):
+        """ Switch to a clip from its first frame. Keeps going if it is already playing. """
+        clip = self.animations.clips[clip_name]
+        if clip is self.clip:
+            return
+        self.clip = clip
+        self.frame = 0
+        self.time = 0.0
+        self.sprite.texture = clip.textures[self.facing][0]
+
+    def face(self, facing):
+        """ Turn to RIGHT_FACING or LEFT_FACING, staying on the same frame """
+        if facing != self.facing:
+            self.facing = facing
+            self.sprite.texture = self.clip.textures[facing][self.frame]
+
+    def update(self, delta_time):
+        """ Advance the clip by delta_time seconds. """
+        clip = self.clip
+        if clip.frame_count == 1:
+            return
+        time = self.time + delta_time
+        durations = clip.durations
+        frame = self.frame
+        if time < durations[frame]:
+            self.time = time
+            return
+
+        # Whole loops change nothing, then step to the frame the time is in
+        if time >= clip.duration:
+            time %= clip.duration
+        while time >= durations[frame]:
+            time -= durations[frame]
+            frame += 1
+            if frame == clip.frame_count:
+                frame = 0
+        self.time = time
+        self.frame = frame
+        self.sprite.texture = clip.textures[self.facing][frame]
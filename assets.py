@@ -0,0 +1,112 @@
+"""
+Shared textures and sounds
+
+Every view used to load its own copies of the menu textures and sounds in
+__init__, and a new view is made on every menu change. The registry here
+loads each file once, hands the same object to everyone who asks, and
+keeps track of how much memory each one holds so they can be unloaded on
+purpose.
+"""
+import os
+
+import arcade
+
+MENU_TEXTURES = [
+    "maps/images/views/gamestart.png",
+    "maps/images/views/gameover.png",
+    "maps/images/views/Up Arrow.png",
+    "maps/images/views/Down Arrow.png",
+    "maps/images/person/Person_idle.png",
+    "maps/images/person/health_1.png",
+    "maps/images/person/health_2.png",
+    "maps/images/person/health_3.png",
+]
+
+GAME_SOUNDS = [
+    "sounds/select.wav",
+    "sounds/click.wav",
+    "sounds/collect.wav",
+    "sounds/jump.wav",
+    "sounds/dead.wav",
+]
+
+
+class AssetRegistry:
+    """
+    Loads textures and sounds once and shares them.
+    """
+
+    def __init__(self):
+        # (file name, flipped) -> Texture and file name -> Sound
+        self.textures = {}
+        self.sounds = {}
+
+        # Approximate bytes held by each asset, keyed like the dicts above
+        self.sizes = {}
+
+        # How many times a file was actually read from disk
+        self.load_count = 0
+
+    def texture(self, file_name, flipped_horizontally=False):
+        """ Get a texture, loading it the first time it is asked for. """
+        key = (file_name, flipped_horizontally)
+        texture = self.textures.get(key)
+        if texture is None:
+            texture = arcade.load_texture(file_name, flipped_horizontally=flipped_horizontally)
+            self.textures[key] = texture
+            # Textures are kept as RGBA images
+            self.sizes[key] = texture.image.width * texture.image.height * 4
+            self.load_count += 1
+        return texture
+
+    def sound(self, file_name):
+        """ Get a sound, loading it the first time it is asked for. """
+        sound = self.sounds.get(file_name)
+        if sound is None:
+            sound = arcade.load_sound(file_name)
+            self.sounds[file_name] = sound
+            # Short sounds are decoded into memory when loaded
+            data = getattr(sound.source, "_data", None)
+            self.sizes[file_name] = len(data) if data is not None else os.path.getsize(file_name)
+            self.load_count += 1
+        return sound
+
+    def warm(self, textures=(), sounds=()):
+        """ Load a set of assets up front, so nothing loads while playing. """
+        for file_name in textures:
+            self.texture(file_name)
+        for file_name in sounds:
+            self.sound(file_name)
+
+    def unload(self, file_name):
+        """
+        Drop a texture (both facings) or sound. It is loaded again the next
+        time something asks for it.
+        """
+        for key in [key for key in self.textures if key[0] == file_name]:
+            del self.textures[key]
+            del self.sizes[key]
+        if file_name in self.sounds:
+            del self.sounds[file_name]
+            del self.sizes[file_name]
+
+        # arcade keeps its own cache of every texture loaded from the file
+        texture_cache = arcade.load_texture.texture_cache
+        for cache_name in [name for name in texture_cache if name.startswith(file_name)]:
+            del texture_cache[cache_name]
+
+    def memory_usage(self):
+        """ Bytes held by each loaded asset, by file name """
+        usage = {}
+        for key, size in self.sizes.items():
+            file_name = key[0] if isinstance(key, tuple) else key
+            usage[file_name] = usage.get(file_name, 0) + size
+        return usage
+
+    def total_memory(self):
+        """ Bytes held by all loaded assets """
+        return sum(self.sizes.values())
+
+
+# The one registry everything shares
+registry = AssetRegistry()
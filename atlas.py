@@ -0,0 +1,328 @@
+"""
+Texture atlases for tiles and characters
+
+Every tile, item, enemy and character frame is its own PNG, so starting
+the game and loading a level used to open a couple of hundred files. This
+module packs all of them into a few power-of-two atlas images with a JSON
+manifest giving, for every source file, the atlas it is in, its pixel
+rectangle and UV rectangle there, and its hit box. The atlases live in the
+level cache directory and are repacked when a source image is added,
+removed or changed (by size and modification time, so checking costs no
+file opens).
+
+load_atlas() reads the atlases once and puts a texture for every source
+image into arcade's texture cache under the names arcade.load_texture
+would have used, with the hit box already filled in. Tiles, character
+frames and the asset registry then get their textures from the atlas
+without any code of theirs changing.
+
+Those names are arcade's own, not a public API: the file name for the
+loaded image, and "file-x-y-width-height-flipped_h-flipped_v-flipped_d-
+hit_box_algorithm" for a texture. They were checked against
+arcade.load_texture in 2.5.6 (the version in the project's venv), whose
+texture.py is the same as 2.5.7's. requirements.txt doesn't pin arcade,
+so load_atlas also checks the names against the installed arcade, and if
+they don't match it drops the atlas textures again and arcade loads every
+file the way it always did.
+
+Manifest layout:
+
+    {"key": ..., "atlases": [{"file": "atlas-0.png", "width": 2048, "height": 2048}, ...],
+     "images": {"maps/images/tiles/boxCrate.png": {
+         "atlas": 0, "rect": [x, y, width, height],   # pixels, y down from the top
+         "uv": [left, bottom, right, top],            # 0-1, y up like OpenGL
+         "hit_box": [[x, y], ...],                    # arcade's "Simple" hit box
+         "mirrored_hit_box": [[x, y], ...]}}}         # characters only, facing left
+
+Run this file directly to pack the atlases and compare loading them
+against loading every file:
+
+    python atlas.py
+"""
+import hashlib
+import json
+import os
+import threading
+import timeit
+
+import PIL.Image
+
+import headless  # noqa: F401
+import arcade
+
+from level_cache import CACHE_DIRECTORY
+
+# Directories packed into the atlases. Characters face both ways, so the
+# hit box of their mirrored frames is stored too.
+ATLAS_SOURCES = (
+    ("maps/images/tiles", False),
+    ("maps/images/items", False),
+    ("maps/images/person", True),
+    ("maps/images/enemies", True),
+    ("maps/images/alien", True),
+)
+
+# Bump this when the atlas layout or manifest changes, so old atlases are repacked
+ATLAS_VERSION = 1
+
+# Largest atlas side, and the largest image packed. Bigger images (like the
+# full screen pictures) are still loaded on their own.
+MAX_ATLAS_SIZE = 2048
+MAX_PACKED_SIZE = 512
+MIN_ATLAS_SIZE = 256
+
+# Transparent pixels around every image, so filtering never bleeds between them
+ATLAS_PADDING = 1
+
+MANIFEST_FILE_NAME = os.path.join(CACHE_DIRECTORY, "atlas.json")
+
+# Whether load_atlas has run, and the lock so only one thread runs it
+_loaded = False
+_load_lock = threading.Lock()
+
+
+def source_images():
+    """ (file name, mirrored) of every image to pack, in a stable order """
+    images = []
+    for directory, mirrored in ATLAS_SOURCES:
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(".png"):
+                images.append((f"{directory}/{name}", mirrored))
+    return images
+
+
+def atlas_key(images):
+    """ Hash of the packing settings and every image's size and modification time """
+    digest = hashlib.sha1(f"atlas-{ATLAS_VERSION}-{MAX_ATLAS_SIZE}-{MAX_PACKED_SIZE}-{ATLAS_PADDING}".encode())
+    for file_name, mirrored in images:
+        stat = os.stat(file_name)
+        digest.update(f"{file_name}:{mirrored}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def _shelf_pack(sizes, width, height):
+    """
+    Place rectangles on shelves, left to right and top to bottom.
+
+    :param list sizes: (key, width, height), tallest first
+    :returns: (dict of key -> (x, y), list of the sizes that did not fit)
+    """
+    placed = {}
+    leftover = []
+    x = y = shelf_height = 0
+    for key, image_width, image_height in sizes:
+        padded_width = image_width + 2 * ATLAS_PADDING
+        padded_height = image_height + 2 * ATLAS_PADDING
+        if x + padded_width > width:
+            # Start a new shelf
+            x = 0
+            y += shelf_height
+            shelf_height = 0
+        if padded_width > width or y + padded_height > height:
+            leftover.append((key, image_width, image_height))
+            continue
+        placed[key] = (x + ATLAS_PADDING, y + ATLAS_PADDING)
+        x += padded_width
+        shelf_height = max(shelf_height, padded_height)
+    return placed, leftover
+
+
+def pack(sizes):
+    """
+    Pack rectangles into as few power-of-two atlases as they fit in. Every
+    atlas but the last is MAX_ATLAS_SIZE square; the last is the smallest
+    power-of-two size its rectangles fit in.
+
+    :param list sizes: (key, width, height) of every rectangle
+    :returns: List of (atlas width, atlas height, dict of key -> (x, y))
+    """
+    remaining = sorted(sizes, key=lambda size: (-size[2], -size[1], size[0]))
+    candidates = []
+    side = MIN_ATLAS_SIZE
+    while side <= MAX_ATLAS_SIZE:
+        candidates.append((side, side))
+        if side * 2 <= MAX_ATLAS_SIZE:
+            candidates.append((side * 2, side))
+        side *= 2
+
+    atlases = []
+    while remaining:
+        for width, height in candidates:
+            placed, leftover = _shelf_pack(remaining, width, height)
+            if not leftover:
+                break
+        if not placed:
+            raise ValueError(f"{remaining[0][0]} does not fit in a {MAX_ATLAS_SIZE} atlas")
+        atlases.append((width, height, placed))
+        remaining = leftover
+    return atlases
+
+
+def _atlas_file_name(index):
+    """ Where one atlas image is kept """
+    return os.path.join(CACHE_DIRECTORY, f"atlas-{index}.png")
+
+
+def build_atlas(images=None):
+    """
+    Pack the source images into atlases and write them and the manifest.
+
+    :returns: The manifest
+    """
+    if images is None:
+        images = source_images()
+
+    loaded = {}
+    for file_name, mirrored in images:
+        image = PIL.Image.open(file_name).convert("RGBA")
+        if image.width <= MAX_PACKED_SIZE and image.height <= MAX_PACKED_SIZE:
+            loaded[file_name] = (image, mirrored)
+
+    packed = pack([(file_name, image.width, image.height) for file_name, (image, _) in loaded.items()])
+
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+    manifest = {"key": atlas_key(images), "atlases": [], "images": {}}
+    for index, (width, height, placed) in enumerate(packed):
+        atlas_image = PIL.Image.new("RGBA", (width, height))
+        for file_name, (x, y) in placed.items():
+            image, mirrored = loaded[file_name]
+            atlas_image.paste(image, (x, y))
+            entry = {
+                "atlas": index,
+                "rect": [x, y, image.width, image.height],
+                "uv": [x / width, 1 - (y + image.height) / height,
+                       (x + image.width) / width, 1 - y / height],
+                "hit_box": arcade.calculate_hit_box_points_simple(image),
+            }
+            if mirrored:
+                entry["mirrored_hit_box"] = arcade.calculate_hit_box_points_simple(
+                    image.transpose(PIL.Image.FLIP_LEFT_RIGHT))
+            manifest["images"][file_name] = entry
+
+        file_name = _atlas_file_name(index)
+        atlas_image.save(f"{file_name}.{suffix}", format="PNG")
+        os.replace(f"{file_name}.{suffix}", file_name)
+        manifest["atlases"].append({"file": os.path.basename(file_name), "width": width, "height": height})
+
+    # The manifest goes last, so half written atlases are never read
+    with open(f"{MANIFEST_FILE_NAME}.{suffix}", "w") as file:
+        json.dump(manifest, file)
+    os.replace(f"{MANIFEST_FILE_NAME}.{suffix}", MANIFEST_FILE_NAME)
+    return manifest
+
+
+def read_manifest():
+    """ The manifest of the current atlases, packing them first if they are missing or out of date. """
+    images = source_images()
+    try:
+        with open(MANIFEST_FILE_NAME) as file:
+            manifest = json.load(file)
+        if manifest["key"] == atlas_key(images) \
+                and all(os.path.exists(_atlas_file_name(index)) for index in range(len(manifest["atlases"]))):
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_atlas(images)
+
+
+def _cache_texture(cache_name, image, hit_box):
+    """ Put a texture with a known hit box into arcade's texture cache """
+    texture = arcade.Texture(cache_name, image, hit_box_algorithm="Simple")
+    texture._hit_box_points = tuple(tuple(point) for point in hit_box)
+    arcade.load_texture.texture_cache[cache_name] = texture
+    return texture
+
+
+def _cache_names_match(file_name, entry):
+    """
+    True if arcade.load_texture finds the textures cached for one image,
+    so the installed arcade names its cache entries the way load_atlas does.
+    """
+    cache = arcade.load_texture.texture_cache
+    width, height = entry["rect"][2:]
+    expected = [cache.get(f"{file_name}-0-0-0-0-False-False-False-Simple"),
+                cache.get(f"{file_name}-0-0-{width}-{height}-False-False-False-Simple")]
+    if any(texture is None for texture in expected):
+        return False
+    return arcade.load_texture(file_name) is expected[0] \
+        and arcade.load_texture(file_name, 0, 0, width, height) is expected[1]
+
+
+def load_atlas():
+    """
+    Read the atlases and put every image in them into arcade's texture
+    cache. Only does anything the first time. Safe to call from a worker
+    thread.
+
+    :returns: Number of images loaded from the atlases
+    """
+    global _loaded
+    with _load_lock:
+        if _loaded:
+            return 0
+        manifest = read_manifest()
+
+        atlas_images = []
+        for atlas in manifest["atlases"]:
+            with PIL.Image.open(os.path.join(CACHE_DIRECTORY, atlas["file"])) as image:
+                atlas_images.append(image.convert("RGBA"))
+
+        cache_names = []
+        for file_name, entry in manifest["images"].items():
+            x, y, width, height = entry["rect"]
+            image = atlas_images[entry["atlas"]].crop((x, y, x + width, y + height))
+
+            # The names arcade.load_texture gives the whole image, unflipped:
+            # the file itself, no crop (the asset registry) and a crop of the
+            # whole tile (Tiled maps)
+            names = [file_name,
+                     f"{file_name}-0-0-0-0-False-False-False-Simple",
+                     f"{file_name}-0-0-{width}-{height}-False-False-False-Simple"]
+            for name in names:
+                _cache_texture(name, image, entry["hit_box"])
+            if "mirrored_hit_box" in entry:
+                names.append(f"{file_name}-0-0-0-0-True-False-False-Simple")
+                _cache_texture(names[-1], image.transpose(PIL.Image.FLIP_LEFT_RIGHT),
+                               entry["mirrored_hit_box"])
+            cache_names.extend(names)
+
+        _loaded = True
+        if manifest["images"] and not _cache_names_match(*next(iter(manifest["images"].items()))):
+            print(f"arcade {arcade.version.VERSION} names its cached textures differently, "
+                  f"not using the texture atlases")
+            for name in cache_names:
+                arcade.load_texture.texture_cache.pop(name, None)
+            return 0
+        return len(manifest["images"])
+
+
+def main():
+    """ Pack the atlases and compare loading them with loading every file. """
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    start_time = timeit.default_timer()
+    manifest = build_atlas()
+    build_time = timeit.default_timer() - start_time
+
+    # Loading every file, the way the game used to
+    start_time = timeit.default_timer()
+    for file_name in manifest["images"]:
+        texture = arcade.load_texture(file_name, can_cache=False)
+        texture.hit_box_points
+    files_time = timeit.default_timer() - start_time
+    arcade.cleanup_texture_cache()
+
+    start_time = timeit.default_timer()
+    count = load_atlas()
+    atlas_time = timeit.default_timer() - start_time
+
+    sizes = ", ".join(f"{atlas['width']}x{atlas['height']}" for atlas in manifest["atlases"])
+    print(f"Packed {count} images into {len(manifest['atlases'])} atlases ({sizes}) in {build_time:.2f} s")
+    print(f"Loading {count} files with hit boxes: {files_time * 1000:.0f} ms, "
+          f"{count} file opens; from the atlases: {atlas_time * 1000:.0f} ms, "
+          f"{len(manifest['atlases']) + 1} file opens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Sound effects with voice limits
+
+arcade.play_sound makes a new pyglet player every time it is called, on
+the calling thread, with no limit on how many play at once. A burst of
+coin pickups or menu hovers then costs a frame spike and stacks up the
+same clip many times over.
+
+The AudioManager here plays clips from the asset registry, so each is
+decoded once into memory and shared. Every clip has a limit on how many
+voices of it play at once and a cooldown between two starts of it. When
+the limit is reached the oldest voice of the clip is stopped to make room.
+
+play() starts clips that are already loaded straight away. A clip that
+isn't is loaded on a worker thread, and then started back on the main
+thread from pyglet's clock, since pyglet players must only be made and
+stopped there. A clip that fails to load is reported and skipped, and a
+worker that has died is started again by the next play().
+"""
+import collections
+import queue
+import threading
+import timeit
+
+import arcade
+import pyglet
+
+from assets import registry
+
+SELECT_SOUND = "sounds/select.wav"
+CLICK_SOUND = "sounds/click.wav"
+COLLECT_SOUND = "sounds/collect.wav"
+JUMP_SOUND = "sounds/jump.wav"
+DEAD_SOUND = "sounds/dead.wav"
+
+# Most voices of a clip playing at once, and the shortest time in seconds
+# between two starts of it
+CLIP_LIMITS = {
+    SELECT_SOUND: (2, 0.05),
+    CLICK_SOUND: (2, 0.05),
+    COLLECT_SOUND: (4, 0.03),
+    JUMP_SOUND: (2, 0.0),
+    DEAD_SOUND: (1, 0.0),
+}
+DEFAULT_CLIP_LIMITS = (4, 0.0)
+
+
+class AudioManager:
+    """
+    Plays sound effects, loading them on a worker thread and limiting
+    voices per clip.
+    """
+
+    def __init__(self, limits=None):
+        """
+        :param dict limits: File name -> (voices, cooldown in seconds), CLIP_LIMITS if None
+        """
+        self.limits = CLIP_LIMITS if limits is None else limits
+
+        # File name -> time the clip was last started, read on the calling thread
+        self.last_played = {}
+
+        # (file name, volume) waiting for the worker to load, None to stop it
+        self.requests = queue.Queue()
+        self._thread = None
+
+        # (file name, sound, volume) loaded by the worker, waiting for the
+        # main thread to start them
+        self.ready = queue.Queue()
+        self._scheduled = False
+
+        # File name -> pyglet players of the clip, oldest first. Only the
+        # main thread touches these.
+        self.voices = {}
+
+        # Counters for the debug overlay
+        self.played = 0
+        self.skipped = 0
+        self.stolen = 0
+
+    def play(self, file_name, volume=1.0):
+        """
+        Queue a clip to play. Returns straight away. The clip is skipped if
+        it was started less than its cooldown ago.
+        """
+        now = timeit.default_timer()
+        cooldown = self.limits.get(file_name, DEFAULT_CLIP_LIMITS)[1]
+        last_played = self.last_played.get(file_name)
+        if last_played is not None and now - last_played < cooldown:
+            self.skipped += 1
+            return
+        self.last_played[file_name] = now
+
+        sound = registry.sounds.get(file_name)
+        if sound is not None:
+            self._start(file_name, sound, volume)
+            return
+
+        if not self._scheduled:
+            # Start what the worker has loaded, every frame
+            pyglet.clock.schedule(self._start_ready)
+            self._scheduled = True
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self.requests.put((file_name, volume))
+
+    def _run(self):
+        """ Worker thread: load every clip asked for """
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            file_name, volume = request
+            try:
+                sound = registry.sound(file_name)
+            except Exception as error:
+                print(f"Couldn't load sound {file_name}: {error!r}")
+                continue
+            self.ready.put((file_name, sound, volume))
+
+    def _start_ready(self, delta_time):
+        """ Main thread, from pyglet's clock: start the clips the worker loaded """
+        while True:
+            try:
+                request = self.ready.get_nowait()
+            except queue.Empty:
+                return
+            self._start(*request)
+
+    def _start(self, file_name, sound, volume):
+        """ Start one voice of a clip, stopping the oldest if there are too many """
+        voices = self.voices.get(file_name)
+        if voices is None:
+            voices = collections.deque()
+            self.voices[file_name] = voices
+
+        # Forget voices that have finished
+        while voices and sound.is_complete(voices[0]):
+            voices.popleft()
+
+        max_voices = self.limits.get(file_name, DEFAULT_CLIP_LIMITS)[0]
+        while len(voices) >= max_voices:
+            try:
+                arcade.stop_sound(voices.popleft())
+            except ValueError:
+                # pyglet already let go of it at the end of the clip
+                pass
+            self.stolen += 1
+
+        player = arcade.play_sound(sound, volume)
+        if player is not None:
+            voices.append(player)
+            self.played += 1
+
+    def stats(self):
+        """ Clips played, skipped by their cooldown and voices stolen so far """
+        return {"played": self.played, "skipped": self.skipped, "stolen": self.stolen}
+
+    def close(self):
+        """ Stop the worker thread once it has loaded what is queued. """
+        if self._thread is not None:
+            self.requests.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._scheduled:
+            pyglet.clock.unschedule(self._start_ready)
+            self._scheduled = False
+
+
+# The one audio manager every view shares
+audio = AudioManager()
@@ -0,0 +1,251 @@
+"""
+Pre-baked decoration layers
+
+The Background and Foreground layers never move and nothing collides with
+them, but every tile in them is still a sprite drawn each frame. This
+module composites each of those layers with PIL into square chunk images
+the size of a drawing chunk (see chunks.py), so at runtime a layer is a
+handful of large quads in one SpriteList.
+
+Baked chunks are saved as PNGs in the level cache directory next to a
+small JSON manifest holding the level's source hash. They are rebaked
+whenever the map or its tilesets change. A layer that is an object layer
+or has animated tiles can't be baked (see can_bake), and is drawn from its
+sprites as before.
+
+Run this file directly to bake every level and compare the per-tile and
+baked paths:
+
+    python baked_layers.py
+"""
+import json
+import os
+import threading
+
+import numpy as np
+import PIL.Image
+
+import headless  # noqa: F401
+import arcade
+
+from chunks import CHUNK_PIXEL_SIZE, ChunkedLayer
+from constants import GRID_PIXEL_SIZE, LEVEL_MAX, SCREEN_WIDTH, SCREEN_HEIGHT, TILE_SCALING
+from level_cache import (CACHE_DIRECTORY, FLIPPED_HORIZONTALLY_FLAG, FLIPPED_VERTICALLY_FLAG,
+                         FLIPPED_DIAGONALLY_FLAG, GID_MASK, create_layer_sprites, load_level)
+
+# Tiled layers that are only decoration, and can be baked
+BAKED_LAYERS = ("Background", "Foreground")
+
+# Bump this when the way chunks are baked changes, so old bakes are redone
+BAKE_VERSION = 1
+
+
+def _manifest_file_name(level_map, layer_name):
+    """ Where the manifest of a baked layer is kept """
+    base_name = os.path.splitext(os.path.basename(level_map.map_name))[0]
+    return os.path.join(CACHE_DIRECTORY, f"{base_name}-{layer_name}.json")
+
+
+def _chunk_file_name(level_map, layer_name, column, row):
+    """ Where one baked chunk of a layer is kept """
+    base_name = os.path.splitext(os.path.basename(level_map.map_name))[0]
+    return os.path.join(CACHE_DIRECTORY, f"{base_name}-{layer_name}-{column}-{row}.png")
+
+
+def _tile_image(level_map, gid, scaling, images):
+    """ PIL image of a tile gid, flipped and scaled like its sprite would be. """
+    image = images.get(gid)
+    if image is None:
+        tile = level_map.tiles[gid & GID_MASK]
+        image = PIL.Image.open(tile["image"]).convert("RGBA")
+        image = image.crop((0, 0, tile["width"], tile["height"]))
+        # Same order arcade.load_texture applies them in
+        if gid & FLIPPED_DIAGONALLY_FLAG:
+            image = image.transpose(PIL.Image.TRANSPOSE)
+        if gid & FLIPPED_HORIZONTALLY_FLAG:
+            image = image.transpose(PIL.Image.FLIP_LEFT_RIGHT)
+        if gid & FLIPPED_VERTICALLY_FLAG:
+            image = image.transpose(PIL.Image.FLIP_TOP_BOTTOM)
+        size = (max(1, round(image.width * scaling)), max(1, round(image.height * scaling)))
+        image = image.resize(size, resample=PIL.Image.LANCZOS)
+        images[gid] = image
+    return image
+
+
+def bake_layer(level_map, layer_name, scaling):
+    """
+    Composite a layer into chunk images.
+
+    :returns: dict of (column, row) chunk -> PIL image. Chunks the layer
+              leaves empty are left out.
+    """
+    chunks = {}
+    if layer_name not in level_map.cells:
+        return chunks
+
+    grid = level_map.grids[layer_name]
+    opacity = level_map.opacity[layer_name]
+    cell_width = level_map.tile_width * scaling
+    cell_height = level_map.tile_height * scaling
+    images = {}
+
+    # Tiles are pasted in the order their sprites would be drawn
+    for row, column in level_map.cells[layer_name].tolist():
+        image = _tile_image(level_map, int(grid[row, column]), scaling, images)
+        if opacity < 1:
+            image = image.copy()
+            image.putalpha(image.getchannel("A").point(lambda alpha: int(alpha * opacity)))
+
+        # World rectangle of the tile, with y going up
+        left = round(column * cell_width)
+        bottom = round((level_map.height - row - 1) * cell_height)
+        right = left + image.width
+        top = bottom + image.height
+
+        # Big tiles can reach into the chunks next to theirs
+        for chunk_column in range(left // CHUNK_PIXEL_SIZE, (right - 1) // CHUNK_PIXEL_SIZE + 1):
+            for chunk_row in range(bottom // CHUNK_PIXEL_SIZE, (top - 1) // CHUNK_PIXEL_SIZE + 1):
+                chunk = chunks.get((chunk_column, chunk_row))
+                if chunk is None:
+                    chunk = PIL.Image.new("RGBA", (CHUNK_PIXEL_SIZE, CHUNK_PIXEL_SIZE))
+                    chunks[(chunk_column, chunk_row)] = chunk
+
+                # Part of the tile inside this chunk, in image coordinates
+                # (y going down) of the chunk and of the tile
+                chunk_left = chunk_column * CHUNK_PIXEL_SIZE
+                chunk_top = (chunk_row + 1) * CHUNK_PIXEL_SIZE
+                x1 = max(left, chunk_left)
+                x2 = min(right, chunk_left + CHUNK_PIXEL_SIZE)
+                y1 = max(chunk_top - top, 0)
+                y2 = min(chunk_top - bottom, CHUNK_PIXEL_SIZE)
+                source_box = (x1 - left, y1 - (chunk_top - top), x2 - left, y2 - (chunk_top - top))
+                chunk.alpha_composite(image, dest=(x1 - chunk_left, y1), source=source_box)
+
+    return chunks
+
+
+def _bake_key(level_map, scaling):
+    """ What a bake of a level must have been made from to be used """
+    return {"version": BAKE_VERSION, "source_hash": level_map.source_hash,
+            "scaling": scaling, "chunk_size": CHUNK_PIXEL_SIZE}
+
+
+def _read_manifest(level_map, layer_name, scaling):
+    """ The manifest of a layer's bake if it is up to date, else None """
+    try:
+        with open(_manifest_file_name(level_map, layer_name)) as file:
+            manifest = json.load(file)
+        if manifest["key"] == _bake_key(level_map, scaling):
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def can_bake(level_map, layer_name):
+    """ True if a layer is a tile layer without animated tiles, so it looks the same baked """
+    if layer_name in level_map.objects:
+        return False
+    if layer_name not in level_map.cells:
+        return True
+    grid = level_map.grids[layer_name]
+    cells = level_map.cells[layer_name]
+    return not any(level_map.tiles[gid & GID_MASK]["animation"]
+                   for gid in np.unique(grid[cells[:, 0], cells[:, 1]]).tolist())
+
+
+def is_baked(level_map, layer_name, scaling=TILE_SCALING):
+    """ True if the layer has an up to date bake, so its tiles need no sprites """
+    return layer_name in level_map.baked_chunks \
+        or (can_bake(level_map, layer_name) and _read_manifest(level_map, layer_name, scaling) is not None)
+
+
+def load_baked_chunks(level_map, layer_name, scaling=TILE_SCALING):
+    """
+    Get the baked chunks of a layer, baking it first if there is no up to
+    date bake in the cache. Safe to call from a worker thread. A layer
+    that can't be baked has no chunks.
+
+    :returns: dict of (column, row) chunk -> PIL image
+    """
+    if layer_name in level_map.baked_chunks:
+        return level_map.baked_chunks[layer_name]
+    if not can_bake(level_map, layer_name):
+        return {}
+
+    manifest_name = _manifest_file_name(level_map, layer_name)
+    manifest = _read_manifest(level_map, layer_name, scaling)
+
+    chunks = None
+    if manifest is not None:
+        try:
+            chunks = {}
+            for column, row in manifest["chunks"]:
+                with PIL.Image.open(_chunk_file_name(level_map, layer_name, column, row)) as image:
+                    chunks[(column, row)] = image.convert("RGBA")
+        except (OSError, ValueError):
+            chunks = None
+
+    if chunks is None:
+        chunks = bake_layer(level_map, layer_name, scaling)
+
+        # Write the chunks first and the manifest last, so a half written
+        # bake is never read
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+        for (column, row), image in chunks.items():
+            file_name = _chunk_file_name(level_map, layer_name, column, row)
+            image.save(f"{file_name}.{suffix}", format="PNG")
+            os.replace(f"{file_name}.{suffix}", file_name)
+        with open(f"{manifest_name}.{suffix}", "w") as file:
+            json.dump({"key": _bake_key(level_map, scaling), "chunks": sorted(chunks)}, file)
+        os.replace(f"{manifest_name}.{suffix}", manifest_name)
+
+    level_map.baked_chunks[layer_name] = chunks
+    return chunks
+
+
+def create_baked_layer(level_map, layer_name, scaling=TILE_SCALING):
+    """ Build a SpriteList with one sprite per baked chunk of a layer. """
+    sprite_list = arcade.SpriteList(is_static=True)
+    for (column, row), image in load_baked_chunks(level_map, layer_name, scaling).items():
+        name = f"baked-{level_map.source_hash}-{layer_name}-{column}-{row}"
+        sprite = arcade.Sprite()
+        sprite.texture = arcade.Texture(name, image, hit_box_algorithm="None")
+        sprite.left = column * CHUNK_PIXEL_SIZE
+        sprite.bottom = row * CHUNK_PIXEL_SIZE
+        sprite_list.append(sprite)
+    return sprite_list
+
+
+def main():
+    """ Bake every level and compare draw calls and vertices with the per-tile path. """
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    for level in range(1, LEVEL_MAX + 1):
+        level_map = load_level(level)
+        for layer_name in BAKED_LAYERS:
+            tiles = create_layer_sprites(level_map, layer_name, TILE_SCALING)
+            baked = create_baked_layer(level_map, layer_name)
+
+            # Worst case over every camera position for the per-tile
+            # chunked path. Each sprite is one instanced quad, 4 vertices.
+            chunked = ChunkedLayer(tiles)
+            worst_calls = worst_sprites = 0
+            for left in range(0, int(level_map.width * GRID_PIXEL_SIZE), int(GRID_PIXEL_SIZE)):
+                for bottom in range(0, int(level_map.height * GRID_PIXEL_SIZE), int(GRID_PIXEL_SIZE)):
+                    chunks = list(chunked.visible_chunks(left, left + SCREEN_WIDTH,
+                                                         bottom, bottom + SCREEN_HEIGHT))
+                    worst_calls = max(worst_calls, len(chunks))
+                    worst_sprites = max(worst_sprites, sum(len(chunk) for chunk in chunks))
+
+            print(f"Level {level} {layer_name}: "
+                  f"per tile {len(tiles)} sprites, worst frame {worst_calls} draw calls / "
+                  f"{worst_sprites * 4} vertices; "
+                  f"baked {len(baked)} chunks, {1 if len(baked) else 0} draw call / "
+                  f"{len(baked) * 4} vertices, "
+                  f"{len(baked) * CHUNK_PIXEL_SIZE * CHUNK_PIXEL_SIZE * 4 // 1024} KiB of texture")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Benchmarks for every shipped level
+
+For each of maps/level_1..4.tmx this sets the level up and steps it for a
+fixed number of ticks with scripted inputs (or a recording made with
+PlatformerGame.py --record), without a window, and reports:
+
+    ticks_per_second    simulation ticks stepped per second, best of --repeats
+    setup_ms            cost of GameSimulation.setup with the level cache warm
+    queries_per_tick    collision queries made by the engine and the step
+    probes_per_tick     ladder and ground probes the engine actually ran, by kind
+    peak_alloc_kib_per_tick
+                        most memory allocated at once during a tick, over what
+                        was allocated when it started, averaged. Needs
+                        tracemalloc.reset_peak, so null before Python 3.9.
+    peak_rss_mib        peak resident memory of the process so far, or null
+                        where it can't be read (Windows without psutil)
+
+Results can be saved as a JSON baseline. Later runs are compared against it
+and the run fails (exit status 1) when a level's ticks per second fall by
+more than the threshold:
+
+    python benchmark.py --save-baseline
+    python benchmark.py --threshold 0.1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from constants import LEVEL_MAX
+from level_cache import load_level
+from replay import InputReplay
+from simulation import GameSimulation, scripted_inputs, EVENT_GAME_OVER, EVENT_LEVEL_COMPLETE
+
+BASELINE_FILE = "benchmark_baseline.json"
+
+# Ticks measured with tracemalloc on, which is much slower than a normal run
+ALLOCATION_TICKS = 300
+
+# Peak RSS comes from getrusage where there is one (not on Windows), else
+# from psutil if it happens to be installed
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _peak_rss_mib():
+    """ Peak resident memory of this process in MiB, or None if unknown """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, KiB on Linux
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    if psutil is not None:
+        # peak_wset is only there on Windows
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        if peak is not None:
+            return peak / (1024 * 1024)
+    return None
+
+
+def _inputs(recording):
+    """ Function giving the inputs for a tick, scripted or from a recording """
+    if recording is None:
+        return scripted_inputs
+
+    replay = InputReplay.load(recording)
+
+    def replay_inputs(tick):
+        if replay.finished:
+            # Start the recording over for long benchmarks
+            replay.rewind()
+        return replay.next_inputs()
+    return replay_inputs
+
+
+def _run(simulation, level, ticks, inputs, on_tick=None):
+    """
+    Step a level for a number of ticks, starting it again when it ends.
+    Setting the level up again is not counted in the step time.
+
+    :returns: (seconds spent stepping, total collision queries made,
+              dict of probe kind -> probes run)
+    """
+    timer = timeit.default_timer
+    step_time = 0.0
+    queries = 0
+    probes = {}
+
+    def count_queries():
+        engine = simulation.physics_engine
+        for kind, count in engine.probe_queries.items():
+            probes[kind] = probes.get(kind, 0) + count
+        return simulation.collision_queries + engine.collision_queries
+
+    for tick in range(ticks):
+        if on_tick is not None:
+            on_tick()
+        tick_inputs = inputs(tick)
+        start_time = timer()
+        events = simulation.step(tick_inputs)
+        step_time += timer() - start_time
+        if EVENT_GAME_OVER in events or EVENT_LEVEL_COMPLETE in events:
+            queries += count_queries()
+            simulation.setup(level)
+    queries += count_queries()
+    return step_time, queries, probes
+
+
+def benchmark_level(level, ticks, repeats, recording=None):
+    """ Benchmark one level. Returns a dict of results. """
+    # Make sure the level cache is built, so setup times don't include it
+    load_level(level)
+
+    simulation = GameSimulation()
+    setup_times = []
+    for _ in range(repeats):
+        start_time = timeit.default_timer()
+        simulation.setup(level)
+        setup_times.append(timeit.default_timer() - start_time)
+
+    best_time = None
+    queries = 0
+    probes = {}
+    for _ in range(repeats):
+        simulation.setup(level)
+        step_time, queries, probes = _run(simulation, level, ticks, _inputs(recording))
+        if best_time is None or step_time < best_time:
+            best_time = step_time
+
+    # Allocations, on a shorter run since tracemalloc slows everything down.
+    # Python 3.8 can't reset the peak, and the change in traced memory over a
+    # tick is only what it kept, so there is no figure there.
+    peak_alloc = None
+    if hasattr(tracemalloc, "reset_peak"):
+        simulation.setup(level)
+        tick_peaks = []
+        tick_start = [None]
+
+        def start_tick():
+            current, peak = tracemalloc.get_traced_memory()
+            if tick_start[0] is not None:
+                tick_peaks.append(peak - tick_start[0])
+            tracemalloc.reset_peak()
+            tick_start[0] = current
+
+        tracemalloc.start()
+        _run(simulation, level, ALLOCATION_TICKS, _inputs(recording), start_tick)
+        start_tick()
+        tracemalloc.stop()
+        peak_alloc = sum(tick_peaks) / len(tick_peaks) / 1024
+
+    return {
+        "ticks": ticks,
+        "ticks_per_second": ticks / best_time,
+        "setup_ms": min(setup_times) * 1000,
+        "queries_per_tick": queries / ticks,
+        "probes_per_tick": {kind: count / ticks for kind, count in sorted(probes.items())},
+        "peak_alloc_kib_per_tick": peak_alloc,
+        "peak_rss_mib": _peak_rss_mib(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results against a baseline.
+
+    :returns: List of messages for levels that got slower than the threshold allows
+    """
+    failures = []
+    for level, result in results.items():
+        base = baseline.get(level)
+        if base is None:
+            continue
+        change = result["ticks_per_second"] / base["ticks_per_second"] - 1
+        print(f"Level {level}: {change * 100:+.1f}% ticks per second against the baseline")
+        if change < -threshold:
+            failures.append(f"Level {level} is {-change * 100:.1f}% slower "
+                            f"({result['ticks_per_second']:.0f} against "
+                            f"{base['ticks_per_second']:.0f} ticks per second)")
+    return failures
+
+
+def main():
+    """ Main method """
+    parser = argparse.ArgumentParser(description="Benchmark the simulation on every level.")
+    parser.add_argument("--ticks", type=int, default=3000)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--levels", type=int, nargs="*", default=list(range(1, LEVEL_MAX + 1)))
+    parser.add_argument("--recording", help="inputs recorded with PlatformerGame.py --record")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           BASELINE_FILE))
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="save these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fail when ticks per second drop by more than this fraction")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    recording = os.path.abspath(args.recording) if args.recording else None
+    baseline_file = os.path.abspath(args.baseline)
+    json_file = os.path.abspath(args.json) if args.json else None
+
+    # Map and image paths are relative to this file
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    results = {}
+    for level in args.levels:
+        # The simulation prints on every setup and trigger, keep that out
+        # of the measurements
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = benchmark_level(level, args.ticks, args.repeats, recording)
+        results[str(level)] = result
+        peak_alloc = result["peak_alloc_kib_per_tick"]
+        peak_rss = result["peak_rss_mib"]
+        print(f"Level {level}: {result['ticks_per_second']:.0f} ticks/s, "
+              f"setup {result['setup_ms']:.1f} ms, "
+              f"{result['queries_per_tick']:.1f} queries/tick "
+              f"({', '.join(f'{kind} {count:.2f}' for kind, count in result['probes_per_tick'].items())}), "
+              f"{'n/a' if peak_alloc is None else f'{peak_alloc:.1f} KiB'} peak allocated/tick, "
+              f"peak RSS {'n/a' if peak_rss is None else f'{peak_rss:.0f} MiB'}")
+
+    if json_file:
+        with open(json_file, "w") as file:
+            json.dump(results, file, indent=1)
+
+    if args.save_baseline:
+        with open(baseline_file, "w") as file:
+            json.dump(results, file, indent=1)
+        print(f"Saved baseline to {baseline_file}")
+        return
+
+    if not os.path.exists(baseline_file):
+        print(f"No baseline at {baseline_file}, run with --save-baseline to make one")
+        return
+
+    with open(baseline_file) as file:
+        baseline = json.load(file)
+    failures = compare(results, baseline, args.threshold)
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Drawing static tile layers one screen-sized piece at a time
+
+A level is about 100x100 tiles, but only about 20x12 of them fit on the
+screen. Drawing a whole layer's SpriteList sends every tile to the GPU each
+frame. A ChunkedLayer splits a layer into square chunks of CHUNK_SIZE
+tiles, each with its own static SpriteList, and only draws the chunks the
+viewport overlaps, so the work per frame follows the screen size rather
+than the map size.
+
+The chunks share their sprites with the layer's own SpriteList, so a coin
+or wall removed with remove_from_sprite_lists() disappears from its chunk
+too. Sprites in a chunked layer must not move.
+"""
+import math
+
+import arcade
+
+from constants import CHUNK_SIZE, GRID_PIXEL_SIZE
+
+# Width and height of a chunk, in pixels
+CHUNK_PIXEL_SIZE = int(CHUNK_SIZE * GRID_PIXEL_SIZE)
+
+
+class ChunkedLayer:
+    """
+    The sprites of one static layer, grouped into chunks for drawing.
+    """
+
+    def __init__(self, sprite_list):
+        """
+        :param SpriteList sprite_list: Layer to draw. Its sprites must not move.
+        """
+        # (column, row) -> SpriteList
+        self.chunks = {}
+
+        # Sprites are put in the chunk holding their center. Anything
+        # further out than this from a chunk's edge still overlaps it.
+        self.margin = 0
+
+        for sprite in sprite_list:
+            key = (math.floor(sprite.center_x / CHUNK_PIXEL_SIZE),
+                   math.floor(sprite.center_y / CHUNK_PIXEL_SIZE))
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                chunk = arcade.SpriteList(is_static=True)
+                self.chunks[key] = chunk
+            chunk.append(sprite)
+            self.margin = max(self.margin, sprite.width / 2, sprite.height / 2)
+
+        # Sprites sent to the GPU by the last draw
+        self.drawn_sprites = 0
+
+    def visible_chunks(self, left, right, bottom, top):
+        """ The non-empty chunks that overlap the given rectangle, in world coordinates. """
+        first_column = math.floor((left - self.margin) / CHUNK_PIXEL_SIZE)
+        last_column = math.floor((right + self.margin) / CHUNK_PIXEL_SIZE)
+        first_row = math.floor((bottom - self.margin) / CHUNK_PIXEL_SIZE)
+        last_row = math.floor((top + self.margin) / CHUNK_PIXEL_SIZE)
+
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                chunk = self.chunks.get((column, row))
+                if chunk is not None and len(chunk) > 0:
+                    yield chunk
+
+    def draw(self, left, right, bottom, top):
+        """ Draw the chunks that overlap the given rectangle, in world coordinates. """
+        self.drawn_sprites = 0
+        for chunk in self.visible_chunks(left, right, bottom, top):
+            chunk.draw()
+            self.drawn_sprites += len(chunk)
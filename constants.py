@@ -0,0 +1,60 @@
+"""
+Constants shared by the game views and the simulation
+"""
+
+SCREEN_WIDTH = 1280  # 1000
+SCREEN_HEIGHT = 720  # 650
+SCREEN_TITLE = "Robot Platformer"
+
+# Constants used to scale our sprites from their original size
+TILE_SCALING = 0.5
+CHARACTER_SCALING = TILE_SCALING * 2
+COIN_SCALING = TILE_SCALING
+ENEMY_SCALING = TILE_SCALING
+SPRITE_PIXEL_SIZE = 128
+GRID_PIXEL_SIZE = (SPRITE_PIXEL_SIZE * TILE_SCALING)
+
+# Movement speed of player, in pixels per simulation tick
+PLAYER_MOVEMENT_SPEED = 8
+GRAVITY = 1.7
+PLAYER_JUMP_SPEED = 30
+
+# The game logic runs at a fixed number of ticks per second, no matter how
+# fast the window draws. Lowering DRAW_RATE on slow machines does not change
+# how the game plays.
+SIMULATION_RATE = 60
+SIMULATION_TIME_STEP = 1 / SIMULATION_RATE
+DRAW_RATE = 60
+
+# Most simulation ticks to run for one drawn frame. If we fall further
+# behind than this the extra time is dropped instead of spiralling.
+MAX_TICKS_PER_FRAME = 5
+
+# How many pixels to keep as a minimum margin between the character
+# and the edge of the screen.
+LEFT_VIEWPORT_MARGIN = 450
+RIGHT_VIEWPORT_MARGIN = 450
+BOTTOM_VIEWPORT_MARGIN = 150
+TOP_VIEWPORT_MARGIN = 100
+
+PLAYER_START_X = SPRITE_PIXEL_SIZE * TILE_SCALING * 10
+PLAYER_START_Y = SPRITE_PIXEL_SIZE * TILE_SCALING * 4
+
+# Constants used to track if the player is facing left or right
+RIGHT_FACING = 0
+LEFT_FACING = 1
+
+# LEVELS
+LEVEL_MAX = 4
+
+# Compiled levels, baked layers, atlases and hit boxes are kept here
+CACHE_DIRECTORY = "maps/.cache"
+
+# Seconds per frame spent building the next level's sprites in the background
+PRELOAD_SLICE_TIME = 0.002
+
+# Seconds per frame the splash screen spends loading assets before drawing again
+SPLASH_SLICE_TIME = 0.008
+
+# Width and height, in tiles, of the pieces static layers are drawn in
+CHUNK_SIZE = 8
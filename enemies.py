@@ -0,0 +1,453 @@
+"""
+Enemies
+
+Enemies are placed in Tiled as rectangles on an object layer called
+"Enemies". The object's type names the kind of enemy (see ENEMY_KINDS) and
+the rectangle is the area it patrols:
+
+    walkers   pace along the bottom of the rectangle
+    fliers    pace from side to side, bobbing up and down inside it
+    saws      slide back and forth along its longer side
+
+An optional float property "speed" overrides the kind's speed, in pixels
+per tick.
+
+None of the shipped levels has enemies yet. maps/level_enemies.tmx is
+level 2 with a slime and a bee placed on it, for trying them out:
+setup("enemies") loads it like a numbered level.
+
+A level can have a lot of enemies, so they are not sprites while the game
+runs. An EnemySystem keeps every enemy's state in NumPy arrays, one array
+per field (position, velocity, patrol bounds, behavior, hit box), and
+moves them all at once each tick. Touching the player is checked through a
+grid of cells rebuilt every tick: only the enemies in the cells around the
+player are tested against its hit box. Sprites are only updated from the
+arrays when the level is drawn.
+
+Run this file directly to step a level (the enemy test map unless --level
+gives a number) with many enemies scattered over it and report how long
+they take per tick:
+
+    python enemies.py --level enemies --count 1000
+"""
+import argparse
+import math
+import os
+import timeit
+
+import numpy as np
+
+import headless  # noqa: F401
+import arcade
+
+from assets import registry
+from constants import ENEMY_SCALING, SCREEN_HEIGHT, SCREEN_WIDTH, SIMULATION_RATE, TILE_SCALING
+from hit_box_cache import hit_boxes
+
+# Tiled object layer the enemies are placed on
+ENEMY_LAYER = "Enemies"
+
+ENEMY_DIRECTORY = "maps/images/enemies"
+
+# Behavior ids
+WALK = 0
+FLY = 1
+SAW = 2
+
+# Kind -> (frames, behavior, speed in pixels per tick). The images face left.
+ENEMY_KINDS = {
+    "slime": (("slimeBlue.png", "slimeBlue_move.png"), WALK, 1.5),
+    "worm": (("wormGreen.png", "wormGreen_move.png"), WALK, 1.0),
+    "frog": (("frog.png", "frog_move.png"), WALK, 2.0),
+    "bee": (("bee.png",), FLY, 2.0),
+    "fly": (("fly.png",), FLY, 3.0),
+    "saw": (("saw.png",), SAW, 3.0),
+}
+
+# Ticks each frame of a walker's animation is shown
+ENEMY_FRAME_TICKS = 10
+
+# Radians a flier's bob advances per tick, and degrees a saw turns per tick
+BOB_RATE = 2 * math.pi / SIMULATION_RATE
+SAW_SPIN = 6
+
+# Width and height of a cell of the contact grid, in pixels
+ENEMY_CELL_SIZE = 128
+
+
+class EnemyKind:
+    """
+    Textures and hit box shared by every enemy of one kind.
+    """
+
+    def __init__(self, name, frames, behavior, speed):
+        self.name = name
+        self.behavior = behavior
+        self.speed = speed
+
+        # Per frame, the texture facing left and the one facing right
+        self.textures = [(registry.texture(f"{ENEMY_DIRECTORY}/{frame}"),
+                          registry.texture(f"{ENEMY_DIRECTORY}/{frame}", flipped_horizontally=True))
+                         for frame in frames]
+
+        # left, right, bottom, top of the hit box from the centre, scaled
+        texture = self.textures[0][0]
+        hit_boxes.fill(texture)
+        xs = [point[0] * ENEMY_SCALING for point in texture.hit_box_points]
+        ys = [point[1] * ENEMY_SCALING for point in texture.hit_box_points]
+        self.bounds = (min(xs), max(xs), min(ys), max(ys))
+
+
+class EnemySystem:
+    """
+    Every enemy of a level, as one array per field.
+    """
+
+    def __init__(self, spawns, width, height):
+        """
+        :param list spawns: (kind name, left, right, bottom, top, speed) per
+                            enemy, the patrol rectangle in world pixels. Speed
+                            may be None for the kind's own.
+        :param float width: Width of the level in pixels
+        :param float height: Height of the level in pixels
+        """
+        kind_names = sorted({spawn[0] for spawn in spawns})
+        self.kinds = [EnemyKind(name, *ENEMY_KINDS[name]) for name in kind_names]
+        kind_ids = {name: index for index, name in enumerate(kind_names)}
+
+        count = len(spawns)
+        self.count = count
+        self.tick = 0
+
+        self.kind = np.zeros(count, dtype=np.int32)
+        self.behavior = np.zeros(count, dtype=np.int32)
+        self.x = np.zeros(count)
+        self.y = np.zeros(count)
+        self.change_x = np.zeros(count)
+        self.change_y = np.zeros(count)
+        # Patrol bounds of the centre
+        self.min_x = np.zeros(count)
+        self.max_x = np.zeros(count)
+        self.min_y = np.zeros(count)
+        self.max_y = np.zeros(count)
+        # Fliers bob around base_y by up to bob pixels
+        self.base_y = np.zeros(count)
+        self.bob = np.zeros(count)
+        self.phase = np.zeros(count)
+        # Hit box edges from the centre
+        self.left = np.zeros(count)
+        self.right = np.zeros(count)
+        self.bottom = np.zeros(count)
+        self.top = np.zeros(count)
+
+        for index, (name, left, right, bottom, top, speed) in enumerate(spawns):
+            kind = self.kinds[kind_ids[name]]
+            hit_left, hit_right, hit_bottom, hit_top = kind.bounds
+            speed = kind.speed if speed is None else speed
+            self.kind[index] = kind_ids[name]
+            self.behavior[index] = kind.behavior
+            self.left[index] = hit_left
+            self.right[index] = hit_right
+            self.bottom[index] = hit_bottom
+            self.top[index] = hit_top
+
+            # Keep the hit box inside the rectangle, or centred on it if it
+            # is too small
+            min_x = left - hit_left
+            max_x = max(right - hit_right, min_x)
+            min_y = bottom - hit_bottom
+            max_y = max(top - hit_top, min_y)
+            center_x = (min_x + max_x) / 2
+            center_y = (min_y + max_y) / 2
+
+            if kind.behavior == WALK:
+                max_y = min_y
+                self.change_x[index] = -speed
+            elif kind.behavior == FLY:
+                self.base_y[index] = center_y
+                self.bob[index] = (max_y - min_y) / 2
+                self.phase[index] = index
+                min_y = max_y = center_y
+                self.change_x[index] = -speed
+            elif right - left >= top - bottom:
+                min_y = max_y = center_y
+                self.change_x[index] = -speed
+            else:
+                min_x = max_x = center_x
+                self.change_y[index] = -speed
+
+            self.min_x[index] = min_x
+            self.max_x[index] = max_x
+            self.min_y[index] = min_y
+            self.max_y[index] = max_y
+            self.x[index] = center_x
+            self.y[index] = min_y if kind.behavior == WALK else center_y
+
+        self.previous_x = self.x.copy()
+        self.previous_y = self.y.copy()
+        # Where each sprite was last moved to by sync_sprites
+        self.drawn_x = self.x.copy()
+        self.drawn_y = self.y.copy()
+        self.fliers = np.flatnonzero(self.behavior == FLY)
+
+        # Scratch arrays, so a tick allocates as little as possible
+        self._mask = np.zeros(count, dtype=bool)
+        self._speed = np.zeros(count)
+
+        # Contact grid: enemy indexes sorted by the cell their centre is
+        # in, rebuilt on the first contact check of each tick
+        self.grid_columns = max(math.ceil(width / ENEMY_CELL_SIZE), 1)
+        self.grid_rows = max(math.ceil(height / ENEMY_CELL_SIZE), 1)
+        self.cells = np.zeros(count, dtype=np.int64)
+        self.order = np.zeros(count, dtype=np.int64)
+        self.sorted_cells = np.zeros(count, dtype=np.int64)
+        self.grid_tick = -1
+        # How far a hit box reaches out of its centre's cell
+        self.reach = max((max(-kind.bounds[0], kind.bounds[1], -kind.bounds[2], kind.bounds[3])
+                          for kind in self.kinds), default=0)
+
+        # Enemies tested against the player's hit box after the grid
+        # lookup, for the benchmarks
+        self.contact_candidates = 0
+
+        # Drawn in place of the enemies, see sync_sprites
+        self.sprite_list = arcade.SpriteList()
+        for index in range(count):
+            sprite = arcade.Sprite(scale=ENEMY_SCALING)
+            sprite.texture = self.kinds[self.kind[index]].textures[0][0]
+            self.sprite_list.append(sprite)
+        self.sync_sprites(1.0)
+
+    @classmethod
+    def from_level(cls, level_map):
+        """ The enemies placed on a level's Enemies layer """
+        map_height = level_map.height * level_map.tile_height
+        spawns = []
+        for enemy in level_map.objects.get(ENEMY_LAYER, []):
+            if enemy["type"] not in ENEMY_KINDS:
+                print(f"Warning, unknown enemy type '{enemy['type']}' in {level_map.map_name}.")
+                continue
+            # Tiled's y points down from the top of the map
+            left = enemy["x"] * TILE_SCALING
+            right = (enemy["x"] + enemy["width"]) * TILE_SCALING
+            bottom = (map_height - enemy["y"] - enemy["height"]) * TILE_SCALING
+            top = (map_height - enemy["y"]) * TILE_SCALING
+            spawns.append((enemy["type"], left, right, bottom, top, enemy["properties"].get("speed")))
+        return cls(spawns,
+                   level_map.width * level_map.tile_width * TILE_SCALING,
+                   level_map.height * level_map.tile_height * TILE_SCALING)
+
+    def update(self):
+        """ Move every enemy one tick, turning round at its patrol bounds. """
+        if self.count == 0:
+            return
+        self.tick += 1
+        x = self.x
+        y = self.y
+        np.copyto(self.previous_x, x)
+        np.copyto(self.previous_y, y)
+
+        x += self.change_x
+        y += self.change_y
+        self._turn(x, self.min_x, self.max_x, self.change_x)
+        self._turn(y, self.min_y, self.max_y, self.change_y)
+
+        fliers = self.fliers
+        if len(fliers):
+            y[fliers] = self.base_y[fliers] + self.bob[fliers] * np.sin(self.phase[fliers]
+                                                                        + self.tick * BOB_RATE)
+
+    def _turn(self, position, low, high, change):
+        """ Stop enemies at the ends of their patrol and send them back the other way """
+        np.clip(position, low, high, out=position)
+        mask = self._mask
+        speed = self._speed
+        np.absolute(change, out=speed)
+        np.less_equal(position, low, out=mask)
+        np.copyto(change, speed, where=mask)
+        np.negative(speed, out=speed)
+        np.greater_equal(position, high, out=mask)
+        np.copyto(change, speed, where=mask)
+
+    def _build_grid(self):
+        """ Sort the enemies by the grid cell their centre is in """
+        columns = np.floor_divide(self.x, ENEMY_CELL_SIZE).astype(np.int64)
+        rows = np.floor_divide(self.y, ENEMY_CELL_SIZE).astype(np.int64)
+        np.clip(columns, 0, self.grid_columns - 1, out=columns)
+        np.clip(rows, 0, self.grid_rows - 1, out=rows)
+        np.multiply(rows, self.grid_columns, out=self.cells)
+        self.cells += columns
+        self.order[:] = np.argsort(self.cells, kind="stable")
+        np.take(self.cells, self.order, out=self.sorted_cells)
+        self.grid_tick = self.tick
+
+    def touching(self, sprite):
+        """
+        Indexes of the enemies whose hit box overlaps the sprite's. Hit
+        boxes that only touch along an edge do not count.
+        """
+        if self.count == 0:
+            return []
+        if self.grid_tick != self.tick:
+            self._build_grid()
+
+        left = sprite.left
+        right = sprite.right
+        bottom = sprite.bottom
+        top = sprite.top
+
+        # Cells an overlapping enemy's centre could be in
+        reach = self.reach
+        first_column = max(math.floor((left - reach) / ENEMY_CELL_SIZE), 0)
+        last_column = min(math.floor((right + reach) / ENEMY_CELL_SIZE), self.grid_columns - 1)
+        first_row = max(math.floor((bottom - reach) / ENEMY_CELL_SIZE), 0)
+        last_row = min(math.floor((top + reach) / ENEMY_CELL_SIZE), self.grid_rows - 1)
+        if first_column > last_column or first_row > last_row:
+            return []
+
+        # The cells of one row are next to each other in the sorted order
+        slices = []
+        for row in range(first_row, last_row + 1):
+            start = np.searchsorted(self.sorted_cells, row * self.grid_columns + first_column, "left")
+            end = np.searchsorted(self.sorted_cells, row * self.grid_columns + last_column, "right")
+            if start < end:
+                slices.append(self.order[start:end])
+        if not slices:
+            return []
+        candidates = np.concatenate(slices) if len(slices) > 1 else slices[0]
+        self.contact_candidates += len(candidates)
+
+        x = self.x[candidates]
+        y = self.y[candidates]
+        hit = ((x + self.left[candidates] < right) & (left < x + self.right[candidates])
+               & (y + self.bottom[candidates] < top) & (bottom < y + self.top[candidates]))
+        return candidates[hit].tolist()
+
+    def sync_sprites(self, alpha, view=None):
+        """
+        Move the sprites to where the enemies are drawn, part of the way
+        from their previous tick position to their current one.
+
+        :param float alpha: 0 is the previous tick, 1 is the current tick
+        :param tuple view: left, right, bottom, top of the screen. Only the
+                           sprites that are or were on it are moved.
+        """
+        if self.count == 0:
+            return
+        xs = self.previous_x + (self.x - self.previous_x) * alpha
+        ys = self.previous_y + (self.y - self.previous_y) * alpha
+        if view is None:
+            indexes = np.arange(self.count)
+        else:
+            # Sprites left where they were last drawn must not be on screen either
+            left, right, bottom, top = view
+            reach = self.reach
+            shown = ((xs > left - reach) & (xs < right + reach) & (ys > bottom - reach) & (ys < top + reach))
+            shown |= ((self.drawn_x > left - reach) & (self.drawn_x < right + reach)
+                      & (self.drawn_y > bottom - reach) & (self.drawn_y < top + reach))
+            indexes = np.flatnonzero(shown)
+        self.drawn_x[indexes] = xs[indexes]
+        self.drawn_y[indexes] = ys[indexes]
+
+        frame_tick = self.tick // ENEMY_FRAME_TICKS
+        saw_angle = self.tick * SAW_SPIN % 360
+        kinds = self.kinds
+        sprites = self.sprite_list.sprite_list
+        for index, x, y, kind, behavior, change_x in zip(indexes.tolist(), xs[indexes].tolist(),
+                                                         ys[indexes].tolist(), self.kind[indexes].tolist(),
+                                                         self.behavior[indexes].tolist(),
+                                                         self.change_x[indexes].tolist()):
+            sprite = sprites[index]
+            sprite.center_x = x
+            sprite.center_y = y
+            textures = kinds[kind].textures
+            sprite.texture = textures[(frame_tick + index) % len(textures)][change_x > 0]
+            if behavior == SAW:
+                sprite.angle = saw_angle
+
+
+def scatter_spawns(level_map, count, seed=0):
+    """
+    Patrol rectangles for count random enemies, on empty cells of the
+    level's Platforms layer. Used to load a level up for benchmarks.
+    """
+    random = np.random.default_rng(seed)
+    grid = level_map.grids["Platforms"]
+    cell = level_map.tile_width * TILE_SCALING
+    # Rows count down from the top of the map, like the gid grid
+    rows, columns = np.nonzero(grid == 0)
+    picks = random.integers(0, len(rows), count)
+    names = sorted(ENEMY_KINDS)
+    spawns = []
+    for pick in picks.tolist():
+        left = columns[pick] * cell
+        bottom = (level_map.height - rows[pick] - 1) * cell
+        name = names[random.integers(0, len(names))]
+        spawns.append((name, left - 2 * cell, left + 3 * cell, bottom, bottom + 2 * cell, None))
+    return spawns
+
+
+def main():
+    """ Step a level with many enemies and report the time they take. """
+    parser = argparse.ArgumentParser(description="Measure the enemy system with many enemies.")
+    parser.add_argument("--level", default="enemies",
+                        help="level number, or the name of a test map in maps/level_<name>.tmx")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=3000)
+    args = parser.parse_args()
+    if args.level.isdigit():
+        args.level = int(args.level)
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    # Imported here, as the simulation imports this module
+    from simulation import GameSimulation, scripted_inputs, EVENT_GAME_OVER, EVENT_LEVEL_COMPLETE
+
+    simulation = GameSimulation()
+    simulation.setup(args.level)
+    level_map = simulation.level_map
+
+    start_time = timeit.default_timer()
+    enemies = EnemySystem(scatter_spawns(level_map, args.count),
+                          level_map.width * level_map.tile_width * TILE_SCALING,
+                          level_map.height * level_map.tile_height * TILE_SCALING)
+    spawn_time = timeit.default_timer() - start_time
+
+    enemy_time = 0.0
+    step_time = 0.0
+    touches = 0
+    timer = timeit.default_timer
+    for tick in range(args.ticks):
+        start_time = timer()
+        enemies.update()
+        touches += len(enemies.touching(simulation.player_sprite)) > 0
+        enemy_time += timer() - start_time
+
+        start_time = timer()
+        events = simulation.step(scripted_inputs(tick))
+        step_time += timer() - start_time
+        if EVENT_GAME_OVER in events or EVENT_LEVEL_COMPLETE in events:
+            simulation.setup(args.level)
+
+    start_time = timer()
+    enemies.sync_sprites(0.5)
+    sync_all_time = timer() - start_time
+    player_sprite = simulation.player_sprite
+    view = (player_sprite.center_x - SCREEN_WIDTH / 2, player_sprite.center_x + SCREEN_WIDTH / 2,
+            player_sprite.center_y - SCREEN_HEIGHT / 2, player_sprite.center_y + SCREEN_HEIGHT / 2)
+    start_time = timer()
+    enemies.sync_sprites(0.5, view)
+    sync_view_time = timer() - start_time
+
+    budget = 1000 / SIMULATION_RATE
+    per_tick = enemy_time / args.ticks * 1000
+    print(f"Level {args.level}, {args.count} enemies: spawned in {spawn_time * 1000:.0f} ms, "
+          f"update + contact {per_tick:.3f} ms/tick ({per_tick / budget * 100:.1f}% of a "
+          f"{budget:.1f} ms tick), {enemies.contact_candidates / args.ticks:.1f} candidates/tick, "
+          f"touched the player on {touches} ticks")
+    print(f"Rest of the step {step_time / args.ticks * 1000:.3f} ms/tick, syncing the sprites "
+          f"for a drawn frame {sync_view_time * 1000:.2f} ms ({sync_all_time * 1000:.1f} ms for all of them)")
+
+
+if __name__ == "__main__":
+    main()
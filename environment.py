@@ -0,0 +1,381 @@
+"""
+Vectorized game environment
+
+Runs many independent copies of a level at once for bots and automated
+playtesting. A VectorEnvironment holds N GameSimulations (the headless
+part of a GameView) and steps them all with one call. Each world's keys
+for the tick come from one row of an (N, 4) array of left, right, up and
+down. Observations are written into NumPy arrays made once up front:
+
+    tiles       (N, OBSERVATION_ROWS, OBSERVATION_COLUMNS) uint8 tile
+                classes around the player, top row first, clamped to the map
+    position    (N, 2) float32 player centre x and y
+    health      (N,) int32 health left
+    done        (N,) bool, True when the last step ended the game or the
+                level. The world has already been set up again.
+
+The same arrays are filled on every step, so copy them to keep them.
+
+With workers > 0 the worlds are split over that many processes. The
+actions and observations then live in shared memory, so a step only sends
+one message to each worker and waits for its reply.
+
+Run this file directly to measure environment steps per second as the
+number of worlds and workers grows:
+
+    python environment.py --level 2 --worlds 1 8 32 --workers 0 2 4
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import sys
+import timeit
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from constants import TILE_SCALING
+from simulation import (GameSimulation, PlayerInputs, EVENT_COIN, EVENT_GAME_OVER,
+                        EVENT_LEVEL_COMPLETE)
+
+# Columns of the actions array
+ACTION_LEFT = 0
+ACTION_RIGHT = 1
+ACTION_UP = 2
+ACTION_DOWN = 3
+
+# Tile classes in the tiles observation. Outside the map counts as SOLID.
+EMPTY = 0
+SOLID = 1
+LADDER = 2
+COIN = 3
+HAZARD = 4
+GOAL = 5
+ENEMY = 6
+
+# Layers in the tiles observation, by simulation attribute. Later layers
+# cover earlier ones.
+TILE_CLASSES = (
+    ("wall_list", SOLID),
+    ("ladder_list", LADDER),
+    ("coin_list", COIN),
+    ("dont_touch_list", HAZARD),
+    ("do_touch_list", GOAL),
+)
+
+# Size of the tiles observation, in tiles. Odd, so the player is in the middle.
+OBSERVATION_ROWS = 9
+OBSERVATION_COLUMNS = 15
+
+
+def observation_arrays(count, rows=OBSERVATION_ROWS, columns=OBSERVATION_COLUMNS):
+    """ Name -> (shape, dtype) of every array the environment shares with its worlds """
+    return {
+        "actions": ((count, 4), np.bool_),
+        "tiles": ((count, rows, columns), np.uint8),
+        "position": ((count, 2), np.float32),
+        "health": ((count,), np.int32),
+        "done": ((count,), np.bool_),
+    }
+
+
+class WorldBatch:
+    """
+    Worlds stepped in this process, reading their actions from and writing
+    their observations into arrays they are given.
+    """
+
+    def __init__(self, level, arrays):
+        """
+        :param int level: Level every world plays
+        :param dict arrays: Name -> array, as laid out by observation_arrays
+        """
+        self.level = level
+        self.actions = arrays["actions"]
+        self.tiles = arrays["tiles"]
+        self.position = arrays["position"]
+        self.health = arrays["health"]
+        self.done = arrays["done"]
+
+        count = len(self.actions)
+        self.simulations = [GameSimulation() for _ in range(count)]
+        self.inputs = [PlayerInputs() for _ in range(count)]
+
+        # Per world, the tile classes of the whole level with the rows top
+        # first, padded with SOLID so a window never runs off the edge
+        self.class_grids = [None] * count
+
+    def reset(self):
+        """ Set every world up at the start of the level. """
+        for index, simulation in enumerate(self.simulations):
+            simulation.setup(self.level)
+            self._build_class_grid(index)
+            self.done[index] = False
+            self._observe(index)
+
+    def step(self):
+        """ Step every world one tick with its row of the actions. """
+        for index, (simulation, inputs, keys) in enumerate(zip(self.simulations, self.inputs,
+                                                                self.actions.tolist())):
+            inputs.left, inputs.right, inputs.up, inputs.down = keys
+            events = simulation.step(inputs)
+
+            done = EVENT_GAME_OVER in events or EVENT_LEVEL_COMPLETE in events
+            self.done[index] = done
+            if done:
+                simulation.setup(self.level)
+                self._build_class_grid(index)
+            elif EVENT_COIN in events:
+                # The coin and any walls it triggered are gone
+                self._build_class_grid(index)
+            self._observe(index)
+
+    def _build_class_grid(self, index):
+        """ Work out a world's tile classes from its sprite lists """
+        simulation = self.simulations[index]
+        level_map = simulation.level_map
+        cell_size = level_map.tile_width * TILE_SCALING
+        pad_rows = self.tiles.shape[1] // 2
+        pad_columns = self.tiles.shape[2] // 2
+
+        grid = np.full((level_map.height + 2 * pad_rows, level_map.width + 2 * pad_columns),
+                       SOLID, dtype=np.uint8)
+        grid[pad_rows:pad_rows + level_map.height, pad_columns:pad_columns + level_map.width] = EMPTY
+        for attribute, tile_class in TILE_CLASSES:
+            sprites = getattr(simulation, attribute)
+            if len(sprites) == 0:
+                continue
+            xs = np.array([sprite.center_x for sprite in sprites])
+            ys = np.array([sprite.center_y for sprite in sprites])
+            columns = (xs // cell_size).astype(np.int64)
+            rows = level_map.height - 1 - (ys // cell_size).astype(np.int64)
+            inside = (columns >= 0) & (columns < level_map.width) & (rows >= 0) & (rows < level_map.height)
+            grid[rows[inside] + pad_rows, columns[inside] + pad_columns] = tile_class
+
+        self.class_grids[index] = (grid, cell_size)
+
+    def _observe(self, index):
+        """ Fill in one world's row of the observations """
+        simulation = self.simulations[index]
+        player_sprite = simulation.player_sprite
+        x = player_sprite.center_x
+        y = player_sprite.center_y
+        self.position[index] = x, y
+        self.health[index] = simulation.score
+
+        grid, cell_size = self.class_grids[index]
+        height = simulation.level_map.height
+        width = simulation.level_map.width
+        window_rows, window_columns = self.tiles.shape[1:]
+
+        # The player's cell. In the padded grid it is the window's top left.
+        row = min(max(height - 1 - int(y // cell_size), 0), height - 1)
+        column = min(max(int(x // cell_size), 0), width - 1)
+        tiles = self.tiles[index]
+        tiles[:] = grid[row:row + window_rows, column:column + window_columns]
+
+        # Things that move are added on top
+        first_row = row - window_rows // 2
+        first_column = column - window_columns // 2
+        for sprite in simulation.moving_wall_list:
+            wall_row = height - 1 - int(sprite.center_y // cell_size) - first_row
+            wall_column = int(sprite.center_x // cell_size) - first_column
+            if 0 <= wall_row < window_rows and 0 <= wall_column < window_columns:
+                tiles[wall_row, wall_column] = SOLID
+
+        enemies = simulation.enemies
+        if enemies.count:
+            rows = height - 1 - (enemies.y // cell_size).astype(np.int64) - first_row
+            columns = (enemies.x // cell_size).astype(np.int64) - first_column
+            inside = (rows >= 0) & (rows < window_rows) & (columns >= 0) & (columns < window_columns)
+            tiles[rows[inside], columns[inside]] = ENEMY
+
+
+def _attach(layout):
+    """
+    Make the shared memory for every array of a layout, or attach to it
+    when the layout already has names.
+
+    :returns: (list of SharedMemory, dict of name -> array)
+    """
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in layout.items():
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if block_name is None:
+            block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        else:
+            block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+
+def _worker(connection, level, layout, start, stop):
+    """
+    Worker process: run the worlds start to stop on the shared arrays,
+    doing what each message from the environment says.
+    """
+    # Map and image paths are relative to this file, and the simulation's
+    # prints would only slow the workers down
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.stdout = open(os.devnull, "w")
+
+    blocks, arrays = _attach(layout)
+    worlds = WorldBatch(level, {name: array[start:stop] for name, array in arrays.items()})
+    try:
+        while True:
+            command = connection.recv()
+            if command == "step":
+                worlds.step()
+            elif command == "reset":
+                worlds.reset()
+            else:
+                break
+            connection.send(True)
+    finally:
+        del worlds, arrays
+        for block in blocks:
+            block.close()
+
+
+class VectorEnvironment:
+    """
+    N worlds of one level, stepped together.
+    """
+
+    def __init__(self, count, level=1, workers=0, rows=OBSERVATION_ROWS, columns=OBSERVATION_COLUMNS):
+        """
+        :param int count: Number of worlds
+        :param int level: Level every world plays
+        :param int workers: Processes to split the worlds over, 0 to run them here
+        :param int rows: Height of the tiles observation, in tiles
+        :param int columns: Width of the tiles observation, in tiles
+        """
+        self.count = count
+        self.level = level
+        self.workers = []
+        self.blocks = []
+        shapes = observation_arrays(count, rows, columns)
+
+        if workers <= 0:
+            arrays = {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in shapes.items()}
+            self.worlds = WorldBatch(level, arrays)
+        else:
+            self.blocks, arrays = _attach({name: (None, shape, dtype) for name, (shape, dtype) in shapes.items()})
+            layout = {name: (block.name, *shapes[name]) for name, block in zip(shapes, self.blocks)}
+            self.worlds = None
+            context = multiprocessing.get_context("spawn")
+            for shard in np.array_split(np.arange(count), min(workers, count)):
+                connection, worker_connection = context.Pipe()
+                process = context.Process(target=_worker, daemon=True,
+                                          args=(worker_connection, level, layout,
+                                                int(shard[0]), int(shard[-1]) + 1))
+                process.start()
+                self.workers.append((process, connection))
+
+        self.actions = arrays["actions"]
+        self.observations = {name: arrays[name] for name in ("tiles", "position", "health", "done")}
+
+    def _send(self, command):
+        """ Give every worker a command and wait until they have all done it """
+        for _, connection in self.workers:
+            connection.send(command)
+        for _, connection in self.workers:
+            connection.recv()
+
+    def reset(self):
+        """ Set every world up at the start of the level. Returns the observations. """
+        self.actions[:] = False
+        if self.worlds is not None:
+            self.worlds.reset()
+        else:
+            self._send("reset")
+        return self.observations
+
+    def step(self, actions=None):
+        """
+        Step every world one tick.
+
+        :param actions: (N, 4) bools, left, right, up and down for each
+                        world. Leave out to use what is already in self.actions.
+        :returns: The observations, updated in place
+        """
+        if actions is not None:
+            np.copyto(self.actions, actions)
+        if self.worlds is not None:
+            self.worlds.step()
+        else:
+            self._send("step")
+        return self.observations
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory. Observation arrays
+        from this environment must not be used afterwards.
+        """
+        for process, connection in self.workers:
+            connection.send("close")
+            process.join()
+            connection.close()
+        self.workers = []
+        # Drop the arrays before the memory under them
+        self.actions = None
+        self.observations = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def measure(count, workers, level, steps, seed=0):
+    """
+    Step an environment with random keys.
+
+    :returns: (environment steps per second, seconds to set the worlds up)
+    """
+    random = np.random.default_rng(seed)
+    # Held keys change now and then, like a player's
+    actions = random.random((count, 4)) < 0.3
+    environment = VectorEnvironment(count, level, workers)
+    try:
+        start_time = timeit.default_timer()
+        environment.reset()
+        reset_time = timeit.default_timer() - start_time
+
+        start_time = timeit.default_timer()
+        for step in range(steps):
+            if step % 30 == 0:
+                actions = random.random((count, 4)) < 0.3
+            environment.step(actions)
+        step_time = timeit.default_timer() - start_time
+    finally:
+        environment.close()
+    return count * steps / step_time, reset_time
+
+
+def main():
+    """ Measure environment steps per second for each number of worlds and workers. """
+    parser = argparse.ArgumentParser(description="Measure the vectorized environment.")
+    parser.add_argument("--level", type=int, default=1)
+    parser.add_argument("--worlds", type=int, nargs="*", default=[1, 8, 32])
+    parser.add_argument("--workers", type=int, nargs="*", default=[0, 2, 4])
+    parser.add_argument("--steps", type=int, default=1000)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    print(f"Level {args.level}, {args.steps} steps, {os.cpu_count()} CPUs")
+    for count in args.worlds:
+        for workers in args.workers:
+            if workers > count:
+                continue
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                steps_per_second, reset_time = measure(count, workers, args.level, args.steps)
+            print(f"{count:4d} worlds, {workers} workers: {steps_per_second:8.0f} steps/s "
+                  f"(reset {reset_time:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""
+Lets arcade be imported on machines without a display
+
+pyglet creates a hidden 'shadow' GL window as soon as it is imported. That
+fails when there is no display, so this switches it off first. Import it
+before arcade in any module that can run without a window.
+"""
+import os
+import sys
+
+import pyglet
+
+if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+    pyglet.options["shadow_window"] = False
@@ -0,0 +1,172 @@
+"""
+Persistent hit box cache
+
+arcade works out a texture's hit box by scanning its alpha channel the
+first time the hit box is asked for. For a 128x128 tile that is a fraction
+of a millisecond, for a character frame with a lot of transparent border
+it is over ten, and it is redone in every new process. This cache keeps
+every hit box worked out so far in a JSON file in the level cache
+directory, keyed by a hash of the image's pixels and the hit box
+algorithm, so a warm start reads them back instead of scanning.
+
+Textures that already have a hit box (the atlas fills them in from its
+manifest) are left alone.
+
+Run this file directly to load every level's tiles and the player's
+frames from their files and report how many alpha scans the cache saved:
+
+    python hit_box_cache.py          # with the cache as it is
+    python hit_box_cache.py --clear  # from an empty cache
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import timeit
+
+from constants import CACHE_DIRECTORY
+
+HIT_BOX_CACHE_FILE = os.path.join(CACHE_DIRECTORY, "hit_boxes.json")
+
+# Bump this when the key or stored format changes, so old caches are dropped
+HIT_BOX_CACHE_VERSION = 1
+
+
+def hit_box_key(texture):
+    """ Key of a texture's hit box: its pixels, size and hit box settings """
+    image = texture.image
+    digest = hashlib.sha1(image.tobytes())
+    return (f"{digest.hexdigest()}-{image.mode}-{image.width}x{image.height}-"
+            f"{texture._hit_box_algorithm}-{texture._hit_box_detail}")
+
+
+class HitBoxCache:
+    """
+    Hit boxes by image content, saved between runs.
+    """
+
+    def __init__(self, file_name=HIT_BOX_CACHE_FILE):
+        self.file_name = file_name
+
+        # Key -> {"points": hit box, "seconds": time its alpha scan took},
+        # read from the file on first use
+        self.hit_boxes = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        # Hit boxes read from the cache, worked out by arcade, and already
+        # set on the texture
+        self.hits = 0
+        self.misses = 0
+        self.preset = 0
+
+        # Seconds spent on the alpha scans of the misses, and the time the
+        # scans of the hits took when they were first done
+        self.compute_time = 0.0
+        self.saved_time = 0.0
+
+    def _load(self):
+        """ Read the cache file, if there is a usable one """
+        self.hit_boxes = {}
+        try:
+            with open(self.file_name) as file:
+                data = json.load(file)
+            if data["version"] == HIT_BOX_CACHE_VERSION:
+                self.hit_boxes = data["hit_boxes"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def fill(self, texture):
+        """
+        Give a texture its hit box from the cache, or work it out and add
+        it. Safe to call from a worker thread.
+        """
+        if texture._hit_box_points is not None:
+            with self._lock:
+                self.preset += 1
+            return
+
+        key = hit_box_key(texture)
+        with self._lock:
+            if self.hit_boxes is None:
+                self._load()
+            entry = self.hit_boxes.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.saved_time += entry["seconds"]
+
+        if entry is not None:
+            texture._hit_box_points = tuple(tuple(point) for point in entry["points"])
+            return
+
+        start_time = timeit.default_timer()
+        points = texture.hit_box_points
+        seconds = timeit.default_timer() - start_time
+        with self._lock:
+            self.compute_time += seconds
+            self.misses += 1
+            self.hit_boxes[key] = {"points": [list(point) for point in points], "seconds": seconds}
+            self._dirty = True
+
+    def save(self):
+        """ Write the cache file if hit boxes were added since it was read. """
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+            temp_name = f"{self.file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_name, "w") as file:
+                json.dump({"version": HIT_BOX_CACHE_VERSION, "hit_boxes": self.hit_boxes}, file)
+            os.replace(temp_name, self.file_name)
+            self._dirty = False
+
+    def stats(self):
+        """ Counts of hits, misses and preset hit boxes, and the scan time saved so far """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "preset": self.preset,
+                    "saved_ms": self.saved_time * 1000}
+
+
+# The one cache the level loader and the character animations share
+hit_boxes = HitBoxCache()
+
+
+def main():
+    """ Load every level's tiles and the player's frames, and report what the cache saved. """
+    parser = argparse.ArgumentParser(description="Report the hit box computations the cache saves.")
+    parser.add_argument("--clear", action="store_true", help="start from an empty cache")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if args.clear and os.path.exists(HIT_BOX_CACHE_FILE):
+        os.remove(HIT_BOX_CACHE_FILE)
+
+    # Imported here, as they fill this module's cache
+    import headless  # noqa: F401
+    from animation import animation_set
+    from constants import LEVEL_MAX
+    from level_cache import load_level, load_tile_textures
+    from player import PLAYER_ANIMATIONS
+
+    # The atlas isn't loaded, so every texture comes from its own file
+    # with no hit box yet
+    start_time = timeit.default_timer()
+    for level in range(1, LEVEL_MAX + 1):
+        load_tile_textures(load_level(level))
+    animation_set(PLAYER_ANIMATIONS)
+    total_time = timeit.default_timer() - start_time
+    hit_boxes.save()
+
+    print(f"{hit_boxes.hits + hit_boxes.misses} hit boxes in {total_time * 1000:.0f} ms: "
+          f"{hit_boxes.hits} from the cache, {hit_boxes.misses} computed "
+          f"({hit_boxes.compute_time * 1000:.1f} ms of alpha scans)")
+    print(f"The cache saved {hit_boxes.hits} alpha scans, which took {hit_boxes.saved_time * 1000:.1f} ms "
+          f"when they were first done")
+
+
+if __name__ == "__main__":
+    # Run main from the imported module, so it reports on the same cache
+    # the level loader and animations fill
+    import hit_box_cache
+    hit_box_cache.main()
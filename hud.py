@@ -0,0 +1,38 @@
+"""
+Heads-up display pieces drawn over the level
+"""
+from assets import registry
+
+HEALTH_TEXTURE_PATH = "maps/images/person/health_{}.png"
+
+
+class HealthBar:
+    """
+    The health shown above the player's head.
+
+    All the health textures are resolved once, up front. The shown texture
+    only changes when the health value does.
+    """
+
+    def __init__(self, max_health=3):
+        self.textures = {health: registry.texture(HEALTH_TEXTURE_PATH.format(health))
+                         for health in range(1, max_health + 1)}
+        self.health = None
+        self.texture = self.textures[1]
+
+        # How many times the shown texture was swapped
+        self.texture_changes = 0
+
+    def set_health(self, health):
+        """ Show a new health value. No work is done if it hasn't changed. """
+        if health == self.health:
+            return
+        self.health = health
+        # Keep the last texture when health drops to zero, the game is over
+        if health in self.textures:
+            self.texture = self.textures[health]
+            self.texture_changes += 1
+
+    def draw(self, center_x, center_y):
+        """ Draw the bar centred on a point """
+        self.texture.draw_sized(center_x, center_y, 25, 10)
@@ -0,0 +1,597 @@
+"""
+Compiled level cache
+
+Reading a level with arcade.tilemap.read_tmx goes through pytiled_parser,
+which parses the XML and decodes every base64/zlib layer each time a level
+is set up. This module compiles a maps/level_N.tmx and the tilesets it uses
+into a small .npz file instead: one NumPy gid grid per layer, the filled
+cells of each layer in drawing order, the objects of each object layer,
+and a table of tile images, properties, hit boxes and animation frames. The file is stored
+in maps/.cache and keyed by a hash of the source files, so editing a map
+in Tiled recompiles it on the next load. The modification time and size
+of each source file are stored too: a load only hashes the sources when
+one of them has changed.
+
+Tile objects on an object layer (like "Moving Platforms") become sprites
+the way arcade.tilemap.process_layer made them, with change_x, change_y
+and the boundary_* properties set from the object. Anything the cache
+can't turn into sprites, like a tile without an image of its own or a
+shape object on a layer built as sprites, raises a ValueError rather than
+loading as an empty layer.
+
+Run this file directly to compile every level and compare load times:
+
+    python level_cache.py
+"""
+import base64
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+import threading
+import timeit
+import xml.etree.ElementTree as ElementTree
+import zlib
+
+import numpy as np
+
+import headless  # noqa: F401
+import arcade
+
+from constants import CACHE_DIRECTORY, LEVEL_MAX, TILE_SCALING
+from hit_box_cache import hit_boxes
+
+# Bump this when the compiled format changes, so old cache files are rebuilt
+LEVEL_CACHE_VERSION = 4
+
+# Tiled keeps tile flips in the top bits of each gid
+FLIPPED_HORIZONTALLY_FLAG = 0x80000000
+FLIPPED_VERTICALLY_FLAG = 0x40000000
+FLIPPED_DIAGONALLY_FLAG = 0x20000000
+GID_MASK = 0x1FFFFFFF
+
+# Object properties arcade sets on the sprite of a tile object
+SPRITE_OBJECT_PROPERTIES = ("change_x", "change_y",
+                            "boundary_left", "boundary_right", "boundary_bottom", "boundary_top")
+
+
+def level_map_name(level):
+    """ Path of the Tiled map for a level, by number or by test map name like "enemies" """
+    return f"maps/level_{level}.tmx"
+
+
+def _parse_properties(element):
+    """ Read a Tiled <properties> element into a dict, converting by type. """
+    properties = {}
+    if element is None:
+        return properties
+    for property_element in element.findall("property"):
+        property_type = property_element.get("type", "string")
+        value = property_element.get("value", property_element.text)
+        if property_type == "int":
+            value = int(value)
+        elif property_type == "float":
+            value = float(value)
+        elif property_type == "bool":
+            value = value == "true"
+        properties[property_element.get("name")] = value
+    return properties
+
+
+def _parse_hit_box(object_element, width, height):
+    """
+    Turn the first object of a tile's collision group into hit box points,
+    centred on the tile with y pointing up, the same way arcade does.
+    """
+    x = float(object_element.get("x", 0))
+    y = float(object_element.get("y", 0))
+    half_width = width / 2
+    half_height = height / 2
+
+    polygon = object_element.find("polygon")
+    if polygon is None:
+        polygon = object_element.find("polyline")
+    if polygon is not None:
+        points = []
+        for pair in polygon.get("points").split():
+            point_x, point_y = (float(value) for value in pair.split(","))
+            points.append([point_x + x - half_width, -(point_y + y - half_height)])
+        # A closed polyline repeats its first point
+        if points[0] == points[-1]:
+            points.pop()
+        return points
+
+    if object_element.get("width") is None or object_element.get("height") is None:
+        return None
+    object_width = float(object_element.get("width"))
+    object_height = float(object_element.get("height"))
+
+    if object_element.find("ellipse") is not None:
+        radius_x = object_width / 2
+        radius_y = object_height / 2
+        center_x = x + radius_x - half_width
+        center_y = y + radius_y - half_height
+        total_steps = 8
+        return [[radius_x * math.cos(step / total_steps * 2 * math.pi) + center_x,
+                 -(radius_y * math.sin(step / total_steps * 2 * math.pi) + center_y)]
+                for step in range(total_steps)]
+
+    start_x = x - half_width
+    start_y = -(y - half_height)
+    end_x = x + object_width - half_width
+    end_y = -(y + object_height - half_height)
+    return [[start_x, start_y], [end_x, start_y], [end_x, end_y], [start_x, end_y]]
+
+
+def _parse_tileset(tileset_element, first_gid, directory, tiles):
+    """ Add every tile of a tileset to the gid -> tile info table. """
+    for tile_element in tileset_element.findall("tile"):
+        image = tile_element.find("image")
+        if image is None:
+            # Tiles cut from one tileset image aren't supported. A layer
+            # using one fails in compile_level.
+            continue
+        width = int(image.get("width"))
+        height = int(image.get("height"))
+
+        properties = _parse_properties(tile_element.find("properties"))
+        if tile_element.get("type"):
+            properties['type'] = tile_element.get("type")
+
+        hit_box = None
+        object_group = tile_element.find("objectgroup")
+        if object_group is not None and object_group.find("object") is not None:
+            hit_box = _parse_hit_box(object_group.find("object"), width, height)
+
+        # [gid, duration in ms] of each animation frame
+        animation = None
+        animation_element = tile_element.find("animation")
+        if animation_element is not None:
+            animation = [[first_gid + int(frame.get("tileid")), int(frame.get("duration"))]
+                         for frame in animation_element.findall("frame")]
+
+        gid = first_gid + int(tile_element.get("id"))
+        tiles[gid] = {
+            "image": os.path.normpath(os.path.join(directory, image.get("source"))).replace(os.sep, "/"),
+            "width": width,
+            "height": height,
+            "properties": properties,
+            "hit_box": hit_box,
+            "animation": animation,
+        }
+
+
+def _parse_objects(object_group):
+    """
+    Read the objects of an object layer into dicts, in Tiled's pixel
+    coordinates (y pointing down, unscaled). Tile objects have their gid,
+    flip flags included, other objects a gid of None.
+    """
+    objects = []
+    for object_element in object_group.findall("object"):
+        gid = object_element.get("gid")
+        objects.append({
+            "name": object_element.get("name", ""),
+            "type": object_element.get("type", object_element.get("class", "")),
+            "x": float(object_element.get("x", 0)),
+            "y": float(object_element.get("y", 0)),
+            "width": float(object_element.get("width", 0)),
+            "height": float(object_element.get("height", 0)),
+            "rotation": float(object_element.get("rotation", 0)),
+            "gid": int(gid) if gid is not None else None,
+            "properties": _parse_properties(object_element.find("properties")),
+        })
+    return objects
+
+
+def _decode_layer(layer_element, width, height):
+    """ Decode a tile layer's <data> into a (height, width) gid grid. """
+    data = layer_element.find("data")
+    encoding = data.get("encoding")
+    compression = data.get("compression")
+
+    if encoding == "csv":
+        values = np.array([int(value) for value in data.text.replace("\n", "").split(",")],
+                          dtype=np.uint32)
+    elif encoding == "base64":
+        raw = base64.b64decode(data.text.strip())
+        if compression == "zlib":
+            raw = zlib.decompress(raw)
+        elif compression == "gzip":
+            raw = gzip.decompress(raw)
+        elif compression:
+            raise ValueError(f"Unsupported layer compression '{compression}'")
+        values = np.frombuffer(raw, dtype="<u4").astype(np.uint32)
+    else:
+        raise ValueError(f"Unsupported layer encoding '{encoding}'")
+
+    return values.reshape(height, width)
+
+
+def source_files(map_name):
+    """ The map file followed by every external tileset it uses. """
+    files = [map_name]
+    root = ElementTree.parse(map_name).getroot()
+    for tileset_element in root.findall("tileset"):
+        if tileset_element.get("source"):
+            files.append(os.path.normpath(os.path.join(os.path.dirname(map_name),
+                                                       tileset_element.get("source"))))
+    return files
+
+
+def source_hash(map_name):
+    """ Hash of the map and its tilesets. Changes whenever one of them is edited. """
+    digest = hashlib.sha1(f"level-cache-{LEVEL_CACHE_VERSION}".encode())
+    for file_name in source_files(map_name):
+        with open(file_name, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def source_stamps(file_names):
+    """ [file name, modification time in ns, size] of each file. Much cheaper than a hash. """
+    stamps = []
+    for file_name in file_names:
+        stat = os.stat(file_name)
+        stamps.append([file_name, stat.st_mtime_ns, stat.st_size])
+    return stamps
+
+
+# (map name, source stamps) -> source hash, so a map is hashed at most once
+# per process for each version of its files
+_source_hashes = {}
+
+
+def _is_current(map_name, meta):
+    """ True if a compiled level was built from the map and tilesets as they are now """
+    stamps = meta["source_stamps"]
+    try:
+        current = source_stamps([stamp[0] for stamp in stamps])
+    except OSError:
+        current = None
+    if current == stamps:
+        return True
+
+    # Touched but maybe not changed, like after a checkout
+    key = (map_name, repr(current))
+    digest = _source_hashes.get(key)
+    if digest is None:
+        digest = source_hash(map_name)
+        _source_hashes[key] = digest
+    return digest == meta["source_hash"]
+
+
+def cache_file_name(map_name):
+    """ Where the compiled copy of a map is kept """
+    base_name = os.path.splitext(os.path.basename(map_name))[0]
+    return os.path.join(CACHE_DIRECTORY, f"{base_name}.npz")
+
+
+def compile_level(map_name):
+    """
+    Compile a Tiled map and its tilesets into a cache file.
+
+    :returns: Path of the compiled file
+    """
+    root = ElementTree.parse(map_name).getroot()
+    width = int(root.get("width"))
+    height = int(root.get("height"))
+    map_directory = os.path.dirname(map_name)
+
+    tiles = {}
+    for tileset_element in root.findall("tileset"):
+        first_gid = int(tileset_element.get("firstgid"))
+        if tileset_element.get("source"):
+            tileset_name = os.path.join(map_directory, tileset_element.get("source"))
+            tileset_root = ElementTree.parse(tileset_name).getroot()
+            _parse_tileset(tileset_root, first_gid, os.path.dirname(tileset_name), tiles)
+        else:
+            _parse_tileset(tileset_element, first_gid, map_directory, tiles)
+
+    arrays = {}
+    layers = []
+    for index, layer_element in enumerate(root.findall("layer")):
+        grid = _decode_layer(layer_element, width, height)
+        # Filled cells in the order arcade creates them: rows from the top,
+        # left to right
+        rows, columns = np.nonzero(grid)
+        arrays[f"grid_{index}"] = grid
+        arrays[f"cells_{index}"] = np.stack([rows, columns], axis=1).astype(np.int32)
+        layers.append({
+            "name": layer_element.get("name"),
+            "opacity": float(layer_element.get("opacity", 1)),
+        })
+
+    object_layers = {}
+    object_opacity = {}
+    for object_group in root.findall("objectgroup"):
+        object_layers[object_group.get("name")] = _parse_objects(object_group)
+        object_opacity[object_group.get("name")] = float(object_group.get("opacity", 1))
+
+    # Every tile used has to be in the table, or its sprites can't be made
+    used = [(layer["name"], arrays[f"grid_{index}"][tuple(arrays[f"cells_{index}"].T)])
+            for index, layer in enumerate(layers)]
+    used += [(name, [tiled_object["gid"] for tiled_object in objects if tiled_object["gid"] is not None])
+             for name, objects in object_layers.items()]
+    for layer_name, gids in used:
+        for gid in set(int(gid) & GID_MASK for gid in gids):
+            if gid not in tiles:
+                raise ValueError(f"{map_name}: layer '{layer_name}' uses tile {gid}, which has no "
+                                 f"image of its own and can't be put in the level cache")
+
+    meta = {
+        "version": LEVEL_CACHE_VERSION,
+        "source_hash": source_hash(map_name),
+        "source_stamps": source_stamps(source_files(map_name)),
+        "width": width,
+        "height": height,
+        "tile_width": int(root.get("tilewidth")),
+        "tile_height": int(root.get("tileheight")),
+        "background_color": root.get("backgroundcolor"),
+        "layers": layers,
+        "object_layers": object_layers,
+        "object_opacity": object_opacity,
+        "tiles": {str(gid): tile for gid, tile in tiles.items()},
+    }
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+
+    # Write to a temporary file first, so a half written cache is never read
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    file_name = cache_file_name(map_name)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    temp_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_name, "wb") as file:
+        file.write(buffer.getvalue())
+    os.replace(temp_name, file_name)
+    return file_name
+
+
+class LevelMap:
+    """
+    A level loaded from the cache.
+    """
+
+    def __init__(self, map_name, arrays, meta):
+        self.map_name = map_name
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.tile_width = meta["tile_width"]
+        self.tile_height = meta["tile_height"]
+        self.background_color = meta["background_color"]
+        self.source_hash = meta["source_hash"]
+        self.tiles = {int(gid): tile for gid, tile in meta["tiles"].items()}
+
+        # Layer name -> gid grid, filled cells and opacity
+        self.grids = {}
+        self.cells = {}
+        self.opacity = {}
+        for index, layer in enumerate(meta["layers"]):
+            self.grids[layer["name"]] = arrays[f"grid_{index}"]
+            self.cells[layer["name"]] = arrays[f"cells_{index}"]
+            self.opacity[layer["name"]] = layer["opacity"]
+
+        # Object layer name -> list of object dicts
+        self.objects = meta["object_layers"]
+        self.opacity.update(meta["object_opacity"])
+
+        # Filled in by load_level
+        self.from_cache = False
+        self.load_time = 0.0
+
+        # Layer name -> baked chunk images, filled in by baked_layers
+        self.baked_chunks = {}
+
+
+def _read_cache(file_name):
+    """ Read a compiled level. Returns (arrays, meta), or None if it can't be read. """
+    try:
+        with np.load(file_name) as data:
+            arrays = {key: data[key] for key in data.files}
+    except (OSError, ValueError, zlib.error):
+        return None
+    meta = json.loads(arrays.pop("meta").tobytes().decode())
+    return arrays, meta
+
+
+def load_level(level):
+    """
+    Load a level, compiling it first if the cache is missing or out of date.
+
+    :returns: LevelMap
+    """
+    start_time = timeit.default_timer()
+    map_name = level_map_name(level)
+    file_name = cache_file_name(map_name)
+
+    from_cache = True
+    cached = _read_cache(file_name) if os.path.exists(file_name) else None
+    if cached is None or cached[1].get("version") != LEVEL_CACHE_VERSION \
+            or not _is_current(map_name, cached[1]):
+        from_cache = False
+        compile_level(map_name)
+        cached = _read_cache(file_name)
+
+    level_map = LevelMap(map_name, *cached)
+    level_map.from_cache = from_cache
+    level_map.load_time = timeit.default_timer() - start_time
+    return level_map
+
+
+def load_tile_textures(level_map):
+    """
+    Load the texture and hit box of every tile the level uses into arcade's
+    texture cache, so creating the sprites later doesn't touch the disk.
+    Safe to call from a worker thread.
+    """
+    gids = set()
+    for layer_name, cells in level_map.cells.items():
+        grid = level_map.grids[layer_name]
+        gids.update(grid[cells[:, 0], cells[:, 1]].tolist())
+
+    for objects in level_map.objects.values():
+        gids.update(tiled_object["gid"] for tiled_object in objects if tiled_object["gid"] is not None)
+
+    for gid in gids:
+        load_tile_texture(level_map, gid)
+        for frame_gid, _ in level_map.tiles[gid & GID_MASK]["animation"] or ():
+            load_tile_texture(level_map, frame_gid | (gid & ~GID_MASK))
+    hit_boxes.save()
+
+
+def load_tile_texture(level_map, gid):
+    """
+    Load the texture of one tile gid, flips included, the way its sprites
+    load it, and give it its hit box from the hit box cache.
+    """
+    tile = level_map.tiles[gid & GID_MASK]
+    texture = arcade.load_texture(tile["image"],
+                                  0,
+                                  0,
+                                  tile["width"],
+                                  tile["height"],
+                                  flipped_horizontally=bool(gid & FLIPPED_HORIZONTALLY_FLAG),
+                                  flipped_vertically=bool(gid & FLIPPED_VERTICALLY_FLAG),
+                                  flipped_diagonally=bool(gid & FLIPPED_DIAGONALLY_FLAG),
+                                  hit_box_algorithm="Simple")
+    hit_boxes.fill(texture)
+    return texture
+
+
+def create_tile_sprite(level_map, gid, scaling):
+    """ Create the sprite for one tile gid, flips included. """
+    tile = level_map.tiles[gid & GID_MASK]
+    if tile["animation"]:
+        # Frames keep the flips of the tile they animate
+        sprite = arcade.AnimatedTimeBasedSprite(scale=scaling)
+        sprite.frames = [arcade.AnimationKeyframe(frame_gid, duration,
+                                                  load_tile_texture(level_map, frame_gid | (gid & ~GID_MASK)))
+                         for frame_gid, duration in tile["animation"]]
+        sprite.texture = sprite.frames[0].texture
+        sprite.properties.update(tile["properties"])
+        return sprite
+
+    sprite = arcade.Sprite(tile["image"],
+                           scaling,
+                           0,
+                           0,
+                           tile["width"],
+                           tile["height"],
+                           flipped_horizontally=bool(gid & FLIPPED_HORIZONTALLY_FLAG),
+                           flipped_vertically=bool(gid & FLIPPED_VERTICALLY_FLAG),
+                           flipped_diagonally=bool(gid & FLIPPED_DIAGONALLY_FLAG),
+                           hit_box_algorithm="Simple")
+    sprite.properties.update(tile["properties"])
+    if tile["hit_box"]:
+        sprite.set_hit_box(tile["hit_box"])
+    return sprite
+
+
+def _object_sprite(level_map, tiled_object, opacity, scaling):
+    """ Create the sprite of a tile object, placed and set up like arcade does. """
+    sprite = create_tile_sprite(level_map, tiled_object["gid"], scaling)
+    sprite.width = width = tiled_object["width"] * scaling
+    sprite.height = height = tiled_object["height"] * scaling
+
+    # The object's x, y is its bottom left corner, and it turns around it
+    x = tiled_object["x"] * scaling
+    y = (level_map.height * level_map.tile_height - tiled_object["y"]) * scaling
+    rotation = -math.radians(tiled_object["rotation"])
+    sprite.position = (x + width / 2 * math.cos(rotation) - height / 2 * math.sin(rotation),
+                       y + width / 2 * math.sin(rotation) + height / 2 * math.cos(rotation))
+    sprite.angle = math.degrees(rotation)
+    if opacity < 1:
+        sprite.alpha = int(opacity * 255)
+
+    properties = tiled_object["properties"]
+    for name in SPRITE_OBJECT_PROPERTIES:
+        if name in properties:
+            setattr(sprite, name, float(properties[name]))
+    sprite.properties.update(properties)
+    if tiled_object["type"]:
+        sprite.properties["type"] = tiled_object["type"]
+    if tiled_object["name"]:
+        sprite.properties["name"] = tiled_object["name"]
+    return sprite
+
+
+def iter_layer_sprites(level_map, layer_name, scaling):
+    """
+    Create the sprites of a layer one at a time, in drawing order. An
+    object layer gives a sprite per tile object.
+    """
+    if layer_name in level_map.objects:
+        opacity = level_map.opacity[layer_name]
+        for tiled_object in level_map.objects[layer_name]:
+            if tiled_object["gid"] is None:
+                raise ValueError(f"{level_map.map_name}: object '{tiled_object['name']}' on layer "
+                                 f"'{layer_name}' is not a tile, so it can't be made into a sprite")
+            yield _object_sprite(level_map, tiled_object, opacity, scaling)
+        return
+
+    if layer_name not in level_map.cells:
+        return
+
+    grid = level_map.grids[layer_name]
+    opacity = level_map.opacity[layer_name]
+    cell_width = level_map.tile_width * scaling
+    cell_height = level_map.tile_height * scaling
+    cells = level_map.cells[layer_name]
+
+    # Hit boxes come from the cache rather than each texture's alpha
+    for gid in np.unique(grid[cells[:, 0], cells[:, 1]]).tolist():
+        load_tile_texture(level_map, gid)
+
+    for row, column in cells.tolist():
+        sprite = create_tile_sprite(level_map, int(grid[row, column]), scaling)
+        sprite.center_x = column * cell_width + sprite.width / 2
+        sprite.center_y = (level_map.height - row - 1) * cell_height + sprite.height / 2
+        if opacity < 1:
+            sprite.alpha = int(opacity * 255)
+        yield sprite
+
+
+def create_layer_sprites(level_map, layer_name, scaling, use_spatial_hash=None):
+    """
+    Build a SpriteList for a layer. Layers the map doesn't have come back
+    empty.
+    """
+    sprite_list = arcade.SpriteList(use_spatial_hash=use_spatial_hash)
+    for sprite in iter_layer_sprites(level_map, layer_name, scaling):
+        sprite_list.append(sprite)
+    return sprite_list
+
+
+def main():
+    """ Compile every level and compare cached loads against reading the TMX. """
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    for level in range(1, LEVEL_MAX + 1):
+        map_name = level_map_name(level)
+
+        start_time = timeit.default_timer()
+        my_map = arcade.tilemap.read_tmx(map_name)
+        for layer in my_map.layers:
+            arcade.tilemap.process_layer(my_map, layer.name, TILE_SCALING)
+        tmx_time = timeit.default_timer() - start_time
+
+        start_time = timeit.default_timer()
+        compile_level(map_name)
+        compile_time = timeit.default_timer() - start_time
+
+        start_time = timeit.default_timer()
+        level_map = load_level(level)
+        for layer_name in level_map.grids:
+            create_layer_sprites(level_map, layer_name, TILE_SCALING)
+        cached_time = timeit.default_timer() - start_time
+
+        print(f"Level {level}: read_tmx + process_layer {tmx_time * 1000:.1f} ms, "
+              f"compile {compile_time * 1000:.1f} ms, "
+              f"cached load {level_map.load_time * 1000:.1f} ms + sprites "
+              f"{(cached_time - level_map.load_time) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
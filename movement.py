@@ -0,0 +1,157 @@
+"""
+Player movement state machine
+
+The player is always in one of four states:
+
+    grounded    standing on a platform
+    jumping     in the air and going up
+    falling     in the air and not going up
+    climbing    on a ladder and off the ground
+
+Keys set the player's velocity when they are pressed or let go, not on
+every tick. After each physics step the machine looks at what the player
+touches, through the physics engine's memoized probes, and only does
+anything when that matters: it holds the climbing speed while on a ladder
+and launches a jump that is waiting for the player to land. Then it works
+out the new state and records every change of state as a transition, for
+the animation and sound code to react to.
+
+Anything that moves the player or sets its velocity outside the physics
+step (a reset, walls removed by a trigger) must call interrupt(), so the
+held keys are applied again on the next tick. A hazard that stops the
+player calls stop() instead: as in the original game, the player then
+stands still for one physics step before the held keys move it again.
+"""
+from constants import PLAYER_MOVEMENT_SPEED, PLAYER_JUMP_SPEED
+
+GROUNDED = "grounded"
+JUMPING = "jumping"
+FALLING = "falling"
+CLIMBING = "climbing"
+
+# Extra distance under the player a jump can start from
+JUMP_PROBE_DISTANCE = 10
+
+
+class PlayerMovement:
+    """
+    Movement state of the player, driven by key changes and contacts.
+    """
+
+    def __init__(self, player_sprite, physics_engine):
+        """
+        :param Sprite player_sprite: The player
+        :param PlatformerPhysicsEngine physics_engine: Engine moving the player
+        """
+        self.player_sprite = player_sprite
+        self.physics_engine = physics_engine
+
+        # Jumping again needs the jump key to be let go first
+        self.jump_needs_reset = False
+
+        # (left, right, up, down) last applied, None to apply the keys again
+        self._keys = None
+
+        # True to leave the player stopped for the next physics step
+        self._stopped = False
+
+        # (previous state, new state) for every change during the last tick
+        self.transitions = []
+
+        self.state = None
+        self._set_state(self._current_state())
+        self.transitions.clear()
+
+    def interrupt(self):
+        """ The player was moved or stopped from outside. Apply the keys again next tick. """
+        self._keys = None
+
+    def stop(self):
+        """ The player was stopped by a hazard. Keep it still for one tick, then apply the keys again. """
+        self._keys = None
+        self._stopped = True
+
+    def apply_inputs(self, inputs):
+        """
+        Set the player's velocity from the keys, if they changed. Call at
+        the start of every tick, before the physics step.
+
+        :param PlayerInputs inputs: Keys held down during this tick
+        :returns: True if the player jumped
+        """
+        self.transitions.clear()
+
+        if self._stopped:
+            self._stopped = False
+            return False
+
+        keys = (inputs.left, inputs.right, inputs.up, inputs.down)
+        if keys == self._keys:
+            return False
+        self._keys = keys
+
+        if not inputs.up:
+            self.jump_needs_reset = False
+        jumped = self._apply_vertical(inputs)
+
+        if inputs.right and not inputs.left:
+            self.player_sprite.change_x = PLAYER_MOVEMENT_SPEED
+        elif inputs.left and not inputs.right:
+            self.player_sprite.change_x = -PLAYER_MOVEMENT_SPEED
+        else:
+            self.player_sprite.change_x = 0
+        return jumped
+
+    def update(self, inputs):
+        """
+        React to the player's new contacts and work out its state. Call
+        after every physics step.
+
+        :param PlayerInputs inputs: Keys held down during this tick
+        :returns: True if the player jumped
+        """
+        jumped = self._apply_vertical(inputs)
+        self._set_state(JUMPING if jumped else self._current_state())
+        return jumped
+
+    def _apply_vertical(self, inputs):
+        """ Climb, or jump if one is waiting and the player is on the ground. """
+        engine = self.physics_engine
+        up = inputs.up and not inputs.down
+        down = inputs.down and not inputs.up
+
+        if engine.is_on_ladder():
+            # The engine stops the player when it bumps into something, so
+            # the climbing speed is set again every time
+            if up:
+                self.player_sprite.change_y = PLAYER_MOVEMENT_SPEED
+            elif down:
+                self.player_sprite.change_y = -PLAYER_MOVEMENT_SPEED
+            else:
+                self.player_sprite.change_y = 0
+        elif up and not self.jump_needs_reset and engine.can_jump(y_distance=JUMP_PROBE_DISTANCE):
+            self.player_sprite.change_y = PLAYER_JUMP_SPEED
+            self.jump_needs_reset = True
+            return True
+        return False
+
+    def _current_state(self):
+        """ State from what the player touches and which way it is going """
+        engine = self.physics_engine
+        if engine.can_jump():
+            return GROUNDED
+        if engine.is_on_ladder():
+            return CLIMBING
+        if self.player_sprite.change_y > 0:
+            return JUMPING
+        return FALLING
+
+    def _set_state(self, state):
+        """ Change state, recording the transition and setting the sprite's flags """
+        if state == self.state:
+            return
+        self.transitions.append((self.state, state))
+        self.state = state
+        self.player_sprite.can_jump = state != GROUNDED
+        self.player_sprite.is_on_ladder = state == CLIMBING
+        self.player_sprite.movement_state = state
@@ -0,0 +1,384 @@
+"""
+Platformer physics with static and moving platforms kept apart
+
+arcade's PhysicsEnginePlatformer takes one platform list and walks all of
+it every update looking for platforms to move. Our maps are almost all
+static tiles, so this engine keeps them in one list that never changes,
+looked up by grid cell through a TileGrid, and the few moving platforms in
+a small list of their own. Collision checks look at both, but only the
+moving list is updated each tick.
+
+Moving platform positions, speeds and boundaries are kept in NumPy arrays
+by PlatformArrays, so every platform is stepped and bounced at once.
+"""
+import math
+
+import numpy as np
+
+import arcade
+from arcade import check_for_collision, check_for_collision_with_list
+
+from profiler import profiler
+
+
+class PlatformerPhysicsEngine(arcade.PhysicsEnginePlatformer):
+    """
+    PhysicsEnginePlatformer that collides with a static and a moving
+    platform list.
+    """
+
+    def __init__(self, player_sprite, platforms, moving_platforms,
+                 gravity_constant=0.5, ladders=None, platform_grid=None, ladder_grid=None):
+        """
+        :param Sprite player_sprite: The moving sprite
+        :param SpriteList platforms: Platforms that never move. Should use a spatial
+                                   hash if there is no platform_grid.
+        :param SpriteList moving_platforms: Platforms with a change_x or change_y
+        :param float gravity_constant: Downward acceleration per tick
+        :param SpriteList ladders: Ladders the user can climb on
+        :param TileGrid platform_grid: Grid of platforms, to look them up by cell
+        :param TileGrid ladder_grid: Grid of ladders, to look them up by cell
+        """
+        super().__init__(player_sprite, platforms, gravity_constant, ladders)
+        self.moving_platforms = moving_platforms
+        self.platform_grid = platform_grid
+        self.ladder_grid = ladder_grid
+
+        # Number of times check_platforms has been called
+        self.collision_queries = 0
+
+        # Arrays for moving the moving platforms, made on the first update
+        self._platform_arrays = None
+
+        # Results of the ladder and ground probes, kept until the player or
+        # the platforms move. Kind -> ((version, player x, player y), result)
+        self._probes = {}
+        self._probe_version = 0
+
+        # How many times each kind of probe actually ran a collision query
+        self.probe_queries = {}
+
+    def check_platforms(self):
+        """ Return every platform, static or moving, the player is touching. """
+        self.collision_queries += 1
+        with profiler.phase("collisions"):
+            if self.platform_grid is not None:
+                hit_list = self.platform_grid.collisions(self.player_sprite)
+            else:
+                hit_list = check_for_collision_with_list(self.player_sprite, self.platforms)
+            if len(self.moving_platforms) > 0:
+                hit_list += check_for_collision_with_list(self.player_sprite, self.moving_platforms)
+        return hit_list
+
+    def invalidate_probes(self):
+        """ Forget the ladder and ground probes. Call when platforms or ladders are removed. """
+        self._probe_version += 1
+
+    def _probe(self, kind, query):
+        """
+        Result of a probe of the player's surroundings. query only runs if
+        the player or the platforms moved since this kind of probe last ran.
+        """
+        key = (self._probe_version, self.player_sprite.center_x, self.player_sprite.center_y)
+        cached = self._probes.get(kind)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        result = query()
+        self._probes[kind] = (key, result)
+        self.probe_queries[kind] = self.probe_queries.get(kind, 0) + 1
+        return result
+
+    def is_on_ladder(self):
+        """ Return True if the player is touching a ladder. """
+        return self._probe("ladder", self._touching_ladder)
+
+    def _touching_ladder(self):
+        """ Ladder probe, without the cache """
+        if self.ladder_grid is None:
+            return super().is_on_ladder()
+        with profiler.phase("collisions"):
+            return len(self.ladder_grid.collisions(self.player_sprite)) > 0
+
+    def _platform_below(self, y_distance):
+        """ Ground probe, without the cache: is there a platform y_distance under the player? """
+        # Move down to see if we are on a platform
+        player = self.player_sprite
+        original_y = player.center_y
+        player.center_y = original_y - y_distance
+
+        # Check for wall hit
+        hit_list = self.check_platforms()
+
+        player.center_y = original_y
+        return len(hit_list) > 0
+
+    def can_jump(self, y_distance=5) -> bool:
+        """
+        Return True if there is a platform under the player.
+        """
+        on_platform = self._probe(f"ground {y_distance}", lambda: self._platform_below(y_distance))
+
+        if on_platform:
+            self.jumps_since_ground = 0
+
+        if on_platform or self.allow_multi_jump and self.jumps_since_ground < self.allowed_jumps:
+            return True
+        else:
+            return False
+
+    def update(self):
+        """
+        Move the player and the moving platforms, and resolve collisions.
+
+        :returns: List of platforms the player touched.
+        """
+
+        # --- Add gravity if we aren't on a ladder
+        if not self.is_on_ladder():
+            self.player_sprite.change_y -= self.gravity_constant
+
+        complete_hit_list = self._move_player()
+        self._move_platforms()
+
+        # Platforms may have moved, so earlier probes no longer hold
+        self.invalidate_probes()
+
+        return complete_hit_list
+
+    def _push_out(self):
+        """ Nudge the player out of a platform it is already stuck in. """
+        player = self.player_sprite
+        original_x = player.center_x
+        original_y = player.center_y
+
+        vary = 1
+        while True:
+            for x_offset, y_offset in ((0, 1), (0, -1), (1, 0), (-1, 0),
+                                       (1, 1), (1, -1), (-1, 1), (-1, -1)):
+                player.center_x = original_x + x_offset * vary
+                player.center_y = original_y + y_offset * vary
+                if len(self.check_platforms()) == 0:
+                    return
+            vary *= 2
+
+    def _move_player(self):
+        """
+        Move the player by its change_x and change_y, stopping at platforms
+        and walking up ramps. Same steps as arcade's platformer engine, but
+        checking both platform lists. The player never rotates, so rotation
+        is not handled.
+        """
+        player = self.player_sprite
+
+        # See if we are starting this turn with a sprite already colliding with us.
+        if len(self.check_platforms()) > 0:
+            self._push_out()
+
+        original_x = player.center_x
+        original_y = player.center_y
+
+        # --- Move in the y direction
+        player.center_y += player.change_y
+
+        # Check for wall hit
+        hit_list_y = self.check_platforms()
+        complete_hit_list = hit_list_y
+
+        # If we hit a wall, move so the edges are at the same point
+        if len(hit_list_y) > 0:
+            if player.change_y > 0:
+                while len(self.check_platforms()) > 0:
+                    player.center_y -= 1
+            elif player.change_y < 0:
+                for item in hit_list_y:
+                    while check_for_collision(player, item):
+                        player.center_y += 0.25
+
+                    # Ride along with moving platforms
+                    if item.change_x != 0:
+                        player.center_x += item.change_x
+
+            player.change_y = min(0.0, hit_list_y[0].change_y)
+
+        player.center_y = round(player.center_y, 2)
+
+        # --- Move in the x direction
+        if player.change_x:
+            # Keep track of our current y, used in ramping up
+            almost_original_y = player.center_y
+
+            # Strip off sign so we only have to write one version of this for
+            # both directions
+            direction = math.copysign(1, player.change_x)
+            cur_x_change = abs(player.change_x)
+            upper_bound = cur_x_change
+            lower_bound = 0
+            cur_y_change = 0
+
+            exit_loop = False
+            while not exit_loop:
+
+                # Move sprite and check for collisions
+                player.center_x = original_x + cur_x_change * direction
+                collision_check = self.check_platforms()
+
+                # Update collision list
+                for sprite in collision_check:
+                    if sprite not in complete_hit_list:
+                        complete_hit_list.append(sprite)
+
+                # Did we collide?
+                if len(collision_check) > 0:
+                    # We did collide. Can we ramp up and not collide?
+                    cur_y_change = cur_x_change
+                    player.center_y = original_y + cur_y_change
+
+                    collision_check = self.check_platforms()
+                    if len(collision_check) > 0:
+                        cur_y_change -= cur_x_change
+                    else:
+                        while len(collision_check) == 0 and cur_y_change > 0:
+                            cur_y_change -= 1
+                            player.center_y = almost_original_y + cur_y_change
+                            collision_check = self.check_platforms()
+                        cur_y_change += 1
+                        collision_check = []
+
+                    if len(collision_check) > 0:
+                        upper_bound = cur_x_change - 1
+                        if upper_bound - lower_bound <= 0:
+                            cur_x_change = lower_bound
+                            exit_loop = True
+                        else:
+                            cur_x_change = (upper_bound + lower_bound) // 2
+                    else:
+                        exit_loop = True
+
+                else:
+                    # No collision. Keep this new position and exit
+                    lower_bound = cur_x_change
+                    if upper_bound - lower_bound <= 0:
+                        exit_loop = True
+                    else:
+                        cur_x_change = (upper_bound + lower_bound) // 2 + (upper_bound + lower_bound) % 2
+
+            player.center_x = original_x + cur_x_change * direction
+            player.center_y = almost_original_y + cur_y_change
+
+        return complete_hit_list
+
+    def _move_platforms(self):
+        """ Move the moving platforms and bounce them off their boundaries. """
+        if len(self.moving_platforms) == 0:
+            return
+        if self._platform_arrays is None or not self._platform_arrays.matches(self.moving_platforms):
+            self._platform_arrays = PlatformArrays(self.moving_platforms)
+        self._platform_arrays.step(self.player_sprite)
+
+
+def _boundaries(sprites, name):
+    """ One boundary of every sprite as an array, NaN where it isn't set """
+    return np.array([getattr(sprite, name) if getattr(sprite, name) is not None else np.nan
+                     for sprite in sprites], dtype=float)
+
+
+class PlatformArrays:
+    """
+    Position, speed and boundaries of a list of moving platforms, as arrays.
+
+    Each step moves every platform in x, pushes the player out of the way,
+    then moves every platform in y, bouncing off boundaries as it goes. This
+    is the same as arcade's one-platform-at-a-time loop, except that when
+    the player touches several moving platforms they all move before it is
+    pushed. Only platforms that moved are written back to their sprites.
+
+    The arrays are the real state of the platforms while the list doesn't
+    change, so change_x and change_y should not be set on the sprites
+    directly. Build a new PlatformArrays if they are.
+    """
+
+    def __init__(self, sprite_list):
+        self.sprites = list(sprite_list)
+        sprites = self.sprites
+
+        self.x = np.array([sprite.center_x for sprite in sprites], dtype=float)
+        self.y = np.array([sprite.center_y for sprite in sprites], dtype=float)
+        self.change_x = np.array([sprite.change_x for sprite in sprites], dtype=float)
+        self.change_y = np.array([sprite.change_y for sprite in sprites], dtype=float)
+
+        self.boundary_left = _boundaries(sprites, "boundary_left")
+        self.boundary_right = _boundaries(sprites, "boundary_right")
+        self.boundary_top = _boundaries(sprites, "boundary_top")
+        self.boundary_bottom = _boundaries(sprites, "boundary_bottom")
+
+        # Distance from the center to each side of the hit box. Platforms
+        # don't turn or scale, so these never change.
+        self.left_offset = self.x - np.array([sprite.left for sprite in sprites], dtype=float)
+        self.right_offset = np.array([sprite.right for sprite in sprites], dtype=float) - self.x
+        self.bottom_offset = self.y - np.array([sprite.bottom for sprite in sprites], dtype=float)
+        self.top_offset = np.array([sprite.top for sprite in sprites], dtype=float) - self.y
+
+    def matches(self, sprite_list):
+        """ True if these arrays still describe the sprites in sprite_list """
+        # Same sprites in the same order, not just as many of them. The
+        # arrays hold on to their sprites, so an id can't be reused.
+        return (len(sprite_list) == len(self.sprites)
+                and all(sprite is own for sprite, own in zip(sprite_list, self.sprites)))
+
+    def step(self, player_sprite):
+        """ Move every platform one tick and write the ones that moved back to their sprites. """
+        moving = (self.change_x != 0) | (self.change_y != 0)
+        if not moving.any():
+            return
+
+        # --- Move in the x direction, and bounce
+        x = self.x
+        change_x = self.change_x
+        x[moving] += change_x[moving]
+
+        hit = moving & (x - self.left_offset <= self.boundary_left)
+        x[hit] = self.boundary_left[hit] + self.left_offset[hit]
+        change_x[hit & (change_x < 0)] *= -1
+
+        hit = moving & (x + self.right_offset >= self.boundary_right)
+        x[hit] = self.boundary_right[hit] - self.right_offset[hit]
+        change_x[hit & (change_x > 0)] *= -1
+
+        # --- Push the player out of the way. Only platforms whose box
+        # overlaps the player's need the exact check.
+        candidates = moving & (x - self.left_offset <= player_sprite.right) \
+            & (x + self.right_offset >= player_sprite.left) \
+            & (self.y - self.bottom_offset <= player_sprite.top) \
+            & (self.y + self.top_offset >= player_sprite.bottom)
+        for index in np.flatnonzero(candidates).tolist():
+            platform = self.sprites[index]
+            platform.center_x = float(x[index])
+            if check_for_collision(player_sprite, platform):
+                if change_x[index] < 0:
+                    player_sprite.right = float(x[index] - self.left_offset[index])
+                if change_x[index] > 0:
+                    player_sprite.left = float(x[index] + self.right_offset[index])
+
+        # --- Move in the y direction, and bounce
+        y = self.y
+        change_y = self.change_y
+        y[moving] += change_y[moving]
+
+        hit = moving & (y + self.top_offset >= self.boundary_top)
+        y[hit] = self.boundary_top[hit] - self.top_offset[hit]
+        change_y[hit & (change_y > 0)] *= -1
+
+        hit = moving & (y - self.bottom_offset <= self.boundary_bottom)
+        y[hit] = self.boundary_bottom[hit] + self.bottom_offset[hit]
+        change_y[hit & (change_y < 0)] *= -1
+
+        # --- Write the moved platforms back to their sprites
+        sprites = self.sprites
+        indices = np.flatnonzero(moving)
+        for index, new_x, new_y, new_change_x, new_change_y in zip(
+                indices.tolist(), x[indices].tolist(), y[indices].tolist(),
+                change_x[indices].tolist(), change_y[indices].tolist()):
+            platform = sprites[index]
+            platform.position = new_x, new_y
+            platform.change_x = new_change_x
+            platform.change_y = new_change_y
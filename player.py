@@ -0,0 +1,72 @@
+"""
+Player character sprite
+"""
+import arcade
+
+from animation import Animator, animation_set
+from constants import CHARACTER_SCALING, RIGHT_FACING, LEFT_FACING
+from movement import GROUNDED, JUMPING, FALLING, CLIMBING
+
+# Clips of the player character
+PLAYER_ANIMATIONS = "maps/images/person/Person.json"
+
+
+class PlayerCharacter(arcade.Sprite):
+    """ Player Sprite"""
+
+    def __init__(self):
+
+        # Set up parent class
+        super().__init__()
+
+        # Default to face-right
+        self.character_face_direction = RIGHT_FACING
+
+        self.scale = CHARACTER_SCALING
+
+        # Track our state
+        self.jumping = False
+        self.climbing = False
+        self.is_on_ladder = False
+
+        # Set by PlayerMovement, one of GROUNDED, JUMPING, FALLING or CLIMBING
+        self.movement_state = GROUNDED
+
+        # Clips are shared by every player sprite. Starting on the idle
+        # clip sets the texture, and the hit box is based on it.
+        self.animator = Animator(self, animation_set(PLAYER_ANIMATIONS), "idle")
+
+        # Hit box will be set based on the first image used. If you want to specify
+        # a different hit box, you can do it like the code below.
+        # self.set_hit_box([[-22, -64], [22, -64], [22, 28], [-22, 28]])
+        # self.set_hit_box(self.texture.hit_box_points)
+
+    def update_animation(self, delta_time: float = 1 / 60):
+        animator = self.animator
+
+        # Figure out if we need to flip face left or right
+        if self.change_x < 0 and self.character_face_direction == RIGHT_FACING:
+            self.character_face_direction = LEFT_FACING
+        elif self.change_x > 0 and self.character_face_direction == LEFT_FACING:
+            self.character_face_direction = RIGHT_FACING
+        animator.face(self.character_face_direction)
+
+        # Climbing animation, which only moves while the player does
+        self.climbing = self.movement_state == CLIMBING
+        if self.climbing:
+            animator.play("climb")
+            if abs(self.change_y) > 1:
+                animator.update(delta_time)
+            return
+
+        # Jumping animation
+        self.jumping = self.movement_state == JUMPING
+        if self.jumping:
+            animator.play("jump")
+        elif self.movement_state == FALLING:
+            animator.play("fall")
+        elif self.change_x == 0:
+            animator.play("idle")
+        else:
+            animator.play("walk")
+            animator.update(delta_time)
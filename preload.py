@@ -0,0 +1,106 @@
+"""
+Background loading of the next level
+
+Loading a level stalls the game if it happens inside on_update. A
+LevelPreloader reads the compiled level and decodes its tile textures on a
+worker thread, then builds the sprite lists on the main thread a few
+milliseconds per frame. When the level is needed it is handed over
+already built.
+"""
+import threading
+import timeit
+
+from baked_layers import BAKED_LAYERS, load_baked_chunks
+from constants import PRELOAD_SLICE_TIME
+from level_cache import load_level, load_tile_textures
+from simulation import build_level_layers
+
+
+class LevelPreloader:
+    """
+    Loads one level in the background.
+    """
+
+    def __init__(self):
+        # Level being loaded, or None
+        self.level = None
+
+        # Filled in by the worker thread
+        self.level_map = None
+
+        # Sprite lists built so far, keyed by GameSimulation attribute
+        self.layers = None
+
+        self._thread = None
+        self._builder = None
+        self._built = False
+
+    def start(self, level):
+        """ Start loading a level. Anything loaded for another level is dropped. """
+        self.level = level
+        self.level_map = None
+        self.layers = {}
+        self._builder = None
+        self._built = False
+        self._thread = threading.Thread(target=self._load, args=(level,), daemon=True)
+        self._thread.start()
+
+    def _load(self, level):
+        """ Worker thread: read the level, warm the texture cache and bake its decoration. """
+        level_map = load_level(level)
+        load_tile_textures(level_map)
+        for layer_name in BAKED_LAYERS:
+            load_baked_chunks(level_map, layer_name)
+
+        # start() may have moved on to another level in the meantime
+        if self.level == level:
+            self.level_map = level_map
+
+    @property
+    def ready(self):
+        """ True once the level is completely built """
+        return self._built
+
+    def pump(self, time_budget=PRELOAD_SLICE_TIME):
+        """
+        Build sprites for the loaded level until time_budget seconds have
+        passed. Call once per frame from the main thread.
+        """
+        if self._built or self.level_map is None:
+            return
+
+        if self._builder is None:
+            self._builder = build_level_layers(self.level_map, self.layers)
+
+        end_time = timeit.default_timer() + time_budget
+        for _ in self._builder:
+            if timeit.default_timer() >= end_time:
+                return
+        self._built = True
+
+    def take(self, level):
+        """
+        Hand over a level, finishing any loading that is left.
+
+        :returns: (LevelMap, sprite lists) to pass to GameSimulation.setup,
+                  or None if this level was not being loaded.
+        """
+        if self.level != level or self._thread is None:
+            return None
+
+        self._thread.join()
+        if self.level_map is None:
+            # The worker failed, let the caller load it the slow way
+            self.level = None
+            return None
+
+        if not self._built:
+            self.pump(float("inf"))
+
+        preloaded = self.level_map, self.layers
+        self.level = None
+        self.level_map = None
+        self.layers = None
+        self._thread = None
+        self._builder = None
+        return preloaded
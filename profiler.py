@@ -0,0 +1,254 @@
+"""
+Per-phase frame profiler
+
+Time spent in each phase of a frame (the physics step, collision queries,
+triggers, animation, scrolling and every layer's draw) is added up while
+the frame runs, then stored in a ring buffer of the last PROFILER_FRAMES
+frames when the frame ends. From the ring buffer the profiler gives
+p50/p95/p99 per phase, keeps a copy of the slowest frame seen, draws a
+frame time graph and writes everything out as CSV or JSON to attach to bug
+reports.
+
+Phases can nest. "physics" includes the "collisions" it does, so phase
+times do not add up to the frame time.
+
+Time a phase with
+
+    with profiler.phase("physics"):
+        ...
+
+When the profiler is disabled phase() hands back a context that does
+nothing, so the calls can stay in place.
+"""
+import csv
+import json
+import os
+import time
+import timeit
+
+import numpy as np
+
+import arcade
+
+# Frames kept in the ring buffer
+PROFILER_FRAMES = 600
+
+# Where dump() writes its files
+PROFILE_DIRECTORY = "profiles"
+
+# Frame time the graph draws a line at, in seconds
+TARGET_FRAME_TIME = 1 / 60
+
+
+class _Phase:
+    """ Context manager that adds the time spent inside it to one phase. """
+
+    __slots__ = ("profiler", "name", "start_time")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, timeit.default_timer() - self.start_time)
+
+
+class _NoPhase:
+    """ Context manager that does nothing, for when the profiler is off. """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+class FrameProfiler:
+    """
+    Collects per-phase timings for every frame.
+    """
+
+    def __init__(self, capacity=PROFILER_FRAMES):
+        self.capacity = capacity
+        self.enabled = False
+
+        # Phase names, in the order they were first seen
+        self.phases = []
+
+        # Phase name -> seconds spent in it this frame, so far
+        self.current = {}
+
+        # Ring buffers: seconds per frame for the whole frame and per phase.
+        # Slot (frame_count - 1) % capacity holds the last frame.
+        self.frame_times = np.zeros(capacity)
+        self.samples = {}
+        self.frame_count = 0
+
+        # Time the last frame ended, to measure the whole frame
+        self.last_frame_end = None
+
+        # {"frame": number, "frame_time": seconds, "phases": {name: seconds}}
+        self.worst_frame = None
+
+        # Reused context managers, one per phase
+        self._phase_objects = {}
+
+    def phase(self, name):
+        """ Context manager timing one phase of the current frame. """
+        if not self.enabled:
+            return _NO_PHASE
+        phase = self._phase_objects.get(name)
+        if phase is None:
+            phase = _Phase(self, name)
+            self._phase_objects[name] = phase
+        return phase
+
+    def add(self, name, seconds):
+        """ Add time to a phase of the current frame. """
+        if not self.enabled:
+            return
+        if name not in self.samples:
+            self.phases.append(name)
+            self.samples[name] = np.zeros(self.capacity)
+        self.current[name] = self.current.get(name, 0.0) + seconds
+
+    def end_frame(self):
+        """ Store the current frame's timings. Call once at the end of every frame. """
+        now = timeit.default_timer()
+        if not self.enabled:
+            self.last_frame_end = now
+            return
+        frame_time = now - self.last_frame_end if self.last_frame_end is not None else 0.0
+        self.last_frame_end = now
+
+        slot = self.frame_count % self.capacity
+        self.frame_times[slot] = frame_time
+        for name, samples in self.samples.items():
+            samples[slot] = self.current.get(name, 0.0)
+        self.frame_count += 1
+
+        if self.worst_frame is None or frame_time > self.worst_frame["frame_time"]:
+            self.worst_frame = {
+                "frame": self.frame_count,
+                "frame_time": frame_time,
+                "phases": dict(self.current),
+            }
+        self.current.clear()
+
+    def reset(self):
+        """ Forget every frame recorded so far. """
+        self.phases = []
+        self.current = {}
+        self.frame_times[:] = 0
+        self.samples = {}
+        self.frame_count = 0
+        self.last_frame_end = None
+        self.worst_frame = None
+
+    def _ordered(self, values):
+        """ The filled part of a ring buffer, oldest frame first """
+        if self.frame_count < self.capacity:
+            return values[:self.frame_count]
+        slot = self.frame_count % self.capacity
+        return np.concatenate((values[slot:], values[:slot]))
+
+    def percentiles(self, name=None):
+        """
+        p50, p95 and p99 of a phase, or of the whole frame if name is None,
+        in seconds.
+        """
+        values = self.frame_times if name is None else self.samples.get(name)
+        if values is None or self.frame_count == 0:
+            return 0.0, 0.0, 0.0
+        p50, p95, p99 = np.percentile(self._ordered(values), (50, 95, 99))
+        return float(p50), float(p95), float(p99)
+
+    def summary(self):
+        """ Statistics for the frame and every phase, in milliseconds """
+        summary = {}
+        for name in ["frame"] + self.phases:
+            values = self._ordered(self.frame_times if name == "frame" else self.samples[name])
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            summary[name] = {
+                "mean_ms": float(values.mean()) * 1000,
+                "p50_ms": float(p50) * 1000,
+                "p95_ms": float(p95) * 1000,
+                "p99_ms": float(p99) * 1000,
+                "max_ms": float(values.max()) * 1000,
+            }
+        return summary
+
+    def write_csv(self, file_name):
+        """ Write one row per stored frame, with the time of every phase in milliseconds. """
+        first_frame = self.frame_count - len(self._ordered(self.frame_times)) + 1
+        columns = [self._ordered(self.frame_times)] + [self._ordered(self.samples[name])
+                                                        for name in self.phases]
+        with open(file_name, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["frame", "frame_ms"] + [f"{name}_ms" for name in self.phases])
+            for index, row in enumerate(zip(*columns)):
+                writer.writerow([first_frame + index] + [f"{value * 1000:.4f}" for value in row])
+
+    def write_json(self, file_name):
+        """ Write the summary, the worst frame and every stored frame. """
+        worst_frame = None
+        if self.worst_frame is not None:
+            worst_frame = {
+                "frame": self.worst_frame["frame"],
+                "frame_ms": self.worst_frame["frame_time"] * 1000,
+                "phases_ms": {name: seconds * 1000
+                              for name, seconds in self.worst_frame["phases"].items()},
+            }
+        data = {
+            "frames": self.frame_count,
+            "summary": self.summary(),
+            "worst_frame": worst_frame,
+            "samples_ms": {name: (self._ordered(self.samples[name]) * 1000).round(4).tolist()
+                           for name in self.phases},
+            "frame_ms": (self._ordered(self.frame_times) * 1000).round(4).tolist(),
+        }
+        with open(file_name, "w") as file:
+            json.dump(data, file, indent=1)
+
+    def dump(self, directory=PROFILE_DIRECTORY):
+        """
+        Write a CSV and a JSON file named after the current time.
+
+        :returns: (CSV file name, JSON file name)
+        """
+        os.makedirs(directory, exist_ok=True)
+        base_name = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S"))
+        self.write_csv(f"{base_name}.csv")
+        self.write_json(f"{base_name}.json")
+        return f"{base_name}.csv", f"{base_name}.json"
+
+    def draw_graph(self, left, bottom, width, height, scale=2 * TARGET_FRAME_TIME):
+        """
+        Draw the stored frame times as a line, oldest on the left. The top of
+        the graph is scale seconds, with a line at the target frame time.
+        """
+        values = self._ordered(self.frame_times)
+        arcade.draw_lrtb_rectangle_filled(left, left + width, bottom + height, bottom, (0, 0, 0, 160))
+        target_y = bottom + height * TARGET_FRAME_TIME / scale
+        arcade.draw_line(left, target_y, left + width, target_y, arcade.csscolor.GREEN, 1)
+        if len(values) < 2:
+            return
+        x = left + np.arange(len(values)) * (width / (self.capacity - 1))
+        y = bottom + np.minimum(values / scale, 1.0) * height
+        arcade.draw_line_strip(np.stack((x, y), axis=1).tolist(), arcade.csscolor.YELLOW, 1)
+
+
+# The one profiler the game, the simulation and the physics engine share
+profiler = FrameProfiler()
@@ -0,0 +1,205 @@
+"""
+Input recording and replay
+
+The simulation only depends on the level it starts on and the keys held
+down on each tick, so a session can be reproduced exactly from those. An
+InputRecorder stores the key state every time it changes, by tick number,
+and an InputReplay hands the same key states back one tick at a time.
+GameView can record while playing and play a recording back in the
+window, and replay_headless() runs it without one. Both give the same
+player trajectory, so a session can be profiled again after every change.
+
+Recording file layout, all little-endian:
+
+    header  4s magic, B version, B start level, H simulation rate, I ticks
+    change  I tick, B key bits       (repeated, one per change)
+
+Record or replay from the game with
+
+    python PlatformerGame.py --record session.rec
+    python PlatformerGame.py --replay session.rec
+
+or replay without a window with
+
+    python replay.py session.rec
+"""
+import argparse
+import hashlib
+import os
+import struct
+import timeit
+
+from constants import LEVEL_MAX, SIMULATION_RATE
+from simulation import GameSimulation, PlayerInputs, EVENT_GAME_OVER, EVENT_LEVEL_COMPLETE
+
+REPLAY_MAGIC = b"RPLY"
+REPLAY_VERSION = 1
+
+_HEADER = struct.Struct("<4sBBHI")
+_CHANGE = struct.Struct("<IB")
+
+# Bit for each key in a change record
+LEFT_BIT = 1
+RIGHT_BIT = 2
+UP_BIT = 4
+DOWN_BIT = 8
+
+
+def pack_inputs(inputs):
+    """ Key state of a PlayerInputs as bits """
+    return ((LEFT_BIT if inputs.left else 0) | (RIGHT_BIT if inputs.right else 0)
+            | (UP_BIT if inputs.up else 0) | (DOWN_BIT if inputs.down else 0))
+
+
+def unpack_inputs(bits, inputs):
+    """ Set a PlayerInputs from key bits """
+    inputs.left = bool(bits & LEFT_BIT)
+    inputs.right = bool(bits & RIGHT_BIT)
+    inputs.up = bool(bits & UP_BIT)
+    inputs.down = bool(bits & DOWN_BIT)
+
+
+class InputRecorder:
+    """
+    Records the keys held down on every simulation tick of a session.
+    """
+
+    def __init__(self, level):
+        """
+        :param int level: Level the session starts on
+        """
+        self.level = level
+
+        # Ticks stepped so far, across every level of the session
+        self.tick = 0
+
+        # (tick, key bits) every time the keys changed
+        self.changes = []
+        self._last_bits = None
+
+    def record(self, inputs):
+        """ Record the inputs for the next tick. Call once before every step. """
+        bits = pack_inputs(inputs)
+        if bits != self._last_bits:
+            self.changes.append((self.tick, bits))
+            self._last_bits = bits
+        self.tick += 1
+
+    def save(self, file_name):
+        """ Write the recording to a file. """
+        with open(file_name, "wb") as file:
+            file.write(_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.level, SIMULATION_RATE, self.tick))
+            for tick, bits in self.changes:
+                file.write(_CHANGE.pack(tick, bits))
+
+
+class InputReplay:
+    """
+    Plays back a recording one tick at a time.
+    """
+
+    def __init__(self, level, ticks, changes):
+        """
+        :param int level: Level the session starts on
+        :param int ticks: Number of ticks in the session
+        :param list changes: (tick, key bits) every time the keys changed
+        """
+        self.level = level
+        self.ticks = ticks
+        self.changes = changes
+
+        # Position in the playback
+        self.tick = 0
+        self._next_change = 0
+        self.inputs = PlayerInputs()
+
+    @classmethod
+    def load(cls, file_name):
+        """ Read a recording written by InputRecorder.save """
+        with open(file_name, "rb") as file:
+            data = file.read()
+
+        magic, version, level, rate, ticks = _HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(f"{file_name} is not a version {REPLAY_VERSION} recording")
+        if rate != SIMULATION_RATE:
+            raise ValueError(f"{file_name} was recorded at {rate} ticks per second, "
+                             f"the game runs at {SIMULATION_RATE}")
+
+        changes = list(_CHANGE.iter_unpack(data[_HEADER.size:]))
+        return cls(level, ticks, changes)
+
+    def rewind(self):
+        """ Start playing from the first tick again. """
+        self.tick = 0
+        self._next_change = 0
+        self.inputs.clear()
+
+    @property
+    def finished(self):
+        """ True once every recorded tick has been played """
+        return self.tick >= self.ticks
+
+    def next_inputs(self):
+        """ The inputs for the next tick """
+        while self._next_change < len(self.changes) \
+                and self.changes[self._next_change][0] <= self.tick:
+            unpack_inputs(self.changes[self._next_change][1], self.inputs)
+            self._next_change += 1
+        self.tick += 1
+        return self.inputs
+
+
+def replay_headless(replay):
+    """
+    Play a recording without a window, moving on between levels the same way
+    GameView does.
+
+    :returns: List of (level, x, y) of the player after every tick
+    """
+    simulation = GameSimulation()
+    simulation.setup(replay.level)
+
+    trajectory = []
+    while not replay.finished:
+        events = simulation.step(replay.next_inputs())
+        player_sprite = simulation.player_sprite
+        trajectory.append((simulation.level, player_sprite.center_x, player_sprite.center_y))
+
+        if EVENT_GAME_OVER in events:
+            break
+        if EVENT_LEVEL_COMPLETE in events:
+            if simulation.level >= LEVEL_MAX:
+                break
+            simulation.setup(simulation.level + 1)
+
+    return trajectory
+
+
+def trajectory_hash(trajectory):
+    """ Short hash of a trajectory, to compare two runs """
+    return hashlib.sha1(repr(trajectory).encode()).hexdigest()[:12]
+
+
+def main():
+    """ Main method """
+    parser = argparse.ArgumentParser(description="Play a recording without opening a window.")
+    parser.add_argument("recording")
+    args = parser.parse_args()
+
+    replay = InputReplay.load(args.recording)
+
+    # Map and image paths are relative to this file
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    start_time = timeit.default_timer()
+    trajectory = replay_headless(replay)
+    total_time = timeit.default_timer() - start_time
+
+    level, x, y = trajectory[-1] if trajectory else (replay.level, 0, 0)
+    print(f"{len(trajectory)} of {replay.ticks} ticks in {total_time:.2f} s, "
+          f"ended on level {level} at ({x:.2f}, {y:.2f}), trajectory {trajectory_hash(trajectory)}")
+
+
+if __name__ == "__main__":
+    main()
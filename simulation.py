@@ -0,0 +1,452 @@
+"""
+Headless game simulation
+
+Everything that decides what happens in a level lives here: the physics
+step, ladder and jump handling, coins and their triggers, enemies, the
+Don't Touch and Do Touch layers and the fall-off reset. Nothing in this module opens a
+window or touches OpenGL (sprite lists only need a GL context when they are
+drawn), so levels can be stepped on machines without a GPU.
+
+Run this file directly to step a level without a window:
+
+    python simulation.py --level 2 --ticks 20000
+"""
+import argparse
+import os
+import timeit
+
+import headless  # noqa: F401
+import arcade
+
+from atlas import load_atlas
+from baked_layers import BAKED_LAYERS, is_baked
+from constants import GRID_PIXEL_SIZE, TILE_SCALING, GRAVITY, PLAYER_START_X, PLAYER_START_Y
+from enemies import EnemySystem
+from hit_box_cache import hit_boxes
+from level_cache import load_level, iter_layer_sprites
+from movement import PlayerMovement
+from physics import PlatformerPhysicsEngine
+from player import PlayerCharacter
+from profiler import profiler
+from tile_grid import TileGrid
+
+# Events returned from GameSimulation.step, so the caller can play sounds
+# and switch views.
+EVENT_JUMP = "jump"
+EVENT_COIN = "coin"
+EVENT_PLAYER_RESET = "player_reset"
+EVENT_GAME_OVER = "game_over"
+EVENT_LEVEL_COMPLETE = "level_complete"
+
+# Sprite list attribute, Tiled layer name and whether the list uses a
+# spatial hash, for each layer of a level. Layers the player is checked
+# against are looked up through a TileGrid instead, and the moving
+# platforms are few and move every tick, so nothing needs arcade's hash.
+# The Background and Foreground lists stay empty when the layer has been
+# baked, as it is drawn from the baked chunks.
+LEVEL_LAYERS = (
+    ("wall_list", "Platforms", False),
+    ("moving_wall_list", "Moving Platforms", False),
+    ("foreground_list", "Foreground", None),
+    ("background_list", "Background", None),
+    ("ladder_list", "Ladders", False),
+    ("coin_list", "Coins", False),
+    ("dont_touch_list", "Don't Touch", False),
+    ("do_touch_list", "Do Touch", False),
+)
+
+# Layers the player is checked against, by sprite list attribute and Tiled
+# layer name. Each gets a TileGrid so the checks are cell lookups.
+GRID_LAYERS = (
+    ("wall_list", "Platforms"),
+    ("ladder_list", "Ladders"),
+    ("coin_list", "Coins"),
+    ("dont_touch_list", "Don't Touch"),
+    ("do_touch_list", "Do Touch"),
+)
+
+
+def build_level_layers(level_map, layers):
+    """
+    Build the sprite lists of a level into the layers dict, keyed by
+    attribute name. This is a generator that yields after every sprite,
+    so the work can be spread over several frames.
+    """
+    for attribute, layer_name, use_spatial_hash in LEVEL_LAYERS:
+        sprite_list = arcade.SpriteList(use_spatial_hash=use_spatial_hash)
+        layers[attribute] = sprite_list
+        if layer_name in BAKED_LAYERS and is_baked(level_map, layer_name):
+            continue
+        for sprite in iter_layer_sprites(level_map, layer_name, TILE_SCALING):
+            sprite_list.append(sprite)
+            yield
+
+
+class PlayerInputs:
+    """ State of the movement keys for one simulation tick """
+
+    def __init__(self, left=False, right=False, up=False, down=False):
+        self.left = left
+        self.right = right
+        self.up = up
+        self.down = down
+
+    def clear(self):
+        """ Release every key """
+        self.left = False
+        self.right = False
+        self.up = False
+        self.down = False
+
+
+class GameSimulation:
+    """
+    One level of the game, stepped one tick at a time.
+    """
+
+    def __init__(self):
+
+        # These are 'lists' that keep track of our sprites. Each sprite should
+        # go into a list.
+        self.coin_list = None
+        self.wall_list = None
+        self.moving_wall_list = None
+        self.foreground_list = None
+        self.background_list = None
+        self.dont_touch_list = None
+        self.do_touch_list = None
+        self.ladder_list = None
+        self.player_list = None
+        self.enemy_list = None
+
+        # Other level sprite lists with animated tiles in them
+        self.animated_lists = []
+
+        # Separate variable that holds the player sprite
+        self.player_sprite = None
+
+        # Sprites that move between ticks, and where they were at the start
+        # of the last tick. Used to draw them between two ticks.
+        self.moving_sprites = []
+        self.previous_positions = []
+        self.drawn_positions = None
+
+        # TileGrid of each of the GRID_LAYERS, by attribute
+        self.tile_grids = {}
+
+        # Walls that disappear when a coin or button of the same Type is
+        # collected, keyed by Type
+        self.trigger_index = {}
+
+        # Our 'physics' engine
+        self.physics_engine = None
+
+        # The player's PlayerMovement state machine
+        self.movement = None
+
+        # Every enemy of the level, moved in batches
+        self.enemies = None
+
+        # The LevelMap the level was built from
+        self.level_map = None
+
+        self.end_of_map = 0
+        self.background_color = None
+
+        # Level
+        self.level = 1
+
+        # Number of ticks stepped since setup
+        self.tick = 0
+
+        # Collision queries made by step, not counting the physics engine's
+        self.collision_queries = 0
+
+        # Keep track of the score
+        self.score = 0
+        self.tutorial_num = 0
+
+    def setup(self, level, preloaded=None):
+        """
+        Load a level and place the player at the start.
+
+        :param int level: Level number
+        :param tuple preloaded: (LevelMap, sprite lists) from a LevelPreloader,
+                                to skip loading the level here
+        """
+
+        # Tile and character textures come from the atlases
+        load_atlas()
+
+        # Updates the self.level variable to the game level
+        self.level = level
+        self.tick = 0
+        self.collision_queries = 0
+
+        # Keep track of the score
+        self.score = 3
+        self.tutorial_num = 0
+
+        # Create the Sprite lists
+        self.player_list = arcade.SpriteList()
+
+        # Set up the player, specifically placing it at these coordinates.
+        self.player_sprite = PlayerCharacter()
+
+        self.player_sprite.center_x = PLAYER_START_X
+        self.player_sprite.center_y = PLAYER_START_Y
+        self.player_list.append(self.player_sprite)
+
+        # --- Load in a map from the tiled editor ---
+        if preloaded is None:
+            # Read in the tiled map, compiled into the level cache
+            level_map = load_level(level)
+            start_time = timeit.default_timer()
+            layers = {}
+            for _ in build_level_layers(level_map, layers):
+                pass
+            sprite_time = timeit.default_timer() - start_time
+            print(f"Level {level}: map {'read from cache' if level_map.from_cache else 'compiled'} "
+                  f"in {level_map.load_time * 1000:.1f} ms, sprites built in {sprite_time * 1000:.1f} ms")
+        else:
+            level_map, layers = preloaded
+        self.level_map = level_map
+
+        # Keep any hit boxes worked out while building the sprites for next time
+        hit_boxes.save()
+
+        self.animated_lists = []
+        for attribute, _, _ in LEVEL_LAYERS:
+            setattr(self, attribute, layers[attribute])
+            if attribute != "coin_list" and any(isinstance(sprite, arcade.AnimatedTimeBasedSprite)
+                                                for sprite in layers[attribute]):
+                self.animated_lists.append(layers[attribute])
+
+        # Platforms never move, so they are drawn from a static buffer
+        self.wall_list.is_static = True
+
+        self.moving_sprites = [self.player_sprite] + list(self.moving_wall_list)
+        self.snap_interpolation()
+
+        # Calculate the right edge of the my_map in pixels
+        self.end_of_map = level_map.width * GRID_PIXEL_SIZE
+        self.background_color = level_map.background_color
+
+        self.build_trigger_index()
+
+        # Enemies come from the level's Enemies object layer
+        self.enemies = EnemySystem.from_level(level_map)
+        self.enemy_list = self.enemies.sprite_list
+
+        cell_size = level_map.tile_width * TILE_SCALING
+        self.tile_grids = {}
+        for attribute, layer_name in GRID_LAYERS:
+            self.tile_grids[attribute] = TileGrid(getattr(self, attribute), cell_size,
+                                                  level_map, layer_name)
+
+        # Create the 'physics engine'
+        self.physics_engine = PlatformerPhysicsEngine(self.player_sprite,
+                                                      self.wall_list,
+                                                      self.moving_wall_list,
+                                                      gravity_constant=GRAVITY,
+                                                      ladders=self.ladder_list,
+                                                      platform_grid=self.tile_grids["wall_list"],
+                                                      ladder_grid=self.tile_grids["ladder_list"])
+        self.movement = PlayerMovement(self.player_sprite, self.physics_engine)
+
+    def build_trigger_index(self):
+        """ Group the walls that have a Type property by that Type. """
+        self.trigger_index = {}
+        for wall_list in (self.wall_list, self.moving_wall_list):
+            for wall in wall_list:
+                if "Type" in wall.properties:
+                    trigger = int(wall.properties['Type'])
+                    self.trigger_index.setdefault(trigger, []).append(wall)
+
+    def fire_trigger(self, trigger):
+        """
+        Remove every wall with this Type. A removed wall with its own
+        'Trigger' property fires that Type next, so triggers can chain.
+        Each Type only fires once.
+        """
+        pending = [trigger]
+        while pending:
+            walls = self.trigger_index.pop(pending.pop(), [])
+            for wall in walls:
+                wall.remove_from_sprite_lists()
+                if "Trigger" in wall.properties:
+                    pending.append(int(wall.properties['Trigger']))
+
+        # The player may be standing on a wall that just went
+        self.physics_engine.invalidate_probes()
+        self.movement.interrupt()
+
+    def reset_player(self):
+        """ Put the player back at the start and take away one health. """
+        self.player_sprite.center_x = PLAYER_START_X
+        self.player_sprite.center_y = PLAYER_START_Y
+        self.score -= 1
+        self.snap_interpolation()
+        self.movement.interrupt()
+
+    def advance_tutorial(self, inputs, jumped, events):
+        """ Move the tutorial on once the player has walked, then jumped. """
+        if jumped:
+            if self.tutorial_num == 1:
+                self.tutorial_num += 1
+            events.append(EVENT_JUMP)
+        if inputs.left != inputs.right and self.tutorial_num == 0:
+            self.tutorial_num += 1
+
+    def step(self, inputs):
+        """
+        Advance the level by one tick.
+
+        :param PlayerInputs inputs: Keys held down during this tick
+        :returns: List of EVENT_* strings for things that happened this tick
+        """
+        events = []
+        self.tick += 1
+
+        # Remember where everything was, so drawing can blend between ticks
+        for position, sprite in zip(self.previous_positions, self.moving_sprites):
+            position[0] = sprite.center_x
+            position[1] = sprite.center_y
+
+        # Keys only change the player's velocity when they change
+        self.advance_tutorial(inputs, self.movement.apply_inputs(inputs), events)
+
+        # Move the player and the moving platforms with the physics engine
+        with profiler.phase("physics"):
+            self.physics_engine.update()
+            self.advance_tutorial(inputs, self.movement.update(inputs), events)
+
+        with profiler.phase("enemies"):
+            self.enemies.update()
+
+        # Coins, Don't Touch and Do Touch are each checked once a tick
+        self.collision_queries += 3
+
+        # See if we hit any coins
+        with profiler.phase("collisions"):
+            coin_hit_list = self.tile_grids["coin_list"].collisions(self.player_sprite)
+
+        # Loop through each coin we hit (if any) and remove it
+        with profiler.phase("triggers"):
+            for coin in coin_hit_list:
+
+                # Figure out how many points this coin is worth
+                if 'Type' not in coin.properties:
+                    print("Warning, collected an item without a Type property.")
+                else:
+                    trigger = int(coin.properties['Type'])
+                    print("Triggered:", trigger)
+                    self.fire_trigger(trigger)
+
+                # Remove the coin
+                coin.remove_from_sprite_lists()
+                events.append(EVENT_COIN)
+
+        # Did the player fall off the map?
+        if self.player_sprite.center_y < -100:
+            self.reset_player()
+            events.append(EVENT_PLAYER_RESET)
+            if self.score <= 0:
+                events.append(EVENT_GAME_OVER)
+
+        # Did the player touch something they should not?
+        with profiler.phase("collisions"):
+            touched = self.tile_grids["dont_touch_list"].collisions(self.player_sprite)
+        if not touched:
+            with profiler.phase("enemies"):
+                touched = self.enemies.touching(self.player_sprite)
+        if touched:
+            self.player_sprite.change_x = 0
+            self.player_sprite.change_y = 0
+            self.reset_player()
+            self.movement.stop()
+            events.append(EVENT_PLAYER_RESET)
+            if self.score <= 0:
+                events.append(EVENT_GAME_OVER)
+
+        # See if the user got to the end of the level
+        with profiler.phase("collisions"):
+            touched = self.tile_grids["do_touch_list"].collisions(self.player_sprite)
+        if touched:
+            events.append(EVENT_LEVEL_COMPLETE)
+
+        return events
+
+    def snap_interpolation(self):
+        """ Forget the previous tick, so teleports are not drawn as movement. """
+        self.previous_positions = [[sprite.center_x, sprite.center_y] for sprite in self.moving_sprites]
+
+    def begin_interpolation(self, alpha):
+        """
+        Move the moving sprites part of the way from their previous tick
+        position to their current one, for drawing. Call end_interpolation
+        after drawing to put them back.
+
+        :param float alpha: 0 is the previous tick, 1 is the current tick
+        """
+        self.drawn_positions = []
+        for position, sprite in zip(self.previous_positions, self.moving_sprites):
+            x = sprite.center_x
+            y = sprite.center_y
+            self.drawn_positions.append((x, y))
+            sprite.center_x = position[0] + (x - position[0]) * alpha
+            sprite.center_y = position[1] + (y - position[1]) * alpha
+
+    def end_interpolation(self):
+        """ Put the moving sprites back where the simulation left them. """
+        for (x, y), sprite in zip(self.drawn_positions, self.moving_sprites):
+            sprite.center_x = x
+            sprite.center_y = y
+        self.drawn_positions = None
+
+    def update_animation(self, delta_time):
+        """ Advance sprite animations. Only needed when the level is drawn. """
+        self.coin_list.update_animation(delta_time)
+        for sprite_list in self.animated_lists:
+            sprite_list.update_animation(delta_time)
+        self.player_list.update_animation(delta_time)
+
+
+def scripted_inputs(tick):
+    """ Simple input script for headless runs: run right and hop every second. """
+    return PlayerInputs(right=True, up=tick % 60 < 10)
+
+
+def run_headless(level, ticks):
+    """
+    Step a level without a window and return how many ticks ran per second.
+    """
+    simulation = GameSimulation()
+    simulation.setup(level)
+
+    start_time = timeit.default_timer()
+    for tick in range(ticks):
+        events = simulation.step(scripted_inputs(tick))
+        if EVENT_GAME_OVER in events or EVENT_LEVEL_COMPLETE in events:
+            simulation.setup(level)
+    total_time = timeit.default_timer() - start_time
+
+    return ticks / total_time
+
+
+def main():
+    """ Main method """
+    parser = argparse.ArgumentParser(description="Step a level without opening a window.")
+    parser.add_argument("--level", type=int, default=1)
+    parser.add_argument("--ticks", type=int, default=10000)
+    args = parser.parse_args()
+
+    # Map and image paths are relative to this file
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    ticks_per_second = run_headless(args.level, args.ticks)
+    print(f"Level {args.level}: {args.ticks} ticks, {ticks_per_second:.0f} ticks per second")
+
+
+if __name__ == "__main__":
+    main()
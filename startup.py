@@ -0,0 +1,98 @@
+"""
+Startup tracing
+
+Records how long the game takes to get going: importing its modules,
+opening the window, drawing the first frame (the splash screen) and each
+stage of asset loading behind it, up to the first frame of the menu. The
+trace starts when this module is imported, so PlatformerGame imports it
+before anything else. It only uses the standard library, to stay out of
+the import time it measures.
+
+Times are printed once the menu is drawn, and written as JSON with
+
+    python PlatformerGame.py --trace-startup startup.json
+"""
+import json
+import timeit
+
+
+class _StartupPhase:
+    """ Context manager that records the time spent inside it as one phase. """
+
+    __slots__ = ("trace", "name", "start_time")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.phases.append((self.name, timeit.default_timer() - self.start_time))
+
+
+class StartupTrace:
+    """
+    Times from the start of the game to points along the way, and how long
+    each loading phase took.
+    """
+
+    def __init__(self):
+        self.start_time = timeit.default_timer()
+
+        # (name, seconds since the start) of each point reached
+        self.marks = []
+
+        # (name, seconds) of each loading phase
+        self.phases = []
+
+        # Where finish() writes the trace, or None
+        self.file_name = None
+        self.finished = False
+
+    def mark(self, name):
+        """ Record reaching a point in the startup. """
+        self.marks.append((name, timeit.default_timer() - self.start_time))
+
+    def phase(self, name):
+        """ Context manager timing one loading phase. """
+        return _StartupPhase(self, name)
+
+    def elapsed(self, name):
+        """ Seconds from the start to a mark, or None if it wasn't reached """
+        for mark_name, seconds in self.marks:
+            if mark_name == name:
+                return seconds
+        return None
+
+    def report(self):
+        """ One line with every mark and phase, in milliseconds """
+        marks = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.marks)
+        phases = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases)
+        return f"Startup: {marks} (loading: {phases})"
+
+    def write_json(self, file_name):
+        """ Write the marks and phases in milliseconds. """
+        data = {
+            "marks_ms": {name: seconds * 1000 for name, seconds in self.marks},
+            "phases_ms": {name: seconds * 1000 for name, seconds in self.phases},
+        }
+        with open(file_name, "w") as file:
+            json.dump(data, file, indent=1)
+
+    def finish(self, name):
+        """ Record the last mark and report the trace. Does nothing after the first call. """
+        if self.finished:
+            return
+        self.finished = True
+        self.mark(name)
+        print(self.report())
+        if self.file_name is not None:
+            self.write_json(self.file_name)
+
+
+# The one trace of this run, started on import
+startup_trace = StartupTrace()
@@ -0,0 +1,171 @@
+"""
+Cached text drawing
+
+arcade.draw_text rasterizes the text with PIL the first time it sees it,
+keeps the result in a dict that is thrown away whole once it grows past
+5000 entries, and builds its cache key by formatting every argument into
+a string on every call. The menus and the game draw the same handful of
+labels every frame, so this keeps them in a small LRU of ready-to-draw
+sprite lists instead.
+
+Strings that change every frame, like the FPS and timings on the debug
+overlay, would miss any cache and fill it with throw-away entries. Those
+are drawn one character at a time from pre-rendered glyphs by GlyphText.
+"""
+from collections import OrderedDict
+
+import arcade
+
+DEFAULT_FONT = ('calibri', 'arial')
+
+# Most text sprites to keep before dropping the least recently drawn one
+TEXT_CACHE_SIZE = 128
+
+# Characters GlyphText renders up front
+GLYPH_CHARACTERS = "0123456789.,:-+%/()_ abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def _make_text_sprite(name, text, color, font_size, font_name):
+    """ Rasterize text into a sprite with a texture of its own. """
+    image = arcade.get_text_image(text=text,
+                                  text_color=color,
+                                  font_size=font_size,
+                                  font_name=font_name)
+    sprite = arcade.Sprite()
+    # The hit box is the whole image. The default one would scan the alpha
+    # of every pixel, and lines up the ink rather than the image edges.
+    sprite.texture = arcade.Texture(name, image, hit_box_algorithm="None")
+    sprite.width = image.width
+    sprite.height = image.height
+    return sprite
+
+
+class TextCache:
+    """
+    Least recently used cache of rendered text, keyed by
+    (text, font, size, color).
+    """
+
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.max_size = max_size
+
+        # key -> SpriteList holding the one text sprite
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, text, color, font_size=12, font_name=DEFAULT_FONT):
+        """ Get the sprite list for a piece of text, rendering it on a miss. """
+        key = (text, font_name, font_size, tuple(color))
+        sprite_list = self.entries.get(key)
+        if sprite_list is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return sprite_list
+
+        self.misses += 1
+        sprite_list = arcade.SpriteList()
+        sprite_list.append(_make_text_sprite(f"text-cache-{key}", text, color, font_size, font_name))
+        self.entries[key] = sprite_list
+
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+        return sprite_list
+
+    def draw(self, text, start_x, start_y, color, font_size=12, font_name=DEFAULT_FONT):
+        """
+        Draw text with its lower left corner at start_x, start_y. Takes the
+        same leading arguments as arcade.draw_text.
+        """
+        sprite_list = self.get(text, color, font_size, font_name)
+        sprite = sprite_list[0]
+        # Placed the way arcade.draw_text places its image
+        sprite.center_x = start_x + sprite.width / 2
+        sprite.center_y = start_y + sprite.height / 2
+        sprite_list.draw()
+
+    def clear(self):
+        """ Drop every cached text sprite. """
+        self.entries.clear()
+
+    def stats(self):
+        """ Hit and miss counts, for the debug overlay """
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class GlyphText:
+    """
+    Draws strings that change every frame from one pre-rendered sprite per
+    character, so nothing is rasterized while the string changes.
+
+    Characters are placed by the width of their own glyph, so spacing is a
+    little looser than text drawn as a whole. That is fine for numbers on
+    the debug overlay. Characters not in GLYPH_CHARACTERS draw as spaces.
+    Strings longer than max_length raise a ValueError.
+    """
+
+    def __init__(self, color, font_size=12, max_length=40,
+                 font_name=DEFAULT_FONT, characters=GLYPH_CHARACTERS):
+        self.max_length = max_length
+
+        self.glyphs = {}
+        self.sprite_list = arcade.SpriteList()
+
+        # One hidden sprite per glyph keeps every glyph in the sprite list's
+        # texture atlas, so swapping a character never rebuilds it.
+        for character in characters:
+            sprite = _make_text_sprite(f"glyph-{character}-{font_name}-{font_size}-{tuple(color)}",
+                                       character, color, font_size, font_name)
+            sprite.alpha = 0
+            self.glyphs[character] = sprite.texture
+            self.sprite_list.append(sprite)
+
+        self.space = self.glyphs[" "]
+
+        # PIL draws every glyph from the top of its image, so glyphs line up
+        # on a baseline when their tops do. Images are as tall as the ink
+        # of their glyph reaches down, so bottoms don't line up.
+        self.line_height = max(texture.height for texture in self.glyphs.values())
+
+        # The sprites that actually show the string, one per character
+        self.characters = []
+        for _ in range(max_length):
+            sprite = arcade.Sprite()
+            sprite.texture = self.space
+            sprite.width = self.space.width
+            sprite.height = self.space.height
+            self.characters.append(sprite)
+            self.sprite_list.append(sprite)
+
+    def draw(self, text, start_x, start_y):
+        """ Draw text with its lower left corner at start_x, start_y. """
+        if len(text) > self.max_length:
+            raise ValueError(f"{text!r} is longer than this GlyphText's max_length of {self.max_length}")
+        x = start_x
+        top = start_y + self.line_height
+        for index, sprite in enumerate(self.characters):
+            if index < len(text):
+                texture = self.glyphs.get(text[index], self.space)
+            else:
+                texture = self.space
+            if sprite.texture is not texture:
+                sprite.texture = texture
+                sprite.width = texture.width
+                sprite.height = texture.height
+            sprite.center_x = x + texture.width / 2
+            sprite.center_y = top - texture.height / 2
+            x += texture.width
+        self.sprite_list.draw()
+
+
+# The one text cache all the views share
+text_cache = TextCache()
@@ -0,0 +1,196 @@
+"""
+Tile-grid collision lookups
+
+Every tile of a level sits in one cell of a regular grid, so there is no
+need to search for the tiles near the player: the cells under the player's
+hit box are the only ones that can touch it. A TileGrid stores a layer's
+tiles in NumPy arrays by cell (occupancy, gid and the extents of each
+tile's hit box) and answers collision queries by looking at just those
+cells: the bounds of the cells under the player are tested in one go, and
+only the tiles they overlap are tested exactly.
+
+Most tiles have a rectangular hit box, and those are tested against the
+player's hit box with a separating axis test on the rectangle's sides and
+the player polygon's edges. Tiles with a custom, non-rectangular hit box
+(like the ConcreteElectric hazards) go through arcade's polygon test.
+Either way the answer is the same as arcade.check_for_collision_with_list:
+hit boxes that only touch along an edge do not collide.
+"""
+import math
+
+import numpy as np
+
+from arcade import check_for_collision
+
+from level_cache import GID_MASK
+
+
+def _hit_box_bounds(points):
+    """ left, right, bottom, top of a list of points """
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    return min(xs), max(xs), min(ys), max(ys)
+
+
+def _is_rectangle(points):
+    """ True if the points are the corners of an axis-aligned rectangle """
+    if len(points) != 4:
+        return False
+    return len({point[0] for point in points}) == 2 and len({point[1] for point in points}) == 2
+
+
+def _is_convex(points):
+    """ True if the polygon is convex, whichever way it winds """
+    sign = 0
+    count = len(points)
+    for index in range(count):
+        x1, y1 = points[index]
+        x2, y2 = points[(index + 1) % count]
+        x3, y3 = points[(index + 2) % count]
+        cross = (x2 - x1) * (y3 - y2) - (y2 - y1) * (x3 - x2)
+        if cross != 0:
+            if sign == 0:
+                sign = 1 if cross > 0 else -1
+            elif (cross > 0) != (sign > 0):
+                return False
+    return True
+
+
+def _polygon_overlaps_rectangle(points, left, right, bottom, top):
+    """
+    True if the inside of a convex polygon overlaps the inside of a
+    rectangle. The polygon's bounds must already overlap the rectangle.
+    """
+    corners = ((left, bottom), (right, bottom), (right, top), (left, top))
+    count = len(points)
+    for index in range(count):
+        x1, y1 = points[index]
+        x2, y2 = points[(index + 1) % count]
+        normal_x = y2 - y1
+        normal_y = x1 - x2
+        if normal_x == 0 or normal_y == 0:
+            # Axis-aligned edges are already covered by the bounds check
+            continue
+        polygon = [x * normal_x + y * normal_y for x, y in points]
+        rectangle = [x * normal_x + y * normal_y for x, y in corners]
+        if max(polygon) <= min(rectangle) or max(rectangle) <= min(polygon):
+            return False
+    return True
+
+
+class TileGrid:
+    """
+    The tiles of one layer, by grid cell.
+    """
+
+    def __init__(self, sprite_list, cell_size, level_map=None, layer_name=None):
+        """
+        :param SpriteList sprite_list: Tiles of the layer. They must not move.
+        :param float cell_size: Width and height of a grid cell, in pixels
+        :param LevelMap level_map: Map the layer was built from, for its size and gids
+        :param str layer_name: Tiled name of the layer
+        """
+        self.sprite_list = sprite_list
+        self.cell_size = cell_size
+
+        # Size the grid to the map, or to the tiles if there is no map
+        if level_map is not None:
+            self.rows = level_map.height
+            self.columns = level_map.width
+        else:
+            self.rows = self.columns = 0
+            for sprite in sprite_list:
+                self.columns = max(self.columns, math.ceil(sprite.right / cell_size))
+                self.rows = max(self.rows, math.ceil(sprite.top / cell_size))
+
+        # Rows count up from the bottom of the map, like world y
+        self.occupied = np.zeros((self.rows, self.columns), dtype=bool)
+        self.gids = np.zeros((self.rows, self.columns), dtype=np.uint32)
+        self.rectangular = np.zeros((self.rows, self.columns), dtype=bool)
+        # left, -right, bottom, -top of each tile's hit box, so one
+        # comparison against (right, -left, top, -bottom) tells whether a
+        # tile's bounds overlap a box. Empty cells never overlap.
+        self.extents = np.full((self.rows, self.columns, 4), np.inf)
+
+        if level_map is not None and layer_name in level_map.grids:
+            self.gids[:] = np.flipud(level_map.grids[layer_name]) & GID_MASK
+
+        # Sprites by cell, as nested lists since only the cells a query
+        # hits are read
+        self.sprites = [[None] * self.columns for _ in range(self.rows)]
+
+        # Tiles that don't fit in one cell of the grid, always checked
+        self.overflow = []
+
+        for sprite in sprite_list:
+            points = sprite.get_adjusted_hit_box()
+            if len(points) == 0:
+                continue
+            left, right, bottom, top = _hit_box_bounds(points)
+            column = math.floor(left / cell_size)
+            row = math.floor(bottom / cell_size)
+            if column != math.ceil(right / cell_size) - 1 or row != math.ceil(top / cell_size) - 1 \
+                    or not (0 <= row < self.rows and 0 <= column < self.columns) \
+                    or self.sprites[row][column] is not None:
+                self.overflow.append(sprite)
+                continue
+
+            self.occupied[row, column] = True
+            self.rectangular[row, column] = _is_rectangle(points)
+            self.extents[row, column] = left, -right, bottom, -top
+            self.sprites[row][column] = sprite
+
+    def _remove(self, row, column):
+        """ Empty a cell whose tile was removed from the layer """
+        self.occupied[row, column] = False
+        self.gids[row, column] = 0
+        self.rectangular[row, column] = False
+        self.extents[row, column] = np.inf
+        self.sprites[row][column] = None
+
+    def collisions(self, sprite):
+        """
+        Tiles whose hit box overlaps the sprite's, the same as
+        arcade.check_for_collision_with_list(sprite, sprite_list).
+        Tiles come back in grid order, bottom row first.
+        """
+        points = sprite.get_adjusted_hit_box()
+        if len(points) == 0:
+            return []
+        left, right, bottom, top = _hit_box_bounds(points)
+        convex = _is_convex(points)
+        cell_size = self.cell_size
+
+        first_column = max(math.floor(left / cell_size), 0)
+        last_column = min(math.ceil(right / cell_size) - 1, self.columns - 1)
+        first_row = max(math.floor(bottom / cell_size), 0)
+        last_row = min(math.ceil(top / cell_size) - 1, self.rows - 1)
+
+        hits = []
+        if first_row <= last_row and first_column <= last_column:
+            # Cells under the sprite whose tile's bounds overlap its bounds
+            rows = slice(first_row, last_row + 1)
+            columns = slice(first_column, last_column + 1)
+            overlapping = (self.extents[rows, columns] < (right, -left, top, -bottom)).all(axis=-1) \
+                & self.occupied[rows, columns]
+            cell_rows, cell_columns = overlapping.nonzero()
+
+            for row, column in zip((cell_rows + first_row).tolist(), (cell_columns + first_column).tolist()):
+                tile = self.sprites[row][column]
+                if self.sprite_list not in tile.sprite_lists:
+                    # Collected or triggered away since the grid was built
+                    self._remove(row, column)
+                    continue
+
+                if self.rectangular[row, column] and convex:
+                    tile_left, tile_right, tile_bottom, tile_top = self.extents[row, column].tolist()
+                    if _polygon_overlaps_rectangle(points, tile_left, -tile_right, tile_bottom, -tile_top):
+                        hits.append(tile)
+                elif check_for_collision(sprite, tile):
+                    hits.append(tile)
+
+        for tile in self.overflow:
+            if self.sprite_list in tile.sprite_lists and check_for_collision(sprite, tile):
+                hits.append(tile)
+
+        return hits